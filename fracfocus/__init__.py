@@ -111,6 +111,7 @@ def create_app(script_info=None):
                     "status": response.status,
                     "status_code": response.status_code,
                     "content_length": response.content_length,
+                    "compression": g.get("compression"),
                 },
             }
 
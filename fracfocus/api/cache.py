@@ -0,0 +1,645 @@
+""" Read-through cache of completion parameters, keyed by api number """
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import metrics
+import util
+
+logger = logging.getLogger(__name__)
+
+Record = Dict[str, Any]
+
+
+class CacheBackend(ABC):
+    """ Key/value store behind a CompletionCache.
+
+        Shared backends are visible to every worker process on a node, so one
+        worker's misses warm the cache for the others. """
+
+    shared = False
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    @abstractmethod
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """ Return the unexpired values of the keys that are cached """
+
+    @abstractmethod
+    def set_many(self, mapping: Dict[str, Any]):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        pass
+
+    @staticmethod
+    def dumps(value: Any) -> bytes:
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def loads(data: bytes) -> Any:
+        return pickle.loads(data)
+
+
+class LRUCache(CacheBackend):
+    """ In-process cache bounded by entry count and total size, evicting the least
+        recently used entries first. Entries also expire ttl seconds after they
+        are set. """
+
+    def __init__(self, maxsize: int = 100000, ttl: float = 3600, max_bytes: int = None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evictions = 0
+        self.nbytes = 0
+        self._data: OrderedDict[str, Tuple[float, int, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"LRUCache: {len(self)}/{self.maxsize} entries (ttl={self.ttl}s)"
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is None:
+                    continue
+                expires_at, _, value = entry
+                if expires_at <= now:
+                    self._pop(key)
+                    continue
+                self._data.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, mapping: Dict[str, Any]):
+        expires_at = time.monotonic() + self.ttl
+        # values are stored as is; the pickled size is only used for accounting
+        sizes = {k: len(self.dumps(v)) for k, v in mapping.items()}
+        with self._lock:
+            for key, value in mapping.items():
+                if key in self._data:
+                    self._pop(key)
+                self._data[key] = (expires_at, sizes[key], value)
+                self.nbytes += sizes[key]
+            while self._data and (
+                len(self._data) > self.maxsize
+                or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+            ):
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _pop(self, key: str):
+        _, size, _ = self._data.pop(key)
+        self.nbytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self), "bytes": self.nbytes, "evictions": self.evictions}
+
+
+class SQLiteCache(CacheBackend):
+    """ Cache stored in a SQLite database on local disk and shared by every
+        process that opens the same path.
+
+        Bounded by entry count and total size. When a write takes the cache over
+        either bound, expired entries are removed first, then the least recently
+        read. Read times are only refreshed once per touch_interval, so hot keys
+        don't turn every read into a write. """
+
+    shared = True
+    touch_interval = 60  # seconds
+
+    def __init__(
+        self,
+        path: str,
+        maxsize: int = 100000,
+        ttl: float = 3600,
+        max_bytes: int = None,
+        timeout: float = 5,
+    ):
+        self.path = path
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.timeout = timeout
+        self.evictions = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"SQLiteCache: {self.path} (ttl={self.ttl}s)"
+
+    def __len__(self) -> int:
+        return self.stats()["size"]
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """ Connect on first use in each process, so forked workers don't share a
+            connection """
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_cache_accessed_at ON cache (accessed_at)"
+            )
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        now = time.time()
+        found = {}
+        stale = []
+        with self._lock:
+            for chunk in util.chunks(keys, 500):  # stay under the bound parameter limit
+                chunk = list(chunk)
+                rows = self.conn.execute(
+                    f"SELECT key, value, accessed_at FROM cache WHERE key IN ({', '.join('?' * len(chunk))}) AND expires_at > ?",  # noqa
+                    chunk + [now],
+                )
+                for key, value, accessed_at in rows:
+                    found[key] = self.loads(value)
+                    if accessed_at < now - self.touch_interval:
+                        stale.append(key)
+            if stale:
+                self.conn.executemany(
+                    "UPDATE cache SET accessed_at = ? WHERE key = ?",
+                    [(now, key) for key in stale],
+                )
+        return found
+
+    def set_many(self, mapping: Dict[str, Any]):
+        now = time.time()
+        rows = []
+        for key, value in mapping.items():
+            data = self.dumps(value)
+            rows.append((key, data, len(data), now + self.ttl, now))
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",  # noqa
+                    rows,
+                )
+                self._evict(now)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self, now: float):
+        conn = self.conn
+        count, nbytes = conn.execute(
+            "SELECT count(*), total(size) FROM cache"
+        ).fetchone()
+        if count <= self.maxsize and (
+            self.max_bytes is None or nbytes <= self.max_bytes
+        ):
+            return
+
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        while True:
+            count, nbytes = conn.execute(
+                "SELECT count(*), total(size) FROM cache"
+            ).fetchone()
+            excess = count - self.maxsize
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                excess = max(excess, count // 10, 1)  # size of each entry varies
+            if excess <= 0 or count == 0:
+                return
+            conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",  # noqa
+                (excess,),
+            )
+            self.evictions += excess
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM cache")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            count, nbytes = self.conn.execute(
+                "SELECT count(*), total(size) FROM cache"
+            ).fetchone()
+        return {"size": count, "bytes": int(nbytes), "evictions": self.evictions}
+
+
+class RedisCache(CacheBackend):
+    """ Cache stored in Redis, or any server that speaks the Redis protocol,
+        shared by every process that connects to it.
+
+        Entries are written with the ttl as their expiry. Size is bounded by the
+        server: configure maxmemory with an lru eviction policy (volatile-lru or
+        allkeys-lru). Requires the redis extra.
+
+        Stats are read from the server's own counters rather than by visiting
+        keys, so they cover the whole database the url selects: give the cache
+        a database of its own (e.g. redis://host:6379/1) to count only its
+        entries. """
+
+    shared = True
+
+    def __init__(self, url: str, ttl: float = 3600, prefix: str = "fracfocus:cache:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError(
+                "The redis cache backend requires the redis package. Install the redis extra: pip install fracfocus[redis]"  # noqa
+            ) from e
+
+        self.url = url
+        self.ttl = ttl
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+
+    def __repr__(self):
+        return f"RedisCache: {self.prefix}* (ttl={self.ttl}s)"
+
+    def __len__(self) -> int:
+        return self.client.dbsize()
+
+    def keys(self) -> Iterable[bytes]:
+        """ Iterate over the keys of this cache, leaving other keys on the server
+            alone. Scans the whole keyspace, so only clear() uses it. """
+        return self.client.scan_iter(match=f"{self.prefix}*", count=1000)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.client.mget([self.prefix + k for k in keys])
+        return {k: self.loads(v) for k, v in zip(keys, values) if v is not None}
+
+    def set_many(self, mapping: Dict[str, Any]):
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(self.prefix + key, self.dumps(value), px=int(self.ttl * 1000))
+        pipe.execute()
+
+    def clear(self):
+        for chunk in util.chunks(self.keys(), 1000):
+            self.client.delete(*chunk)
+
+    def stats(self) -> Dict[str, int]:
+        """ Size is the number of keys in the selected database. Bytes and
+            evictions are server-wide, as the server only tracks them in total. """
+        pipe = self.client.pipeline(transaction=False)
+        pipe.dbsize()
+        pipe.info("memory")
+        pipe.info("stats")
+        size, memory, info = pipe.execute()
+        return {
+            "size": size,
+            "bytes": memory.get("used_memory", 0),
+            "evictions": info.get("evicted_keys", 0),
+        }
+
+
+class Throttled:
+    """ Calls func at most once per interval seconds, returning the last result
+        in between. If a call fails, the last result is kept. """
+
+    def __init__(self, func: Callable[[], Any], interval: float = 30):
+        self.func = func
+        self.interval = interval
+        self.value: Any = None
+        self._called_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def __call__(self) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            if self._called_at is not None and now - self._called_at < self.interval:
+                return self.value
+            self._called_at = now
+
+        try:
+            self.value = self.func()
+        except Exception as e:
+            logger.warning(f"Failed calling {self.func.__name__}: {e}")
+        return self.value
+
+
+class SingleFlight:
+    """ Coalesces concurrent calls that share a key into a single call.
+
+        The first caller for a key runs the function; callers arriving while it
+        is in flight wait for it and receive the same result, or the same
+        exception. Nothing is kept once the call returns. The locks and events
+        are looked up on the threading module when they are created, so they
+        cooperate with gevent once it has patched threading. Counts are reported
+        to metrics at most once per report_interval. """
+
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result: Any = None
+            self.error: Optional[BaseException] = None
+
+    def __init__(self, name: str = "completions", report_interval: float = 30):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight: Dict[Hashable, SingleFlight.Call] = {}
+        self._reported = {"calls": 0, "coalesced": 0}
+        self._lock = threading.Lock()
+        self._report = Throttled(self.report, interval=report_interval)
+
+    def __repr__(self):
+        return f"SingleFlight: {self.name} ({len(self._inflight)} in flight)"
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs) -> Any:
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = self.Call()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+            self._report()
+        return call.result
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
+
+    def report(self):
+        """ Post call and coalesced counts accumulated since the last report """
+        with self._lock:
+            counts = {"calls": self.calls, "coalesced": self.coalesced}
+            deltas = {k: v - self._reported[k] for k, v in counts.items()}
+            self._reported = counts
+
+        tags = {"singleflight": self.name}
+        for key, value in deltas.items():
+            if value:
+                metrics.post(f"singleflight.{key}", value, tags=tags)
+        logger.debug(f"{self.name}: {self.stats()}")
+
+
+def make_backend(
+    name: str = "memory",
+    maxsize: int = 100000,
+    ttl: float = 3600,
+    max_bytes: int = None,
+    path: str = None,
+    url: str = None,
+) -> CacheBackend:
+    """ Create a cache backend by name: memory, sqlite, or redis """
+    if name == "memory":
+        return LRUCache(maxsize=maxsize, ttl=ttl, max_bytes=max_bytes)
+    elif name == "sqlite":
+        return SQLiteCache(path, maxsize=maxsize, ttl=ttl, max_bytes=max_bytes)
+    elif name == "redis":
+        return RedisCache(url, ttl=ttl)
+    else:
+        raise ValueError(f"Unknown cache backend: {name}")
+
+
+class CompletionCache:
+    """ Caches completion parameter records per api14 in front of a loader with
+        the signature of completion_calcs.
+
+        A request for several wells is answered from the cached wells and the
+        loader is only asked for the rest. Wells without completion data are
+        cached too, so repeated requests for them don't reach the database.
+        Lookups by api10 additionally cache the api14s that belong to each api10.
+
+        Keys are namespaced by the dataset version, so entries cached before an
+        ingest are never served after it. The version is checked at most once per
+        check_interval, at which point hit and miss counts are also reported to
+        metrics from a background thread. When it changes, a private backend is cleared; entries of old
+        versions in a shared backend are left for eviction to remove, since other
+        workers may already be filling the cache for the new version. """
+
+    def __init__(
+        self,
+        loader: Callable[..., List[Record]],
+        backend: CacheBackend = None,
+        version: Callable[[], Optional[str]] = None,
+        check_interval: float = 30,
+        name: str = "completions",
+    ):
+        self.loader = loader
+        self.backend = backend if backend is not None else LRUCache()
+        self.get_version = version
+        self.check_interval = check_interval
+        self.name = name
+        self.version: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self._checked_at: Optional[float] = None
+        self._reported = {"hits": 0, "misses": 0}
+        self._reporter: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"CompletionCache: {self.name} ({self.backend})"
+
+    def api14_key(self, api14: str) -> str:
+        return f"{self.version}:api14:{api14}"
+
+    def api10_key(self, api10: str) -> str:
+        return f"{self.version}:api10:{api10}"
+
+    def completion_calcs(
+        self, api10s: List[str] = None, api14s: List[str] = None
+    ) -> List[Record]:
+        self.check()
+        if api10s:
+            return self.by_api10(util.dedupe(api10s))
+        elif api14s:
+            return self.by_api14(util.dedupe(api14s))
+        else:
+            raise ValueError(f"One of [api10, api14] must be specified")
+
+    def by_api14(self, api14s: List[str]) -> List[Record]:
+        cached = self.backend.get_many(self.api14_key(x) for x in api14s)
+        records = {
+            x: cached[self.api14_key(x)] for x in api14s if self.api14_key(x) in cached
+        }
+        misses = [x for x in api14s if x not in records]
+
+        if misses:
+            found = {r["api14"]: r for r in self.loader(api14s=misses)}
+            loaded = {x: found.get(x) for x in misses}
+            self.backend.set_many({self.api14_key(k): v for k, v in loaded.items()})
+            records.update(loaded)
+
+        self.count(len(api14s) - len(misses), len(misses))
+        return [records[x] for x in api14s if records[x] is not None]
+
+    def by_api10(self, api10s: List[str]) -> List[Record]:
+        index = self.backend.get_many(self.api10_key(x) for x in api10s)
+        members = [x for api14s in index.values() for x in api14s]
+        cached = self.backend.get_many(self.api14_key(x) for x in members)
+
+        groups: Dict[str, List[Record]] = {}
+        for api10 in api10s:
+            api14s = index.get(self.api10_key(api10))
+            if api14s is None:
+                continue
+            keys = [self.api14_key(x) for x in api14s]
+            if all(k in cached for k in keys):  # else a member has been evicted
+                groups[api10] = [cached[k] for k in keys]
+        misses = [x for x in api10s if x not in groups]
+
+        if misses:
+            loaded: Dict[str, List[Record]] = {x: [] for x in misses}
+            for record in self.loader(api10s=misses):
+                loaded.setdefault(record["api10"], []).append(record)
+            entries: Dict[str, Any] = {}
+            for api10, records in loaded.items():
+                entries[self.api10_key(api10)] = [r["api14"] for r in records]
+                entries.update({self.api14_key(r["api14"]): r for r in records})
+            self.backend.set_many(entries)
+            groups.update(loaded)
+
+        self.count(len(api10s) - len(misses), len(misses))
+        return [r for api10 in api10s for r in groups.get(api10, [])]
+
+    def count(self, hits: int, misses: int):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def clear(self):
+        self.backend.clear()
+
+    def check(self):
+        """ Clear the cache if the dataset version has changed and report metrics,
+            at most once per check_interval """
+        now = time.monotonic()
+        with self._lock:
+            if (
+                self._checked_at is not None
+                and now - self._checked_at < self.check_interval
+            ):
+                return
+            self._checked_at = now
+
+        if self.get_version is not None:
+            try:
+                version = self.get_version()
+            except Exception as e:
+                logger.warning(f"{self.name}: failed to check dataset version: {e}")
+            else:
+                if version != self.version:
+                    if self.version is not None:
+                        logger.info(
+                            f"{self.name}: dataset version changed ({self.version} -> {version}). Clearing cache."  # noqa
+                        )
+                    if not self.backend.shared:
+                        self.clear()
+                    self.version = version
+
+        self.report_in_background()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "version": self.version,
+            **self.backend.stats(),
+        }
+
+    def report_in_background(self):
+        """ Report from a daemon thread, so reading the backend's stats doesn't
+            hold up the request that happened to trigger the check. A report
+            that is still running is not started again. """
+        with self._lock:
+            if self._reporter is not None and self._reporter.is_alive():
+                return
+            self._reporter = threading.Thread(
+                target=self._report, name=f"{self.name}-report", daemon=True
+            )
+            self._reporter.start()
+
+    def _report(self):
+        try:
+            self.report()
+        except Exception as e:
+            logger.warning(f"{self.name}: failed to report cache metrics: {e}")
+
+    def report(self):
+        """ Post hit and miss counts accumulated since the last report """
+        with self._lock:
+            counts = {"hits": self.hits, "misses": self.misses}
+            deltas = {k: v - self._reported[k] for k, v in counts.items()}
+            self._reported = counts
+
+        tags = {"cache": self.name}
+        for key, value in deltas.items():
+            if value:
+                metrics.post(f"cache.{key}", value, tags=tags)
+        stats = self.stats()
+        metrics.post("cache.size", stats["size"], "gauge", tags)
+        metrics.post("cache.bytes", stats["bytes"], "gauge", tags)
+        logger.debug(f"{self.name}: {stats}")
@@ -1,39 +1,280 @@
 # pylint: disable=not-an-iterable, no-member, arguments-differ, invalid-name, no-value-for-parameter
-from typing import Dict, List, Tuple, Union, no_type_check
+from typing import Dict, Iterator, List, Optional, Tuple, Union, no_type_check
+import hashlib
 import logging
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Request, Response, jsonify, request, stream_with_context
 from flask_restful import Api, Resource
+from sqlalchemy import func
+from werkzeug.http import quote_etag
 
 import api.schema as schemas
-from api.models import Registry
+import util
+from api.cache import CompletionCache, SingleFlight, Throttled, make_backend
+from api.compression import compress_response
+from api.models import CompletionSummary, DatasetVersion, Registry, any_of
+from config import get_active_config
+from util.jsontools import dumps
 
 logger = logging.getLogger(__name__)
 
+conf = get_active_config()
+
 comp_blueprint = Blueprint("completions", __name__)
 api = Api(comp_blueprint)
-
-
-class Completion(Resource):
-    schema = schemas.CompletionParameterSchema(many=True)
-
+comp_blueprint.after_request(compress_response)
+
+
+def completion_model() -> Union[CompletionSummary, Registry]:
+    """ Serve precomputed completion parameters, or compute them from the registry
+        when the request includes live=true (for verification) """
+    if util.to_bool(request.args.get("live", False)):
+        return Registry
+    return CompletionSummary
+
+
+def current_version() -> Optional[str]:
+    """ The version stamp of the last ingest, falling back to the time the
+        completion summaries were last updated """
+    version = DatasetVersion.get()
+    if version is None:
+        updated_at = CompletionSummary.query.with_entities(
+            func.max(CompletionSummary.updated_at)
+        ).scalar()
+        version = updated_at.isoformat() if updated_at else None
+    return version
+
+
+dataset_version = Throttled(current_version, interval=conf.CACHE_CHECK_INTERVAL)
+
+cache = (
+    CompletionCache(
+        CompletionSummary.completion_calcs,
+        backend=make_backend(
+            conf.CACHE_BACKEND,
+            maxsize=conf.CACHE_MAX_SIZE,
+            ttl=conf.CACHE_TTL,
+            max_bytes=conf.CACHE_MAX_BYTES,
+            path=conf.CACHE_PATH,
+            url=conf.CACHE_REDIS_URL,
+        ),
+        version=dataset_version,
+        check_interval=conf.CACHE_CHECK_INTERVAL,
+    )
+    if conf.CACHE_ENABLED
+    else None
+)
+
+
+flight = (
+    SingleFlight(report_interval=conf.CACHE_CHECK_INTERVAL)
+    if conf.WEB_COALESCE_REQUESTS
+    else None
+)
+
+
+def completion_calcs(api10s: List[str] = None, api14s: List[str] = None) -> List[Dict]:
+    """ Look up completion parameters, sharing one lookup between concurrent
+        requests for the same wells """
+    model = completion_model()
+    if model is CompletionSummary and cache is not None:
+        calcs = cache.completion_calcs
+    else:
+        calcs = model.completion_calcs
+
+    if flight is None:
+        return calcs(api10s=api10s, api14s=api14s)
+
+    key = (model.__name__, tuple(api10s or []), tuple(api14s or []))
+    return flight.do(key, calcs, api10s=api10s, api14s=api14s)
+
+
+def read_version(cached: bool = True) -> Optional[str]:
+    """ The dataset version a response is read under. The cache only moves to a
+        new version once per check interval, so responses it serves are read
+        under its version, which can trail the latest one. """
+    if cached and cache is not None and completion_model() is CompletionSummary:
+        cache.check()
+        return cache.version
+    return dataset_version()
+
+
+def completion_etag(
+    api10s: List[str] = None, api14s: List[str] = None, cached: bool = True
+) -> str:
+    """ Tag a response by the wells requested and the dataset version they were
+        read from. Streamed responses aren't read through the cache, so they are
+        tagged with cached=False. """
+    key = "|".join(
+        [
+            str(read_version(cached)),
+            completion_model().__name__,
+            "api10" if api10s else "api14",
+            ",".join(api10s or api14s or []),
+        ]
+    )
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def validate_api(value, name: str = "api", lengths: Tuple[int, ...] = (10, 14)) -> str:
+    """ Return value as an api number, raising a ValueError if it isn't one of
+        the expected lengths """
+    value = str(value).strip().strip('"')
+    if len(value) not in lengths:
+        expected = " or ".join(str(x) for x in lengths)
+        raise ValueError(
+            f"{name} should have a length of {expected}. Received {value} with a length of {len(value)}."  # noqa
+        )
+    return value
+
+
+def parse_api_list(req: Request) -> Dict[str, List[str]]:
+    """ Read api numbers from a request body, grouped by api10 and api14.
+
+        Accepts a JSON list, a JSON object with api10 and/or api14 lists, or
+        newline-delimited text. Api numbers in a list are grouped by length.
+        Raises a ValueError if an api number isn't exactly 10 or 14 digits long,
+        or isn't the length of the list it was given in, rather than truncating
+        it. """
+    if req.is_json:
+        body = req.get_json()
+        if isinstance(body, dict):
+            return {
+                "api10": util.dedupe(
+                    [
+                        validate_api(x, "api10", (10,))
+                        for x in util.ensure_list(body.get("api10", []))
+                    ]
+                ),
+                "api14": util.dedupe(
+                    [
+                        validate_api(x, "api14", (14,))
+                        for x in util.ensure_list(body.get("api14", []))
+                    ]
+                ),
+            }
+        values = util.ensure_list(body)
+    else:
+        values = req.get_data(as_text=True).splitlines()
+
+    api10s: List[str] = []
+    api14s: List[str] = []
+    for value in values:
+        if not str(value).strip().strip('"'):
+            continue
+        value = validate_api(value)
+        if len(value) == 14:
+            api14s.append(value)
+        else:
+            api10s.append(value)
+    return {"api10": util.dedupe(api10s), "api14": util.dedupe(api14s)}
+
+
+class CompletionResource(Resource):
+    serialize = staticmethod(schemas.compile_serializer())
+
+    def completions(
+        self, api10s: List[str] = None, api14s: List[str] = None
+    ) -> Response:
+        """ Respond with the completion parameters of the requested wells, or with
+            304 Not Modified, without querying them, if the client's copy is
+            current. Streams the response if requested with stream=true or an
+            Accept header of application/x-ndjson. """
+        etag = completion_etag(
+            api10s=api10s, api14s=api14s, cached=not self.wants_stream()
+        )
+        headers = {
+            "ETag": quote_etag(etag, weak=True),
+            "Cache-Control": f"public, max-age={conf.WEB_CACHE_MAX_AGE}",
+        }
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304, headers=headers)
+
+        if self.wants_stream():
+            ids = {"api10": api10s or [], "api14": api14s or []}
+            return self.stream_response(ids, headers=headers)
+
+        result = completion_calcs(api10s=api10s, api14s=api14s)
+        body = {"data": [self.serialize(r) for r in result], "status": "success"}
+        return Response(dumps(body), mimetype="application/json", headers=headers)
+
+    @staticmethod
+    def wants_ndjson() -> bool:
+        return (
+            request.accept_mimetypes.best_match(
+                ["application/json", "application/x-ndjson"]
+            )
+            == "application/x-ndjson"
+        )
+
+    @classmethod
+    def wants_stream(cls) -> bool:
+        return util.to_bool(request.args.get("stream", False)) or cls.wants_ndjson()
+
+    def stream_response(
+        self, ids: Dict[str, List[str]], headers: Dict = None
+    ) -> Response:
+        """ Stream the results as newline-delimited JSON if the client accepts it,
+            otherwise as a single JSON document """
+        ndjson = self.wants_ndjson()
+        return Response(
+            stream_with_context(self.stream(completion_model(), ids, ndjson=ndjson)),
+            mimetype="application/x-ndjson" if ndjson else "application/json",
+            headers=headers,
+        )
+
+    def stream(
+        self,
+        model: Union[CompletionSummary, Registry],
+        ids: Dict[str, List[str]],
+        ndjson: bool = False,
+    ) -> Iterator[bytes]:
+        """ Iterate the results with a server-side cursor, serializing and sending
+            WEB_STREAM_CHUNK_SIZE rows at a time, so memory use doesn't grow with
+            the number of wells requested """
+        chunk_size = conf.WEB_STREAM_CHUNK_SIZE
+        groups = {k: v for k, v in ids.items() if v}
+        seen = set()  # a well can match both an api10 and an api14
+        sep = b""
+
+        if not ndjson:
+            yield b'{"data":['
+        for id_name, values in groups.items():
+            qry = model.completion_calcs_query(any_of(getattr(model, id_name), values))
+            serialize = schemas.compile_serializer(
+                [d["name"] for d in qry.column_descriptions]
+            )
+            for chunk in util.chunks(qry.yield_per(chunk_size), chunk_size):
+                records = [serialize(row) for row in chunk]
+                if len(groups) > 1:
+                    records = [r for r in records if r["api14"] not in seen]
+                    seen.update(r["api14"] for r in records)
+                if not records:
+                    continue
+                if ndjson:
+                    yield b"".join(dumps(r) + b"\n" for r in records)
+                else:
+                    yield sep + b",".join(dumps(r) for r in records)
+                    sep = b","
+        if not ndjson:
+            yield b'],"status":"success"}'
+
+
+class Completion(CompletionResource):
     def get(self, api: str) -> Tuple[Dict, int]:
         if len(api) == 10:
-            result = Registry.completion_calcs(api10s=[api])
+            return self.completions(api10s=[api])
         elif len(api) == 14:
-            result = Registry.completion_calcs(api14s=[api])
+            return self.completions(api14s=[api])
         else:
             msg = f"api should have a length of either 10 or 14. The passed parameter has a length of {len(api)} ({api})."  # noqa
             return (
                 {"status": msg},
                 400,
             )
-        return {"data": self.schema.dump(result), "status": "success"}, 200
 
 
-class Completion10(Resource):
-    schema = schemas.CompletionParameterSchema(many=True)
-
+class Completion10(CompletionResource):
     def get(self, api10: str) -> Tuple[Dict, int]:
         api10 = api10[:10]
 
@@ -43,13 +284,10 @@ class Completion10(Resource):
                 {"status": msg},
                 400,
             )
-        result = Registry.completion_calcs(api10s=[api10])
-        return {"data": self.schema.dump(result), "status": "success"}, 200
-
+        return self.completions(api10s=[api10])
 
-class Completion14(Resource):
-    schema = schemas.CompletionParameterSchema(many=True)
 
+class Completion14(CompletionResource):
     def get(self, api14: str) -> Tuple[Dict, int]:
 
         if len(api14) != 14:
@@ -58,13 +296,10 @@ class Completion14(Resource):
                 {"status": msg},
                 400,
             )
-        result = Registry.completion_calcs(api14s=[api14])
-        return {"data": self.schema.dump(result), "status": "success"}, 200
+        return self.completions(api14s=[api14])
 
 
-class Completions(Resource):
-    schema = schemas.CompletionParameterSchema(many=True)
-
+class Completions(CompletionResource):
     def get(self) -> Tuple[Dict, int]:  # type: ignore
         api10 = request.args.get("api10")
         api14 = request.args.get("api14")
@@ -77,8 +312,20 @@ class Completions(Resource):
         else:
             return {"status": "missing_argument"}, 400
 
-        result = Registry.completion_calcs(**{id_var: ids})
-        return {"data": self.schema.dump(result), "status": "success"}, 200
+        return self.completions(**{id_var: ids})
+
+    def post(self) -> Union[Response, Tuple[Dict, int]]:  # type: ignore
+        """ Completion parameters for a list of api numbers in the request body,
+            streamed back in chunks """
+        try:
+            ids = parse_api_list(request)
+        except ValueError as e:
+            return {"status": str(e)}, 400
+
+        if not any(ids.values()):
+            return {"status": "missing_argument"}, 400
+
+        return self.stream_response(ids)
 
 
 # class Completion(CompletionResource):
@@ -0,0 +1,237 @@
+""" Response compression negotiated from the client's Accept-Encoding """
+
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+import logging
+import time
+import zlib
+
+from flask import Response, g, request
+
+from config import get_active_config
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+conf = get_active_config()
+
+logger = logging.getLogger(__name__)
+
+
+class Codec(ABC):
+    """ A content-coding: one-shot compression for buffered bodies and an
+        incremental compressor for streamed ones """
+
+    name: str = ""
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        pass
+
+    @abstractmethod
+    def compressor(self):
+        pass
+
+    def stream(
+        self, chunks: Iterable[bytes], stats: Dict[str, Any] = None
+    ) -> Iterator[bytes]:
+        """ Compress a streamed body, flushing after every chunk so the client
+            receives each one as soon as it is produced. Running totals of the
+            bytes in and out and the cpu time spent compressing are kept in
+            stats, if given. """
+        stats = {} if stats is None else stats
+        stats.update(original_length=0, compressed_length=0, cpu_time=0.0)
+        compressor = self.compressor()
+
+        def measure(func, *args) -> bytes:
+            ts = time.thread_time()
+            data = func(*args)
+            stats["cpu_time"] += time.thread_time() - ts
+            stats["compressed_length"] += len(data)
+            return data
+
+        for chunk in chunks:
+            stats["original_length"] += len(chunk)
+            data = measure(self.flush, compressor, chunk)
+            if data:
+                yield data
+        yield measure(self.finish, compressor)
+
+    @abstractmethod
+    def flush(self, compressor, chunk: bytes) -> bytes:
+        pass
+
+    @abstractmethod
+    def finish(self, compressor) -> bytes:
+        pass
+
+
+class Gzip(Codec):
+    name = "gzip"
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        compressor = self.compressor()
+        return compressor.compress(data) + compressor.flush()
+
+    def compressor(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def flush(self, compressor, chunk: bytes) -> bytes:
+        return compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, compressor) -> bytes:
+        return compressor.flush()
+
+
+class Brotli(Codec):
+    name = "br"
+
+    def __init__(self, quality: int = 4):
+        self.quality = quality
+
+    def compress(self, data: bytes) -> bytes:
+        return brotli.compress(data, quality=self.quality)
+
+    def compressor(self):
+        return brotli.Compressor(quality=self.quality)
+
+    def flush(self, compressor, chunk: bytes) -> bytes:
+        return compressor.process(chunk) + compressor.flush()
+
+    def finish(self, compressor) -> bytes:
+        return compressor.finish()
+
+
+class Zstd(Codec):
+    name = "zstd"
+
+    def __init__(self, level: int = 3):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def compressor(self):
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+    def flush(self, compressor, chunk: bytes) -> bytes:
+        return compressor.compress(chunk) + compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self, compressor) -> bytes:
+        return compressor.flush()
+
+
+def available_codecs() -> Dict[str, Codec]:
+    """ The codecs whose libraries are installed, keyed by content-coding """
+    codecs: List[Codec] = [Gzip()]
+    if brotli is not None:
+        codecs.append(Brotli())
+    if zstandard is not None:
+        codecs.append(Zstd())
+    return {c.name: c for c in codecs}
+
+
+CODECS = available_codecs()
+
+
+def negotiate(encodings: List[str] = None) -> Optional[Codec]:
+    """ Select the codec the client accepts with the highest quality, breaking
+        ties by the server's order of preference """
+    encodings = [
+        e for e in (encodings or conf.WEB_COMPRESSION_ENCODINGS) if e in CODECS
+    ]
+    name = request.accept_encodings.best_match(encodings) if encodings else None
+    return CODECS.get(name) if name else None
+
+
+def is_compressible(response: Response) -> bool:
+    return (
+        200 <= response.status_code < 300
+        and response.status_code != 204
+        and "Content-Encoding" not in response.headers
+        and not response.direct_passthrough
+    )
+
+
+def summarize(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """ Add the compression ratio to stats and round its cpu time (seconds) """
+    stats["ratio"] = round(
+        stats["original_length"] / (stats["compressed_length"] or 1), 2
+    )
+    stats["cpu_time"] = round(stats["cpu_time"], 6)
+    return stats
+
+
+def log_when_closed(chunks: Iterator[bytes], stats: Dict[str, Any]) -> Iterator[bytes]:
+    """ Pass a streamed body through, logging its compression stats once the
+        stream is exhausted or closed by the server """
+    try:
+        yield from chunks
+    finally:
+        summarize(stats)
+        logger.info(
+            f"Compressed streamed response with {stats['encoding']}: "
+            f"{stats['original_length']} -> {stats['compressed_length']} bytes "
+            f"({stats['ratio']}x, {stats['cpu_time']}s cpu)",
+            extra={"compression": stats},
+        )
+
+
+def compress_response(response: Response, min_size: int = None) -> Response:
+    """ Compress the body of a response if the client accepts a supported
+        encoding and the body is larger than min_size bytes. Streamed bodies
+        have no size up front and are always compressed, chunk by chunk.
+
+        Results are recorded on g.compression for the response log. A streamed
+        body is still being produced when that is written, so its totals are
+        logged separately when the stream closes. """
+    if not conf.WEB_COMPRESSION_ENABLED or not is_compressible(response):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    codec = negotiate()
+    if codec is None:
+        return response
+
+    if response.is_streamed:
+        stats = {"encoding": codec.name, "streamed": True}
+        response.response = log_when_closed(
+            codec.stream(response.response, stats), stats
+        )
+        response.headers["Content-Encoding"] = codec.name
+        response.headers.pop("Content-Length", None)
+        g.compression = stats
+        return response
+
+    min_size = conf.WEB_COMPRESSION_MIN_SIZE if min_size is None else min_size
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    ts = time.thread_time()
+    compressed = codec.compress(data)
+    cpu_time = time.thread_time() - ts
+
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = codec.name
+    g.compression = summarize(
+        {
+            "encoding": codec.name,
+            "original_length": len(data),
+            "compressed_length": len(compressed),
+            "cpu_time": cpu_time,
+        }
+    )
+    return response
@@ -1,25 +1,35 @@
 # type: ignore
 
 from __future__ import annotations
-from typing import Dict, List, Union, Optional
+from typing import Dict, Iterable, Iterator, List, Union, Optional, Tuple
 from datetime import datetime, date
+from pathlib import Path
+import io
+import json
 import logging
 from timeit import default_timer as timer
 from enum import Enum
 
 
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import Boolean, Integer, literal, literal_column, not_, select, text
+from sqlalchemy.exc import DataError, IntegrityError
 from sqlalchemy.sql import func
 from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.dialects.postgresql import UUID
 
 # from sqlalchemy.sql.expression import Insert
 from sqlalchemy.dialects.postgresql.dml import Insert
 from sqlalchemy.sql import func
 
 import util.deco
+from config import get_active_config
 from fracfocus import db
 import metrics
 
+conf = get_active_config()
+
+HASH_COLUMN = "row_hash"  # content hash of the source row, when a table has one
+
 
 class Operation(Enum):
     INSERT = "insert"
@@ -40,6 +50,49 @@ class TimestampMixin(object):
 logger = logging.getLogger(__name__)
 
 
+class CopyStream(io.TextIOBase):
+    """ Read-only file-like object that lazily renders rows in PostgreSQL's COPY
+        text format, so rows can be streamed to the server without first building
+        the whole payload in memory.
+    """
+
+    _escapes = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+    def __init__(self, rows: Iterable[Tuple]):
+        self._lines = (self.format_row(row) for row in rows)
+        self._buffer = ""
+
+    @classmethod
+    def format_value(cls, value) -> str:
+        if value is None:
+            return "\\N"
+        if isinstance(value, bool):
+            return "t" if value else "f"
+        if isinstance(value, datetime):
+            return value.isoformat(sep=" ")
+        if isinstance(value, date):
+            return value.isoformat()
+        return str(value).translate(cls._escapes)
+
+    @classmethod
+    def format_row(cls, row: Tuple) -> str:
+        return "\t".join(cls.format_value(v) for v in row) + "\n"
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lines)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
 class CoreMixin(object):
     """Base class for sqlalchemy ORM tables containing mostly utility functions for accessing table properties and managing insert, update, and upsert operations.
     """
@@ -76,6 +129,24 @@ class CoreMixin(object):
 
         return list(cls.__table__.primary_key.columns.keys())
 
+    @classmethod
+    def dedupe_records(cls, records: List[Dict]) -> Tuple[List[Dict], int]:
+        """ Keep only the last record for each primary key, since an upsert can't
+            affect the same row twice in one statement. Returns the remaining
+            records and the number of duplicates dropped. """
+        names = cls.primary_key_names()
+        # uuids are compared case-insensitively, as the database does
+        lower = {n for n in names if isinstance(cls.__table__.c[n].type, UUID)}
+        latest: Dict[Tuple, Dict] = {}
+        for record in records:
+            key = tuple(
+                str(record.get(n)).lower() if n in lower else record.get(n)
+                for n in names
+            )
+            latest.pop(key, None)  # re-insert so the order follows the last copy
+            latest[key] = record
+        return list(latest.values()), len(records) - len(latest)
+
     @classmethod
     def persist_objects(cls, objects: List[db.Model]):
         cls.s.add_all(objects)
@@ -95,6 +166,72 @@ class CoreMixin(object):
             logger.info(e)
             cls.s.rollback()
 
+    @classmethod
+    def on_conflict(
+        cls,
+        stmt: Insert,
+        op_name: str,
+        exclude_cols: list = None,
+        update_on_conflict: bool = True,
+        ignore_on_conflict: bool = False,
+    ) -> Tuple[Insert, str]:
+        """ Append the configured ON CONFLICT clause to an insert statement """
+        exclude_cols = exclude_cols or []
+
+        # update these columns when a conflict is encountered
+        if ignore_on_conflict:
+            final_stmt = stmt.on_conflict_do_nothing(
+                constraint=cls.__table__.primary_key
+            )
+            op_name = op_name + "_ignore_on_conflict"
+        elif update_on_conflict:
+            on_conflict_update_cols = [
+                c.name
+                for c in cls.__table__.c
+                if c not in list(cls.__table__.primary_key.columns)
+                and c.name not in exclude_cols
+            ]
+            op_name = op_name + "_update_on_conflict"
+            # skip rows whose content hasn't changed, so they aren't rewritten
+            # (and their updated_at trigger doesn't fire)
+            where = None
+            if HASH_COLUMN in cls.__table__.c:
+                where = cls.__table__.c[HASH_COLUMN].is_distinct_from(
+                    getattr(stmt.excluded, HASH_COLUMN)
+                )
+            # append on conflict clause to insert statement
+            final_stmt = stmt.on_conflict_do_update(
+                constraint=cls.__table__.primary_key,
+                set_={k: getattr(stmt.excluded, k) for k in on_conflict_update_cols},
+                where=where,
+            )
+
+        else:
+            final_stmt = stmt
+        return final_stmt, op_name
+
+    @classmethod
+    def execute_counted(cls, stmt: Insert, n: int, conn=None) -> Dict[str, int]:
+        """ Execute an insert of n rows and count the rows it inserted, updated,
+            and left unchanged. Rows skipped by the ON CONFLICT clause aren't
+            returned by RETURNING, so they make up the difference. """
+        # xmax is 0 for a newly inserted row and nonzero for one updated on conflict
+        upsert = stmt.returning(
+            literal_column("xmax = 0", Boolean).label("inserted")
+        ).cte("upsert")
+        query = select(
+            [
+                func.count().filter(upsert.c.inserted),
+                func.count().filter(not_(upsert.c.inserted)),
+            ]
+        ).execution_options(autocommit=True)
+        inserted, updated = (conn or cls.s.bind.engine).execute(query).first()
+        return {
+            "inserted": inserted,
+            "updated": updated,
+            "unchanged": n - inserted - updated,
+        }
+
     @classmethod
     def core_insert(
         cls,
@@ -103,77 +240,212 @@ class CoreMixin(object):
         exclude_cols: list = None,
         update_on_conflict: bool = True,
         ignore_on_conflict: bool = False,
-    ):
-        op_name = "core_insert"
+    ) -> int:
+        """ Insert records in chunks of size and return the number loaded.
+
+            If the database refuses a chunk because of the data in it, the chunk
+            is bisected until the offending rows are isolated. They are written
+            to the dead-letter file with their errors and the rest of the chunk
+            is loaded. The load fails once COLLECTOR_MAX_REJECTS rows across all
+            the chunks have been rejected. """
         affected: int = 0
+        rejected: int = 0
         size = size or len(records)
-        exclude_cols = exclude_cols or []
         for chunk in util.chunks(records, size):
             ts = timer()
-            chunk = list(chunk)
-            stmt = Insert(cls).values(chunk)
+            chunk, duplicates = cls.dedupe_records(list(chunk))
+            counts = {"inserted": 0, "updated": 0, "unchanged": 0, "rejected": 0}
+            op_name = cls.insert_isolating(
+                chunk,
+                counts,
+                max_rejects=conf.COLLECTOR_MAX_REJECTS - rejected,
+                exclude_cols=exclude_cols,
+                update_on_conflict=update_on_conflict,
+                ignore_on_conflict=ignore_on_conflict,
+            )
+            counts["duplicates"] = duplicates
+            cls.persist()
+            exc_time = round(timer() - ts, 2)
+            n = len(chunk) + duplicates
+            cls.post_op_metrics(Operation.INSERT, op_name, n, exc_time, counts=counts)
+            affected += len(chunk) - counts["rejected"]
+            rejected += counts["rejected"]
 
-            # update these columns when a conflict is encountered
-            if ignore_on_conflict:
-                final_stmt = stmt.on_conflict_do_nothing(
-                    constraint=cls.__table__.primary_key
-                )
-                op_name = op_name + "_ignore_on_conflict"
-            elif update_on_conflict:
-                on_conflict_update_cols = [
-                    c.name
-                    for c in cls.__table__.c
-                    if c not in list(cls.__table__.primary_key.columns)
-                    and c.name not in exclude_cols
-                ]
-                op_name = op_name + "_update_on_conflict"
-                # append on conflict clause to insert statement
-                final_stmt = stmt.on_conflict_do_update(
-                    constraint=cls.__table__.primary_key,
-                    set_={
-                        k: getattr(stmt.excluded, k) for k in on_conflict_update_cols
-                    },
-                )
+        return affected
 
+    @classmethod
+    def insert_isolating(
+        cls,
+        records: List[Dict],
+        counts: Dict[str, int],
+        max_rejects: int = None,
+        **kwargs,
+    ) -> str:
+        """ Insert records in one statement, adding the outcome to counts. If the
+            statement fails because of a bad value or a violated constraint, retry
+            each half separately, down to single rows, which are rejected. A bad
+            row costs about 2 * log2(len(records)) extra statements.
+
+            Gives up (raising the error) after max_rejects rejected rows (default
+            COLLECTOR_MAX_REJECTS), since by then the problem is unlikely to be a
+            few bad rows. """
+        if max_rejects is None:
+            max_rejects = conf.COLLECTOR_MAX_REJECTS
+        stmt, op_name = cls.on_conflict(
+            Insert(cls).values(records), "core_insert", **kwargs
+        )
+        try:
+            for key, value in cls.execute_counted(stmt, len(records)).items():
+                counts[key] += value
+        except (DataError, IntegrityError) as e:
+            if len(records) == 1:
+                cls.reject(records[0], e)
+                counts["rejected"] += 1
+                if counts["rejected"] >= max_rejects:
+                    raise
             else:
-                final_stmt = stmt
-            try:
-                cls.s.bind.engine.execute(final_stmt)
-                cls.persist()
-                exc_time = round(timer() - ts, 2)
-                n = len(chunk)
-                cls.post_op_metrics(Operation.INSERT, op_name, n, exc_time)
-                affected += len(records)
-
-            except IntegrityError as ie:
-                logger.debug(ie.args[0])
-
-                # fragment and reprocess
-                if len(records) > 1:
-                    first_half = records[: len(records) // 2]
-                    second_half = records[len(records) // 2 :]
-                    cls.core_insert(
-                        records=first_half,
-                        size=len(first_half) // 4,
-                        update_on_conflict=update_on_conflict,
-                        ignore_on_conflict=ignore_on_conflict,
-                    )
-                    cls.core_insert(
-                        records=second_half,
-                        size=len(second_half) // 4,
-                        update_on_conflict=update_on_conflict,
-                        ignore_on_conflict=ignore_on_conflict,
-                    )
-            except Exception as e:
-                logger.error(e)
-                # import json
-                # from util.jsontools import ObjectEncoder
+                logger.debug(
+                    f"{cls.__table__.name}: isolating bad rows in {len(records)} records"
+                )
+                mid = len(records) // 2
+                cls.insert_isolating(records[:mid], counts, max_rejects, **kwargs)
+                cls.insert_isolating(records[mid:], counts, max_rejects, **kwargs)
+        return op_name
 
-                # with open(f"log/{datetime.now()}.json", "w") as f:
-                #     chunk.append({"err": e})
-                #     json.dump(chunk, f, cls=ObjectEncoder, indent=4)
+    @classmethod
+    def reject(cls, record: Dict, error: Exception):
+        """ Append a record the database refused, and why, to the table's
+            dead-letter file (newline-delimited json) """
+        path = Path(conf.COLLECTOR_DEAD_LETTER_PATH) / f"{cls.__table__.name}.ndjson"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        message = str(getattr(error, "orig", None) or error).strip().splitlines()
+        reason = message[0] if message else type(error).__name__
+        line = json.dumps(
+            {
+                "table": cls.__table__.name,
+                "error": reason,
+                "rejected_at": datetime.utcnow().isoformat(),
+                "record": record,
+            },
+            default=str,
+        )
+        with open(path, "a") as f:
+            f.write(line + "\n")  # one write, so concurrent workers don't interleave
+        logger.warning(f"{cls.__table__.name}: rejected record ({reason})")
 
-        return affected
+    @classmethod
+    def copy_rows(cls, records: List[Dict], columns: List[str]) -> Iterator[Tuple]:
+        """ Yield record values in column order, coercing floats bound for integer
+            columns the same way an INSERT's assignment cast would """
+        integer_cols = {
+            c.name for c in cls.__table__.c if isinstance(c.type, Integer)
+        }  # includes BigInteger
+        for record in records:
+            values = []
+            for name in columns:
+                value = record.get(name)
+                if name in integer_cols and isinstance(value, float):
+                    value = int(round(value))
+                values.append(value)
+            yield tuple(values)
+
+    @classmethod
+    def core_copy(
+        cls,
+        records: List[Dict],
+        exclude_cols: list = None,
+        update_on_conflict: bool = True,
+        ignore_on_conflict: bool = False,
+    ) -> int:
+        """ Bulk load records using COPY ... FROM STDIN.
+
+            The records are streamed into a temporary staging table (temporary
+            tables are never WAL-logged and are dropped at commit) and merged into
+            this table with a single INSERT ... SELECT ... ON CONFLICT statement.
+            Conflicts and duplicate keys are handled the same as in core_insert.
+        """
+        if not records:
+            return 0
+
+        ts = timer()
+        n = len(records)
+        batch = records
+        records, duplicates = cls.dedupe_records(records)
+        table = cls.__table__
+        quote = cls.s.bind.dialect.identifier_preparer.quote
+        staging_name = f"{table.name}_staging"
+
+        copy_cols = [c.name for c in table.c if c.name in records[0]]
+
+        # columns absent from the records get their defaults, as they would from an INSERT
+        default_cols = [
+            c
+            for c in table.c
+            if c.name not in copy_cols
+            and c.default is not None
+            and (c.default.is_clause_element or c.default.is_scalar)
+        ]
+
+        staging = db.Table(
+            staging_name,
+            db.MetaData(),
+            *[db.Column(name, table.c[name].type) for name in copy_cols],
+        )
+        query = select(
+            [staging.c[name] for name in copy_cols]
+            + [
+                c.default.arg if c.default.is_clause_element else literal(c.default.arg)
+                for c in default_cols
+            ]
+        )
+        stmt = Insert(cls).from_select(
+            copy_cols + [c.name for c in default_cols], query
+        )
+        final_stmt, op_name = cls.on_conflict(
+            stmt,
+            "core_copy",
+            exclude_cols=exclude_cols,
+            update_on_conflict=update_on_conflict,
+            ignore_on_conflict=ignore_on_conflict,
+        )
+
+        column_list = ", ".join(quote(name) for name in copy_cols)
+        dbapi = cls.s.bind.dialect.dbapi
+        try:
+            with cls.s.bind.engine.begin() as conn:
+                conn.execute(
+                    text(
+                        f"CREATE TEMPORARY TABLE {quote(staging_name)} ON COMMIT DROP AS "
+                        f"SELECT {column_list} FROM {quote(table.name)} WITH NO DATA"
+                    )
+                )
+                cursor = conn.connection.cursor()
+                cursor.copy_expert(
+                    f"COPY {quote(staging_name)} ({column_list}) FROM STDIN",
+                    CopyStream(cls.copy_rows(records, copy_cols)),
+                    size=conf.COLLECTOR_COPY_BUFFER_SIZE,
+                )
+                counts = cls.execute_counted(final_stmt, len(records), conn=conn)
+                counts["duplicates"] = duplicates
+        except Exception as e:
+            # COPY can't skip a bad row, so a batch with one goes through
+            # core_insert, which isolates it. It gets the batch as it was given,
+            # so its metrics count the duplicates too.
+            if not isinstance(
+                getattr(e, "orig", e), (dbapi.DataError, dbapi.IntegrityError)
+            ):
+                raise
+            logger.warning(f"{table.name}.core_copy: {e}. Retrying with core_insert.")
+            return cls.core_insert(
+                batch,
+                exclude_cols=exclude_cols,
+                update_on_conflict=update_on_conflict,
+                ignore_on_conflict=ignore_on_conflict,
+            )
+
+        exc_time = round(timer() - ts, 2)
+        cls.post_op_metrics(Operation.INSERT, op_name, n, exc_time, counts=counts)
+        return len(records)
 
     @classmethod
     def bulk_insert(cls, records: List[Dict], size: int = None):
@@ -241,21 +513,30 @@ class CoreMixin(object):
 
     @classmethod
     def post_op_metrics(
-        cls, method_type: Operation, method: str, n: int, exc_time: float
+        cls,
+        method_type: Operation,
+        method: str,
+        n: int,
+        exc_time: float,
+        counts: Dict[str, int] = None,
     ):
+        """ Post the size and timing of an operation. counts breaks n down by
+            outcome (e.g. inserted/updated/unchanged) and is posted as rows_{key}. """
         op_name = method_type.name.lower()
         tags = {"tablename": cls.__table__.name, "method": method}
         measurements = {
             f"{op_name}s": n,
             f"{op_name}_time": exc_time,
-            f"{op_name}s_per_second": n / exc_time or 1,
+            f"{op_name}s_per_second": n / (exc_time or 1),
         }
+        measurements.update({f"rows_{k}": v for k, v in (counts or {}).items()})
 
         for key, value in measurements.items():
             metrics.post(key, value, tags=tags)
 
+        detail = ", ".join(f"{v} {k}" for k, v in (counts or {}).items())
         logger.info(
-            f"{cls.__table__.name}.{method}: {op_name}ed {n} records ({exc_time}s)",
+            f"{cls.__table__.name}.{method}: {op_name}ed {n} records ({exc_time}s)"
+            + (f" ({detail})" if detail else ""),
             extra=measurements,
         )
-
@@ -1,25 +1,101 @@
 import logging
-from typing import Dict, List, Union
+import re
+import uuid
+from timeit import default_timer as timer
+from typing import Callable, Dict, Iterable, List, Optional, Union
 
-from sqlalchemy import case
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import any_, bindparam, case, exists, false
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, UUID, insert
+from sqlalchemy.engine import RowProxy
+from sqlalchemy.orm import Query
+from sqlalchemy.sql.expression import BinaryExpression
 from sqlalchemy.sql import func
 from sqlalchemy.types import Integer
 
 
-from api.mixins import CoreMixin
+from api.mixins import CoreMixin, Operation
+from api.statements import CachedStatement
+from config import get_active_config
 from fracfocus import db
 
+conf = get_active_config()
+
 
 logger = logging.getLogger(__name__)
 
 schema = "public"
 
 WATER_LBS_PER_GALLON = 8.33
-PROPPANT_REGEX = "sand|silica|propp|mesh"
+PROPPANT_REGEX = conf.COLLECTOR_PROPPANT_REGEX
+PROPPANT_PATTERN = re.compile(PROPPANT_REGEX, re.IGNORECASE)
+
+
+def is_proppant(ingredient_name: str = None) -> bool:
+    """ Classify an ingredient as a proppant by its name """
+    return bool(ingredient_name and PROPPANT_PATTERN.search(ingredient_name))
+
+
+def any_of(column: db.Column, values: Iterable = None) -> BinaryExpression:
+    """ Build column = ANY(:values), binding values as a single array parameter.
+        Unlike IN, the statement text doesn't grow with the number of values.
+        Without values, the parameter ({column}_values) is bound at execution. """
+    return column == any_(
+        bindparam(
+            f"{column.key}_values",
+            list(values) if values is not None else None,
+            type_=ARRAY(column.type),
+        )
+    )
+
+
+class CompletionCalcsMixin(object):
+    """ Looks up completion parameters by api10 or api14 with a statement that is
+        built and compiled once per id type. Models define the query as a
+        completion_calcs_query classmethod taking filter criteria. """
+
+    _statements: Dict[str, CachedStatement]
+    completion_calcs_query: Callable[..., Query]
+
+    @classmethod
+    def completion_calcs_statement(
+        cls, id_name: str, query: Callable[..., Query]
+    ) -> CachedStatement:
+        """ The statement built by query, filtered on id_name (api10 or api14),
+            with the ids bound as {id_name}_values """
+        if "_statements" not in cls.__dict__:
+            cls._statements = {}
+        if id_name not in cls._statements:
+            column = getattr(cls, id_name)
+            cls._statements[id_name] = CachedStatement(
+                f"{cls.__tablename__}_completion_calcs_{id_name}",
+                lambda: query(any_of(column)).statement,
+                prepare=conf.DATABASE_PREPARE_STATEMENTS,
+            )
+        return cls._statements[id_name]
+
+    @classmethod
+    def completion_calcs(
+        cls, api10s: List[str] = None, api14s: List[str] = None, stmt_only: bool = False
+    ) -> List[Dict[str, Union[str, int, float]]]:
+        """ Look up the completion parameters of the given wells """
+
+        if api10s:
+            id_name = "api10"
+            ids = api10s
+        elif api14s:
+            id_name = "api14"
+            ids = api14s
+        else:
+            raise ValueError(f"One of [api10, api14] must be specified")
+
+        stmt = cls.completion_calcs_statement(id_name, cls.completion_calcs_query)
+        if stmt_only:
+            return stmt.statement
+        result = stmt.execute(cls.s.connection(), **{f"{id_name}_values": list(ids)})
+        return [dict(x) for x in result]
 
 
-class Registry(CoreMixin, db.Model):
+class Registry(CompletionCalcsMixin, CoreMixin, db.Model):
     # ref: https://fracfocus.org/welcome/how-read-fracturing-record
     __tablename__ = "registry"
 
@@ -63,6 +139,10 @@ class Registry(CoreMixin, db.Model):
     ingredient_mass = db.Column(db.BigInteger())
     claimant_company = db.Column(db.String())
     disclosure_key = db.Column(UUID(as_uuid=True))
+    is_proppant = db.Column(
+        db.Boolean(), default=False, server_default=false(), nullable=False
+    )  # classified from ingredient_name at ingest time
+    row_hash = db.Column(db.String(32))  # content hash of the source row
 
     created_at = db.Column(
         db.DateTime(timezone=True), default=func.now(), nullable=False
@@ -71,19 +151,14 @@ class Registry(CoreMixin, db.Model):
         db.DateTime(timezone=True), default=func.now(), nullable=False,
     )
 
-    @classmethod
-    def completion_calcs(
-        cls, api10s: List[str] = None, api14s: List[str] = None, stmt_only: bool = False
-    ) -> List[Dict[str, Union[str, int, float]]]:
+    __table_args__ = (
+        db.Index("ix_registry_api14_is_proppant", api14, postgresql_where=is_proppant),
+    )
 
-        if api10s:
-            id_var = cls.api10
-            ids = api10s
-        elif api14s:
-            id_var = cls.api14
-            ids = api14s
-        else:
-            raise ValueError(f"One of [api10, api14] must be specified")
+    @classmethod
+    def completion_calcs_query(cls, *criterion) -> Query:
+        """ Build the completion parameter aggregation over the registry rows
+            matching criterion, one row per api14 """
 
         agg = (
             cls.query.with_entities(
@@ -94,8 +169,8 @@ class Registry(CoreMixin, db.Model):
                 func.sum(cls.percent_hf_job).label("hf_job_pct"),
                 func.max(cls.updated_at).label("updated_at"),
             )
-            .filter(cls.ingredient_name.op("~*")(PROPPANT_REGEX))
-            .filter(id_var.in_(ids))
+            .filter(cls.is_proppant)
+            .filter(*criterion)
             .group_by(cls.api14)
             .subquery()
         )
@@ -137,7 +212,226 @@ class Registry(CoreMixin, db.Model):
             .subquery()
         )
 
-        qry = cls.s.query(agg4)
-        if stmt_only:
-            return qry.statement
-        return [x._asdict() for x in qry.all()]
+        return cls.s.query(agg4)
+
+
+class CompletionSummary(CompletionCalcsMixin, CoreMixin, db.Model):
+    """ Completion parameters precomputed from the registry, one row per api14.
+        The collector refreshes the rows of each well it loads. """
+
+    __tablename__ = "completion_summary"
+
+    api14 = db.Column(db.String(14), primary_key=True)
+    api10 = db.Column(db.String(10), index=True)
+    total_base_water_volume = db.Column(db.BigInteger())
+    ingredient_mass = db.Column(db.Integer())
+    hf_job_pct = db.Column(db.Float())
+    water_mass = db.Column(db.Numeric())
+    prop_mass = db.Column(db.Float())
+    mass_diff_pct = db.Column(db.Float())
+    updated_at = db.Column(db.DateTime(timezone=True))
+
+    @classmethod
+    def completion_calcs_query(cls, *criterion) -> Query:
+        """ Select the summaries matching criterion """
+        return cls.query.with_entities(*cls.__table__.c).filter(*criterion)
+
+    @classmethod
+    def refresh(cls, api14s: Iterable[str] = None) -> int:
+        """ Recompute the summaries of the given wells from the registry, or of
+            every well if api14s is None. Returns the number of rows written.
+
+            Summaries are upserted, so workers refreshing the same well at once
+            don't collide on the primary key. Summaries of wells that no longer
+            have any proppant rows are deleted. """
+        ts = timer()
+        table = cls.__table__
+        criterion = []
+        orphaned = (
+            ~exists().where(Registry.api14 == table.c.api14).where(Registry.is_proppant)
+        )
+        delete = table.delete().where(orphaned)
+
+        if api14s is not None:
+            api14s = sorted({x for x in api14s if x})
+            if not api14s:
+                return 0
+            delete = delete.where(table.c.api14.in_(api14s))
+            criterion.append(Registry.api14.in_(api14s))
+
+        qry = Registry.completion_calcs_query(*criterion)
+        columns = [d["name"] for d in qry.column_descriptions]
+        upsert = insert(cls).from_select(columns, qry.statement)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[table.c.api14],
+            set_={c: upsert.excluded[c] for c in columns if c != "api14"},
+        )
+
+        with cls.s.bind.engine.begin() as conn:
+            n = conn.execute(upsert).rowcount
+            conn.execute(delete)
+
+        cls.post_op_metrics(
+            Operation.MERGE, "refresh", n, round(timer() - ts, 2),
+        )
+        return n
+
+
+class DatasetVersion(CoreMixin, db.Model):
+    """ Version stamp written at the end of each ingest, so readers can tell
+        when the data they have cached is stale """
+
+    __tablename__ = "dataset_version"
+
+    name = db.Column(db.String(), primary_key=True)
+    version = db.Column(db.String(), nullable=False)
+    updated_at = db.Column(
+        db.DateTime(timezone=True), default=func.now(), nullable=False
+    )
+
+    @classmethod
+    def get(cls, name: str = "registry") -> Optional[str]:
+        """ The current version of the named dataset """
+        return cls.s.query(cls.version).filter(cls.name == name).scalar()
+
+    @classmethod
+    def stamp(cls, name: str = "registry") -> str:
+        """ Record a new version of the named dataset """
+        version = uuid.uuid4().hex
+        stmt = insert(cls).values(name=name, version=version, updated_at=func.now())
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.name],
+            set_={"version": version, "updated_at": func.now()},
+        )
+        with cls.s.bind.engine.begin() as conn:
+            conn.execute(stmt)
+        logger.info(f"{cls.__tablename__}: {name} is now at version {version}")
+        return version
+
+
+class DownloadValidators(CoreMixin, db.Model):
+    """ ETag, Last-Modified, and Content-Length of the last download of each url
+        that was fully collected. Kept in the database because the collector
+        runs in a fresh container each time. """
+
+    __tablename__ = "download_validators"
+
+    url = db.Column(db.String(), primary_key=True)
+    validators = db.Column(JSONB(), nullable=False)
+    updated_at = db.Column(
+        db.DateTime(timezone=True), default=func.now(), nullable=False
+    )
+
+    @classmethod
+    def get(cls, url: str) -> Optional[Dict[str, str]]:
+        """ The validators recorded for url """
+        return cls.s.query(cls.validators).filter(cls.url == url).scalar()
+
+    @classmethod
+    def save(cls, url: str, validators: Dict[str, str]):
+        """ Record the validators of a download of url """
+        stmt = insert(cls).values(url=url, validators=validators, updated_at=func.now())
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.url],
+            set_={"validators": validators, "updated_at": func.now()},
+        )
+        with cls.s.bind.engine.begin() as conn:
+            conn.execute(stmt)
+
+
+class IngestLedger(CoreMixin, db.Model):
+    """ Progress of each file loaded by each collector run. A file's entry is
+        checkpointed after every committed write, so a run that dies part way
+        through can be resumed where it left off. """
+
+    __tablename__ = "ingest_ledger"
+
+    run_id = db.Column(db.String(32), primary_key=True)
+    file = db.Column(db.String(), primary_key=True)
+    file_hash = db.Column(db.String(), nullable=False)
+    status = db.Column(db.String(), nullable=False)  # running, success, or error
+    start_row = db.Column(db.Integer(), default=0, nullable=False)
+    last_row = db.Column(
+        db.Integer(), default=0, nullable=False
+    )  # source rows committed, counted from the top of the file
+    rows_read = db.Column(db.Integer(), default=0, nullable=False)
+    rows_written = db.Column(db.Integer(), default=0, nullable=False)
+    rows_rejected = db.Column(
+        db.Integer(), default=0, nullable=False
+    )  # sent to the database but not loaded (dead-lettered or duplicate keys)
+    error = db.Column(db.String())
+    seconds = db.Column(db.Float())
+    started_at = db.Column(
+        db.DateTime(timezone=True), default=func.now(), nullable=False
+    )
+    updated_at = db.Column(
+        db.DateTime(timezone=True), default=func.now(), nullable=False
+    )
+    finished_at = db.Column(db.DateTime(timezone=True))
+
+    __table_args__ = (db.Index("ix_ingest_ledger_file", "file", "file_hash"),)
+
+    @classmethod
+    def exists(cls) -> bool:
+        """ Whether the ingest_ledger table has been migrated into the database """
+        return cls.s.bind.engine.has_table(cls.__tablename__, schema=schema)
+
+    @classmethod
+    def latest(cls, file: str, file_hash: str) -> Optional[RowProxy]:
+        """ The most recent entry for this version of a file, from any run """
+        table = cls.__table__
+        stmt = (
+            table.select()
+            .where(table.c.file == file)
+            .where(table.c.file_hash == file_hash)
+            .order_by(table.c.updated_at.desc())
+            .limit(1)
+        )
+        with cls.s.bind.engine.connect() as conn:
+            return conn.execute(stmt).first()
+
+    @classmethod
+    def start(
+        cls, run_id: str, file: str, file_hash: str, start_row: int = 0
+    ) -> Dict[str, Union[str, int]]:
+        """ Record that a run has started loading a file """
+        values = {
+            "run_id": run_id,
+            "file": file,
+            "file_hash": file_hash,
+            "status": "running",
+            "start_row": start_row,
+            "last_row": start_row,
+        }
+        stmt = insert(cls).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.run_id, cls.file],
+            set_={
+                **values,
+                "rows_read": 0,
+                "rows_written": 0,
+                "rows_rejected": 0,
+                "error": None,
+                "started_at": func.now(),
+                "updated_at": func.now(),
+                "finished_at": None,
+            },
+        )
+        with cls.s.bind.engine.begin() as conn:
+            conn.execute(stmt)
+        return values
+
+    @classmethod
+    def update(cls, run_id: str, file: str, finished: bool = False, **values):
+        """ Checkpoint a file's progress, or record its outcome if finished """
+        values["updated_at"] = func.now()
+        if finished:
+            values["finished_at"] = func.now()
+        stmt = (
+            cls.__table__.update()
+            .where(cls.run_id == run_id)
+            .where(cls.file == file)
+            .values(**values)
+        )
+        with cls.s.bind.engine.begin() as conn:
+            conn.execute(stmt)
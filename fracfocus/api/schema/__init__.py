@@ -1 +1 @@
-from api.schema.comp import CompletionParameterSchema
+from api.schema.comp import CompletionParameterSchema, compile_serializer
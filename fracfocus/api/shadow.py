@@ -0,0 +1,323 @@
+""" Full reloads through a shadow copy of a table that is swapped in when complete """
+
+from __future__ import annotations
+from typing import Dict, List, Tuple
+import hashlib
+import logging
+import re
+from timeit import default_timer as timer
+
+from sqlalchemy import literal, text
+
+from api.mixins import CopyStream, Operation
+from config import get_active_config
+from fracfocus import db
+
+conf = get_active_config()
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = "_shadow"
+MAX_IDENTIFIER_LENGTH = 63  # postgres truncates longer names
+LOAD_ORDER = ["_load_file", "_load_row"]  # shadow only, dropped once deduped
+INDEX_DEFINITION = re.compile(
+    r"^(CREATE (?:UNIQUE )?INDEX) \S+ ON (?:ONLY )?\S+ (USING .*)$", re.DOTALL
+)
+
+
+def execute_verbatim(conn, sql: str):
+    """ Run SQL read back from the catalog exactly as written, without
+        treating colons or percent signs in it as parameters """
+    return conn.execution_options(no_parameters=True).execute(sql)
+
+
+class ShadowTable:
+    """ An unindexed copy of a model's table that is bulk loaded with COPY, then
+        indexed, analyzed, and swapped in for the live table in one transaction.
+
+        Readers of the live table are only blocked for the swap itself, and rows
+        that aren't in the reload are gone afterwards. Primary key, indexes,
+        grants, and triggers are carried over from the live table, as is the
+        created_at of rows that were already there. Anything else that depends
+        on the live table (e.g. a view) makes the swap fail.
+
+        Each row is loaded with its position in the reload (the index of its
+        file and its row in that file), so when a key is loaded more than once
+        the same row wins however the files were spread across workers. """
+
+    preserved_columns = ["created_at"]  # kept from the live table's rows
+
+    def __init__(self, model: db.Model, name: str = None):
+        self.model = model
+        self.table = model.__table__
+        self.name = name or f"{self.table.name}{SUFFIX}"
+
+    def __repr__(self):
+        return f"ShadowTable: {self.name} -> {self.table.name}"
+
+    @property
+    def engine(self):
+        return self.model.s.bind.engine
+
+    def quote(self, name: str) -> str:
+        return self.engine.dialect.identifier_preparer.quote(name)
+
+    @staticmethod
+    def shadow_index_name(name: str) -> str:
+        """ Temporary name of an index on the shadow table. Names too long to take
+            the suffix are truncated and tagged with a hash of the full name, so
+            indexes that share a long prefix don't collide. """
+        if len(name) + len(SUFFIX) <= MAX_IDENTIFIER_LENGTH:
+            return f"{name}{SUFFIX}"
+        digest = hashlib.md5(name.encode()).hexdigest()[:8]
+        keep = MAX_IDENTIFIER_LENGTH - len(SUFFIX) - len(digest) - 1
+        return f"{name[:keep]}_{digest}{SUFFIX}"
+
+    def live_indexes(self, conn) -> List[Tuple[str, str]]:
+        """ (name, definition) of each index on the live table other than its
+            primary key, read from the database rather than the model so that
+            indexes created outside of the model survive the swap """
+        return [
+            (name, definition)
+            for name, definition in conn.execute(
+                text(
+                    "SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x "
+                    "JOIN pg_class i ON i.oid = x.indexrelid "
+                    "WHERE x.indrelid = CAST(:name AS regclass) AND NOT x.indisprimary "
+                    "ORDER BY i.relname"
+                ),
+                name=self.table.name,
+            )
+        ]
+
+    def shadow_index_ddl(self, name: str, definition: str) -> str:
+        """ Point an index definition from pg_get_indexdef at the shadow table """
+        match = INDEX_DEFINITION.match(definition)
+        if match is None:
+            raise ValueError(f"Unrecognized index definition: {definition}")
+        create, using = match.group(1), match.group(2)
+        index = self.quote(self.shadow_index_name(name))
+        return f"{create} {index} ON {self.quote(self.name)} {using}"
+
+    def generated_defaults(self) -> Dict[str, str]:
+        """ Column defaults that sqlalchemy fills in on insert, rendered as SQL,
+            so COPY can leave those columns out """
+        dialect = self.engine.dialect
+        defaults = {}
+        for c in self.table.c:
+            if c.default is None or c.server_default is not None:
+                continue
+            if c.default.is_clause_element:
+                defaults[c.name] = str(c.default.arg.compile(dialect=dialect))
+            elif c.default.is_scalar:
+                defaults[c.name] = str(
+                    literal(c.default.arg).compile(
+                        dialect=dialect, compile_kwargs={"literal_binds": True}
+                    )
+                )
+        return defaults
+
+    def create(self) -> ShadowTable:
+        """ Create the shadow table empty, replacing any left by a failed reload """
+        shadow, live = self.quote(self.name), self.quote(self.table.name)
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {shadow}"))
+            conn.execute(
+                text(f"CREATE TABLE {shadow} (LIKE {live} INCLUDING DEFAULTS)")
+            )
+            conn.execute(
+                text(
+                    f"ALTER TABLE {shadow} "
+                    + ", ".join(f"ADD COLUMN {c} bigint" for c in LOAD_ORDER)
+                )
+            )
+            for name, default in self.generated_defaults().items():
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {shadow} ALTER COLUMN {self.quote(name)} SET DEFAULT {default}"  # noqa
+                    )
+                )
+        logger.info(f"Created {self.name}")
+        return self
+
+    def drop(self):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {self.quote(self.name)}"))
+        logger.info(f"Dropped {self.name}")
+
+    def copy(self, records: List[Dict], file: int = 0, start: int = 0) -> int:
+        """ Load records with COPY, returning the number loaded. file is the index
+            of the records' file in the reload and start the row of the first
+            record in it. Rows the database refuses are isolated and
+            dead-lettered, as in core_insert. """
+        if not records:
+            return 0
+
+        ts = timer()
+        n = len(records)
+        rows = {id(r): (file, start + i) for i, r in enumerate(records)}
+        records, duplicates = self.model.dedupe_records(records)
+        columns = [c.name for c in self.table.c if c.name in records[0]]
+        counts = {"inserted": 0, "rejected": 0, "duplicates": duplicates}
+        self._copy_isolating(records, columns, rows, counts)
+
+        exc_time = round(timer() - ts, 2)
+        self.model.post_op_metrics(
+            Operation.INSERT, "shadow_copy", n, exc_time, counts=counts
+        )
+        return counts["inserted"]
+
+    def _copy_isolating(
+        self,
+        records: List[Dict],
+        columns: List[str],
+        rows: Dict[int, Tuple[int, int]],
+        counts: Dict,
+    ):
+        dbapi = self.engine.dialect.dbapi
+        column_list = ", ".join(self.quote(name) for name in columns + LOAD_ORDER)
+        values = (
+            (*v, *rows[id(r)])
+            for r, v in zip(records, self.model.copy_rows(records, columns))
+        )
+        try:
+            with self.engine.begin() as conn:
+                cursor = conn.connection.cursor()
+                cursor.copy_expert(
+                    f"COPY {self.quote(self.name)} ({column_list}) FROM STDIN",
+                    CopyStream(values),
+                    size=conf.COLLECTOR_COPY_BUFFER_SIZE,
+                )
+            counts["inserted"] += len(records)
+        except (dbapi.DataError, dbapi.IntegrityError) as e:
+            if len(records) == 1:
+                self.model.reject(records[0], e)
+                counts["rejected"] += 1
+                if counts["rejected"] >= conf.COLLECTOR_MAX_REJECTS:
+                    raise
+            else:
+                mid = len(records) // 2
+                self._copy_isolating(records[:mid], columns, rows, counts)
+                self._copy_isolating(records[mid:], columns, rows, counts)
+
+    def build(self):
+        """ Prepare the loaded shadow table to replace the live one: drop duplicate
+            keys (the row latest in the reload wins), copy created_at from rows
+            already in the live table, then add the primary key and the live
+            table's indexes and grants, and analyze it """
+        ts = timer()
+        shadow = self.quote(self.name)
+        live = self.quote(self.table.name)
+        pks = [self.quote(c.name) for c in self.table.primary_key.columns]
+        earlier = ", ".join(f"a.{c}" for c in LOAD_ORDER)
+        later = ", ".join(f"b.{c}" for c in LOAD_ORDER)
+        preserved = [
+            self.quote(name) for name in self.preserved_columns if name in self.table.c
+        ]
+
+        with self.engine.begin() as conn:
+            deleted = conn.execute(
+                text(
+                    f"DELETE FROM {shadow} a USING {shadow} b WHERE "
+                    + " AND ".join(f"a.{pk} = b.{pk}" for pk in pks)
+                    + f" AND ({earlier}) < ({later})"
+                )
+            ).rowcount
+            if deleted:
+                logger.info(f"{self.name}: dropped {deleted} duplicate keys")
+            conn.execute(
+                text(
+                    f"ALTER TABLE {shadow} "
+                    + ", ".join(f"DROP COLUMN {c}" for c in LOAD_ORDER)
+                )
+            )
+
+            if preserved:  # before any indexes exist, so they aren't maintained
+                conn.execute(
+                    text(
+                        f"UPDATE {shadow} a SET "
+                        + ", ".join(f"{c} = b.{c}" for c in preserved)
+                        + f" FROM {live} b WHERE "
+                        + " AND ".join(f"a.{pk} = b.{pk}" for pk in pks)
+                    )
+                )
+
+            # the defaults were only needed while loading
+            for name in self.generated_defaults():
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {shadow} ALTER COLUMN {self.quote(name)} DROP DEFAULT"  # noqa
+                    )
+                )
+
+            conn.execute(
+                text(
+                    f"ALTER TABLE {shadow} ADD CONSTRAINT {self.quote(self.name + '_pkey')} PRIMARY KEY ({', '.join(pks)})"  # noqa
+                )
+            )
+            for name, definition in self.live_indexes(conn):
+                execute_verbatim(conn, self.shadow_index_ddl(name, definition))
+
+            grants = conn.execute(
+                text(
+                    "SELECT grantee, privilege_type FROM information_schema.role_table_grants "  # noqa
+                    "WHERE table_schema = current_schema() AND table_name = :name"
+                ),
+                name=self.table.name,
+            ).fetchall()
+            for grantee, privilege in grants:
+                grantee = "PUBLIC" if grantee == "PUBLIC" else self.quote(grantee)
+                conn.execute(text(f"GRANT {privilege} ON {shadow} TO {grantee}"))
+
+            conn.execute(text(f"ANALYZE {shadow}"))
+
+        logger.info(f"Built {self.name} ({round(timer() - ts, 2)}s)")
+
+    def swap(self):
+        """ Replace the live table with the shadow table in one transaction """
+        ts = timer()
+        shadow, live = self.quote(self.name), self.quote(self.table.name)
+        with self.engine.begin() as conn:
+            # fail rather than queue every reader behind the swap's exclusive lock
+            conn.execute(
+                text(f"SET LOCAL lock_timeout = '{conf.COLLECTOR_SWAP_LOCK_TIMEOUT}'")
+            )
+            conn.execute(text(f"LOCK TABLE {live} IN ACCESS EXCLUSIVE MODE"))
+            indexes = [name for name, _ in self.live_indexes(conn)]
+            triggers = [
+                row[0]
+                for row in conn.execute(
+                    text(
+                        "SELECT pg_get_triggerdef(oid) FROM pg_trigger "
+                        "WHERE tgrelid = CAST(:name AS regclass) AND NOT tgisinternal"
+                    ),
+                    name=self.table.name,
+                )
+            ]
+            pkey = conn.execute(
+                text(
+                    "SELECT conname FROM pg_constraint "
+                    "WHERE conrelid = CAST(:name AS regclass) AND contype = 'p'"
+                ),
+                name=self.table.name,
+            ).scalar()
+
+            conn.execute(text(f"DROP TABLE {live}"))
+            conn.execute(text(f"ALTER TABLE {shadow} RENAME TO {live}"))
+            pkey = pkey or f"{self.table.name}_pkey"  # postgres' default name
+            conn.execute(
+                text(
+                    f"ALTER TABLE {live} RENAME CONSTRAINT {self.quote(self.name + '_pkey')} TO {self.quote(pkey)}"  # noqa
+                )
+            )
+            for name in indexes:
+                tmp = self.shadow_index_name(name)
+                conn.execute(
+                    text(f"ALTER INDEX {self.quote(tmp)} RENAME TO {self.quote(name)}")
+                )
+            for trigger in triggers:  # definitions refer to the table by name
+                execute_verbatim(conn, trigger)
+
+        logger.info(
+            f"Swapped {self.name} in for {self.table.name} ({round(timer() - ts, 2)}s)"
+        )
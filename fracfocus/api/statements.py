@@ -0,0 +1,99 @@
+""" Statements that are built and compiled once and executed many times """
+
+from typing import Any, Callable, Dict, List, Tuple
+import logging
+import re
+import threading
+
+from sqlalchemy.engine import Connection, ResultProxy
+from sqlalchemy.sql import Select, literal, text
+
+logger = logging.getLogger(__name__)
+
+PYFORMAT_PARAM = re.compile(r"%\((\w+)\)s")
+
+
+class CachedStatement:
+    """ A select built on first use and reused for every execution after that.
+
+        The compiled form is kept in a compiled_cache, so executing the statement
+        only binds new parameter values. Parameters that vary in length, like a
+        list of ids, should be bound as a single array (see models.any_of) so the
+        SQL text stays the same from one call to the next.
+
+        With prepare=True, the statement is also prepared on the server
+        (PREPARE/EXECUTE) the first time each database connection runs it, so
+        Postgres skips parsing and planning on later executions. Prepared
+        statements live as long as the connection and don't survive
+        transaction-mode connection poolers like pgbouncer, so this is opt-in. """
+
+    def __init__(self, name: str, build: Callable[[], Select], prepare: bool = False):
+        self.name = name
+        self.build = build
+        self.prepare = prepare
+        self.compiled_cache: Dict = {}
+        self._statement: Select = None
+        self._prepared: Dict[str, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"CachedStatement: {self.name}"
+
+    @property
+    def statement(self) -> Select:
+        if self._statement is None:
+            with self._lock:
+                if self._statement is None:
+                    self._statement = self.build()
+        return self._statement
+
+    def execute(self, conn: Connection, **params) -> ResultProxy:
+        if self.prepare and conn.dialect.name == "postgresql":
+            return self._execute_prepared(conn, params)
+        return conn.execution_options(compiled_cache=self.compiled_cache).execute(
+            self.statement, params
+        )
+
+    def prepared_sql(self, conn: Connection) -> Tuple[str, str]:
+        """ Render the PREPARE statement and the matching EXECUTE template.
+            Parameters without a value (the ones passed to execute) become typed
+            positional parameters; constants in the statement are rendered
+            inline, as the driver would send them. """
+        key = conn.dialect.name
+        if key not in self._prepared:
+            compiled = self.statement.compile(dialect=conn.dialect)
+            names: List[str] = []
+
+            def render(match: Any) -> str:
+                bind = compiled.binds[match.group(1)]
+                if bind.value is not None or bind.callable is not None:
+                    return (
+                        literal(bind.effective_value, bind.type)
+                        .compile(
+                            dialect=conn.dialect, compile_kwargs={"literal_binds": True}
+                        )
+                        .string
+                    )
+                if bind.key not in names:
+                    names.append(bind.key)
+                return f"${names.index(bind.key) + 1}"
+
+            body = PYFORMAT_PARAM.sub(render, compiled.string)
+            body = body.replace("%%", "%")  # executed without parameters
+            types = ", ".join(
+                compiled.binds[n].type.compile(dialect=conn.dialect) for n in names
+            )
+            self._prepared[key] = (
+                f"PREPARE {self.name} ({types}) AS {body}",
+                f"EXECUTE {self.name} ({', '.join(':' + n for n in names)})",
+            )
+        return self._prepared[key]
+
+    def _execute_prepared(self, conn: Connection, params: Dict) -> ResultProxy:
+        prepare, execute = self.prepared_sql(conn)
+        prepared = conn.connection.info.setdefault("prepared_statements", set())
+        if self.name not in prepared:
+            conn.execution_options(no_parameters=True).execute(prepare)
+            prepared.add(self.name)
+            logger.debug(f"prepared {self.name} on {conn.connection}")
+        return conn.execute(text(execute), params)
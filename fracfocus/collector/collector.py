@@ -1,17 +1,27 @@
 from __future__ import annotations
-from typing import Dict, List, Union, Any
+from typing import Dict, List, Optional, Union, Any, ContextManager, IO
 import logging
 from datetime import datetime
 import csv
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+import uuid
+from timeit import default_timer as timer
 
 from flask_sqlalchemy import Model
 import requests
 
 
 from api.models import *
+from api.mixins import HASH_COLUMN
+from api.models import CompletionSummary, IngestLedger, is_proppant
+from api.shadow import ShadowTable
+from collector.downloader import FileHandle, ZipMember, file_checksum
 from collector.endpoint import Endpoint
-from collector.transformer import Transformer
+from collector.pipeline import Pipeline
+from collector.transformer import Transformer, row_hash
 from config import get_active_config
 from collector.util import retry
 
@@ -54,45 +64,298 @@ class Collector(object):
             self._tf = Transformer(
                 aliases=self.endpoint.mappings.get("aliases", {}),
                 exclude=self.endpoint.exclude,
+                model=self.model,
             )
         return self._tf
 
+    @property
+    def hash_column(self) -> Optional[str]:
+        """ The model's row hash column, if it has one """
+        return HASH_COLUMN if HASH_COLUMN in self.model.__table__.c else None
+
     def transform(self, data: dict) -> dict:
         return self.tf.transform(data)
 
 
 class FracFocusCollector(Collector):
+    def transform_row(self, row: dict) -> Optional[dict]:
+        """ Transform a raw row, dropping it if it is missing a primary key """
+        transformed = self.transform(row)
+        if transformed.get("upload_key") and transformed.get("ingredient_key"):
+            transformed["is_proppant"] = is_proppant(transformed.get("ingredient_name"))
+            if self.hash_column:
+                # hashed last, so a change to a derived column (e.g. a new
+                # proppant pattern) also counts as a change to the row
+                transformed[self.hash_column] = row_hash(transformed)
+            return transformed
+        return None
+
+    @staticmethod
+    def open_file(source: FileHandle) -> ContextManager[IO[str]]:
+        """ Open a file on disk or a member of a zip archive for reading """
+        if isinstance(source, ZipMember):
+            return source.open()
+        return open(source)
+
+    def collect_file(
+        self,
+        path: FileHandle,
+        update_on_conflict: bool = True,
+        ignore_on_conflict: bool = False,
+        use_copy: bool = False,
+        shadow: ShadowTable = None,
+        run_id: str = None,
+        resume: bool = False,
+        file_index: int = 0,
+    ) -> Dict[str, Any]:
+        """ Parse and load a single file, returning a summary of the result.
+            Failures are captured in the result rather than raised.
+
+            If shadow is given, rows are copied into it instead of the live table,
+            as part of a full refresh, tagged with file_index (the file's place
+            in the refresh) and their row in the file.
+
+            If run_id is given, the file's progress is checkpointed to the ingest
+            ledger after every write. With resume, a file that an earlier run
+            finished is skipped, and one it didn't restarts after the last row
+            it committed. """
+        load = self.model.core_copy if use_copy else self.model.core_insert
+        result: Dict[str, Any] = {"file": str(path), "status": "success", "rows": 0}
+        ledger = run_id is not None and shadow is None  # a full refresh starts over
+        counts = {"rows_written": 0, "rows_rejected": 0}
+        start_row = 0
+        copied = 0
+        started = False
+        pipeline = None
+
+        ts = timer()
+        logger.info(f"Collecting file {path}")
+        try:
+            if ledger:
+                file_hash = file_checksum(path)
+                entry = IngestLedger.latest(str(path), file_hash) if resume else None
+                if entry is not None and entry.status == "success":
+                    logger.info(f"Skipping {path}: loaded by run {entry.run_id}")
+                    result.update({"status": "skipped", "seconds": 0.0})
+                    return result
+                if entry is not None and entry.last_row:
+                    start_row = entry.last_row
+                    result["start_row"] = start_row
+                    logger.info(f"Resuming {path} after row {start_row}")
+                IngestLedger.start(run_id, str(path), file_hash, start_row)
+                started = True
+
+            with self.open_file(path) as f:
+
+                def write(rows: List[dict]):
+                    nonlocal copied
+                    if shadow is not None:
+                        # summaries are rebuilt after the swap
+                        shadow.copy(rows, file=file_index, start=copied)
+                        copied += len(rows)
+                        return
+                    loaded = load(
+                        rows,
+                        update_on_conflict=update_on_conflict,
+                        ignore_on_conflict=ignore_on_conflict,
+                    )
+                    counts["rows_written"] += loaded
+                    counts["rows_rejected"] += len(rows) - loaded
+                    if conf.COLLECTOR_REFRESH_SUMMARY:
+                        CompletionSummary.refresh(r.get("api14") for r in rows)
+
+                def checkpoint(position: int):
+                    try:
+                        IngestLedger.update(
+                            run_id,
+                            str(path),
+                            last_row=start_row + position,
+                            rows_read=position,
+                            **counts,
+                        )
+                    except Exception as e:  # a resume would only redo more rows
+                        logger.warning(f"Failed checkpointing {path}: {e}")
+
+                pipeline = Pipeline(
+                    source=itertools.islice(csv.DictReader(f), start_row, None),
+                    transform=self.transform_row,
+                    write=write,
+                    read_size=conf.COLLECTOR_READ_SIZE,
+                    write_size=conf.COLLECTOR_WRITE_SIZE,
+                    transformers=conf.COLLECTOR_TRANSFORMERS,
+                    queue_size=conf.COLLECTOR_QUEUE_SIZE,
+                    name=getattr(path, "name", str(path)),
+                    checkpoint=checkpoint if ledger else None,
+                )
+                try:
+                    pipeline.run()
+                finally:
+                    # rows already written are kept even if the pipeline fails
+                    result["rows"] = pipeline.writer_stats.rows
+                    result["pipeline"] = pipeline.stats
+        except Exception as e:
+            logger.exception(f"Failed collecting file {path}: {e}")
+            result.update({"status": "error", "error": str(e)})
+
+        result["seconds"] = round(timer() - ts, 2)
+
+        if started:
+            try:
+                IngestLedger.update(
+                    run_id,
+                    str(path),
+                    finished=True,
+                    status=result["status"],
+                    error=result.get("error"),
+                    seconds=result["seconds"],
+                    rows_read=pipeline.reader_stats.rows if pipeline else 0,
+                    **counts,
+                )
+            except Exception as e:  # the rows are loaded either way
+                logger.exception(f"Failed updating ingest ledger for {path}: {e}")
+
+        logger.info(
+            f"Collected {result['rows']} rows from {path} ({result['seconds']}s)",
+            extra={"collector_file_result": result},
+        )
+        return result
+
     def collect(
         self,
-        filelist: Union[Path, List[Path]],
+        filelist: Union[FileHandle, List[FileHandle]],
         update_on_conflict: bool = True,
         ignore_on_conflict: bool = False,
-    ):
+        use_copy: bool = False,
+        workers: int = 1,
+        shadow: ShadowTable = None,
+        resume: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """ Collect each file in filelist, returning a result summary for each. A
+            failure in one file does not stop the others from being collected.
+
+            Each call is a new run in the ingest ledger, when the ledger table
+            exists or resume is given. With resume, files completed by earlier
+            runs are skipped and interrupted ones pick up from their last
+            checkpoint. """
         if not isinstance(filelist, list):
             filelist = [filelist]
 
-        for path in filelist:
-            logger.info(f"Collecting file {path}")
-            with open(path) as f:
-                csvreader = csv.DictReader(f)
-                rows = []
-                for idx, row in enumerate(csvreader):
-                    transformed = self.transform(row)
-                    if transformed.get("upload_key") and transformed.get(
-                        "ingredient_key"
-                    ):
-                        rows.append(transformed)
-
-                    if idx % conf.COLLECTOR_WRITE_SIZE == 0:
-                        self.model.core_insert(
-                            rows,
-                            update_on_conflict=update_on_conflict,
-                            ignore_on_conflict=ignore_on_conflict,
-                        )
-                        rows = []
+        run_id = None
+        if shadow is None and (resume or IngestLedger.exists()):
+            run_id = uuid.uuid4().hex
+            logger.info(f"Starting collector run {run_id}")
+        options = {
+            "update_on_conflict": update_on_conflict,
+            "ignore_on_conflict": ignore_on_conflict,
+            "use_copy": use_copy,
+            "shadow": shadow,
+            "run_id": run_id,
+            "resume": resume,
+        }
+
+        if workers > 1 and len(filelist) > 1:
+            return self.collect_parallel(filelist, workers, **options)
+        return [
+            self.collect_file(path, file_index=i, **options)
+            for i, path in enumerate(filelist)
+        ]
+
+    def full_refresh(
+        self, filelist: Union[FileHandle, List[FileHandle]], workers: int = 1
+    ) -> List[Dict[str, Any]]:
+        """ Replace the contents of the table with a complete snapshot.
+
+            The files are copied into an unindexed shadow table, which is then
+            indexed, analyzed, and swapped in for the live table in a single
+            transaction, so readers are never blocked by the load and rows that
+            are no longer in the snapshot disappear. If any file fails, or the
+            shadow table can't be built or swapped in, the live table is left as
+            it was and the failure is added to the results. """
+        table = self.model.__table__.name
+        shadow = ShadowTable(self.model).create()
+        results = self.collect(filelist, workers=workers, shadow=shadow)
+
+        if any(r["status"] != "success" for r in results):
+            logger.error(f"Full refresh failed. {table} is unchanged.")
+            shadow.drop()
+            return results
+
+        ts = timer()
+        try:
+            shadow.build()
+            shadow.swap()
+        except Exception as e:
+            logger.exception(f"Failed swapping in {shadow.name}: {e}")
+            logger.error(f"Full refresh failed. {table} is unchanged.")
+            try:
+                shadow.drop()
+            except Exception as drop_error:
+                logger.exception(f"Failed dropping {shadow.name}: {drop_error}")
+            results.append(
+                {
+                    "file": shadow.name,
+                    "status": "error",
+                    "rows": 0,
+                    "error": str(e),
+                    "seconds": round(timer() - ts, 2),
+                }
+            )
+            return results
+
+        CompletionSummary.refresh()
+        return results
+
+    def collect_parallel(
+        self, filelist: List[FileHandle], workers: int, **kwargs
+    ) -> List[Dict[str, Any]]:
+        """ Collect whole files concurrently in a pool of worker processes.
+
+            Workers are spawned rather than forked so that none of them inherit
+            the parent's database connections; each creates its own app and
+            engine. Files are no longer loaded in a deterministic order, so this
+            assumes a primary key does not appear in more than one file, except
+            in a full refresh, where rows are ordered by the file they came from.
+        """
+        logger.info(f"Collecting {len(filelist)} files with {workers} workers")
+        results: List[Dict[str, Any]] = []
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.endpoint.name,),
+        ) as executor:
+            futures = {
+                executor.submit(_collect_file, path, file_index=i, **kwargs): path
+                for i, path in enumerate(filelist)
+            }
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:  # the worker died before it could report back
+                    path = futures[future]
+                    logger.error(f"Worker failed collecting file {path}: {e}")
+                    results.append(
+                        {"file": str(path), "status": "error", "rows": 0, "error": str(e)}
+                    )
+        return results
+
+
+_worker_collector: Optional[FracFocusCollector] = None
+
+
+def _init_worker(endpoint_name: str):
+    """ Initialize a worker process with its own app context and database engine """
+    global _worker_collector  # pylint: disable=global-statement
+    from fracfocus import create_app
+
+    app = create_app()
+    app.app_context().push()
+    endpoint = Endpoint.load_from_config(conf)[endpoint_name]
+    _worker_collector = FracFocusCollector(endpoint)
+
 
-                # persist leftovers
-                self.model.core_insert(rows)
+def _collect_file(path: FileHandle, **kwargs) -> Dict[str, Any]:
+    return _worker_collector.collect_file(path, **kwargs)  # type: ignore
 
 
 if __name__ == "__main__":
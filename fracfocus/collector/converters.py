@@ -0,0 +1,74 @@
+""" Type converters compiled from a model's column definitions """
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterable, Union
+import logging
+
+from sqlalchemy import Boolean, Column, Date, DateTime, Float, Integer, Numeric
+
+import util
+from config import get_active_config
+from util.dt import DateParser
+
+conf = get_active_config()
+
+logger = logging.getLogger(__name__)
+
+Converter = Callable[[Any], Any]
+
+
+def identity(value: Any) -> Any:
+    return value
+
+
+def to_int(value: Any) -> Union[int, float]:
+    """ Convert to int, preserving non-integral values as floats so the database
+        applies its own rounding """
+    try:
+        return int(value)
+    except ValueError:
+        f = float(value)
+        return int(f) if f.is_integer() else f
+
+
+def converter_for_type(sqltype: Any) -> Converter:
+    """ Select the conversion function for a sqlalchemy column type """
+    if isinstance(sqltype, Boolean):
+        return util.to_bool
+    if isinstance(sqltype, Integer):  # includes BigInteger and SmallInteger
+        return to_int
+    if isinstance(sqltype, (Float, Numeric)):
+        return float
+    if isinstance(sqltype, (Date, DateTime)):
+        # each column gets its own parser so formats are detected per column
+        return DateParser(
+            sample_size=conf.PARSER_DATE_SAMPLE_SIZE,
+            cache_size=conf.PARSER_DATE_CACHE_SIZE,
+        )
+    return identity  # strings, uuids, and anything else the driver adapts as text
+
+
+def compile_converter(convert: Converter, fallback: Converter) -> Converter:
+    """ Wrap a conversion function to map empty values to None and hand values it
+        can't convert to the fallback """
+
+    def converter(value: Any) -> Any:
+        if value is None or value == "":
+            return None
+        try:
+            return convert(value)
+        except (TypeError, ValueError, OverflowError):
+            logger.debug(f"{convert.__name__} failed on {value!r}. Using fallback.")
+            return fallback(value)
+
+    converter.__name__ = f"convert_{convert.__name__}"
+    return converter
+
+
+def compile_converters(
+    columns: Iterable[Column], fallback: Converter
+) -> Dict[str, Converter]:
+    """ Build a converter for each column, keyed by column name """
+    return {
+        c.name: compile_converter(converter_for_type(c.type), fallback)
+        for c in columns
+    }
@@ -1,5 +1,8 @@
 from __future__ import annotations
-from typing import Union, List, Dict
+from typing import Union, List, Dict, IO, Iterator, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import hashlib
 import requests
 import zipfile
 import io
@@ -7,11 +10,17 @@ import os
 import logging
 from pathlib import Path
 import itertools
+import shutil
+import threading
 from timeit import default_timer as timer
 import re
+import urllib.parse
 
+from collector.util import retry
+from collector.yammler import Yammler
 from config import get_active_config
 from util import hf_size
+import metrics
 
 
 logger = logging.getLogger(__name__)
@@ -19,9 +28,148 @@ logger = logging.getLogger(__name__)
 conf = get_active_config()
 
 
+class DownloadError(Exception):
+    pass
+
+
+class DownloadProgress:
+    """ Tracks the throughput of an in-flight download and periodically logs it """
+
+    def __init__(self, total: int = None, interval: float = None):
+        self.total = total
+        self.interval = interval or conf.COLLECTOR_DOWNLOAD_LOG_INTERVAL
+        self.nbytes = 0
+        self.started = timer()
+        self._last_report = self.started
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> float:
+        return timer() - self.started
+
+    @property
+    def rate(self) -> float:
+        """ Average transfer rate in bytes/second """
+        elapsed = self.elapsed
+        return self.nbytes / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def attrs(self) -> Dict[str, Union[int, float, None]]:
+        return {
+            "download_bytes": self.nbytes,
+            "download_total_bytes": self.total,
+            "download_seconds": round(self.elapsed, 2),
+            "download_bytes_per_second": round(self.rate, 2),
+        }
+
+    def update(self, n: int):
+        with self._lock:
+            self.nbytes += n
+            now = timer()
+            if now - self._last_report < self.interval:
+                return
+            self._last_report = now
+        self.report()
+
+    def report(self):
+        pct = f" ({self.nbytes / self.total:.0%})" if self.total else ""
+        logger.info(
+            "Downloaded %s of %s%s at %s/s",
+            hf_size(self.nbytes),
+            hf_size(self.total or 0),
+            pct,
+            hf_size(int(self.rate)),
+            extra=self.attrs,
+        )
+
+
 class FileDownloader:
-    def __init__(self, url: str):
+    chunk_size = conf.COLLECTOR_DOWNLOAD_CHUNK_SIZE
+    validator_headers = ["ETag", "Last-Modified", "Content-Length"]
+
+    def __init__(self, url: str, cache: str = None, segments: int = None):
+        """ Validators are recorded in the download_validators table, or in the
+            yaml file at cache (default: COLLECTOR_CACHE_PATH) if one is given """
         self.url = url
+        path = cache or conf.COLLECTOR_CACHE_PATH
+        self.cache = Yammler(os.path.abspath(path)) if path else None
+        self.validators: Dict[str, str] = {}
+        self.segments = segments or conf.COLLECTOR_DOWNLOAD_SEGMENTS
+
+    @property
+    def cached_validators(self) -> Dict[str, str]:
+        """ Validator headers recorded for the last successfully collected download """
+        if self.cache is not None:
+            return self.cache.get(self.url) or {}
+
+        from api.models import DownloadValidators
+
+        try:
+            return DownloadValidators.get(self.url) or {}
+        except Exception as e:  # treated as never downloaded
+            logger.warning(f"Failed reading download validators for {self.url}: {e}")
+            return {}
+
+    def get_validators(self, r: requests.Response) -> Dict[str, str]:
+        return {k: r.headers[k] for k in self.validator_headers if k in r.headers}
+
+    def conditional_headers(self) -> Dict[str, str]:
+        cached = self.cached_validators
+        headers = {}
+        if cached.get("ETag"):
+            headers["If-None-Match"] = cached["ETag"]
+        if cached.get("Last-Modified"):
+            headers["If-Modified-Since"] = cached["Last-Modified"]
+        return headers
+
+    def is_modified(self) -> bool:
+        """ Issue a conditional HEAD request to check if the remote file has changed
+            since the last recorded download. Returns True whenever that can't be
+            determined, so an inconclusive check never skips a download.
+        """
+        cached = self.cached_validators
+        if not cached:
+            return True
+
+        try:
+            r = requests.head(
+                self.url, headers=self.conditional_headers(), allow_redirects=True
+            )
+        except requests.RequestException as e:
+            logger.warning(f"Failed to check {self.url} for changes: {e}")
+            return True
+
+        if r.status_code == 304:
+            return False
+        if not r.ok:
+            logger.debug(f"Conditional request returned status {r.status_code}")
+            return True
+
+        current = self.get_validators(r)
+        keys = [k for k in self.validator_headers if current.get(k) and cached.get(k)]
+        if not keys:
+            return True
+        return any(current[k] != cached[k] for k in keys)
+
+    def save_validators(self):
+        """ Record the validators of the current download. This should only be
+            called once the downloaded data has been fully processed so a failed
+            run is retried on the next attempt.
+        """
+        if not self.validators:
+            return
+        if self.cache is not None:
+            self.cache[self.url] = self.validators
+            self.cache.dump()
+        else:
+            from api.models import DownloadValidators
+
+            try:
+                DownloadValidators.save(self.url, self.validators)
+            except Exception as e:  # the next run downloads again
+                logger.warning(f"Failed saving download validators: {e}")
+                return
+        logger.debug(f"Saved validators for {self.url}: {self.validators}")
 
     def get(self) -> requests.Response:
         logger.info(f"Starting download from {self.url}...")
@@ -31,6 +179,7 @@ class FileDownloader:
         exc_time = round(te - ts, 0)
 
         size = self.get_file_size(r)
+        self.validators = self.get_validators(r)
 
         logger.info(
             "Download successful (download size: %s, download_time: %ss)",
@@ -40,20 +189,263 @@ class FileDownloader:
         )
         return r
 
+    def download(self, path: Union[str, Path]) -> Path:
+        """ Stream the remote file to disk one chunk at a time so that the
+            full payload is never held in memory. Chunks are written to a
+            ".part" file that is moved into place once the transfer completes.
+
+            If more than one segment is configured and the server supports range
+            requests, the file is fetched in parallel segments instead
+            (see download_segmented).
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        if self.segments > 1:
+            size = self.probe_range_support()
+            if size:
+                return self.download_segmented(path, size, self.segments)
+            logger.info(
+                f"{self.url} does not support range requests. Falling back to a single stream."
+            )
+
+        partial = path.with_name(path.name + ".part")
+
+        logger.info(f"Starting streaming download from {self.url} to {path}...")
+        with requests.get(self.url, stream=True) as r:
+            r.raise_for_status()
+            self.validators = self.get_validators(r)
+            progress = DownloadProgress(total=self.get_file_size(r))
+            with open(partial, "wb") as f:
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    progress.update(len(chunk))
+
+            # content-length refers to the encoded body when compression is used
+            if not r.headers.get("Content-Encoding"):
+                self.verify_size(partial, progress.total)
+
+        os.replace(partial, path)
+        self._log_download(progress)
+        return path
+
+    def probe_range_support(self) -> Optional[int]:
+        """ Return the remote file's size if the server accepts byte range requests """
+        try:
+            r = requests.head(
+                self.url,
+                headers={"Accept-Encoding": "identity"},
+                allow_redirects=True,
+            )
+        except requests.RequestException as e:
+            logger.warning(f"Failed to probe {self.url} for range support: {e}")
+            return None
+
+        if r.ok and r.headers.get("Accept-Ranges", "").lower() == "bytes":
+            self.validators = self.get_validators(r)
+            return self.get_file_size(r)
+        return None
+
+    @staticmethod
+    def split_ranges(size: int, segments: int) -> List[Tuple[int, int]]:
+        """ Split size bytes into contiguous, inclusive (start, end) byte ranges """
+        segments = max(1, min(segments, size))
+        step = -(-size // segments)  # ceiling division
+        return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+    def download_segmented(self, path: Path, size: int, segments: int) -> Path:
+        """ Fetch the remote file as a set of byte ranges over several connections.
+
+            Each range is written to its own ".partN" file. A manifest describing
+            the remote file is stored next to them so that an interrupted download
+            resumes from the existing parts on the next attempt, as long as the
+            remote file hasn't changed in the meantime. The assembled file must
+            match the remote Content-Length.
+        """
+        ranges = self.split_ranges(size, segments)
+        parts = [path.with_name(f"{path.name}.part{i}") for i in range(len(ranges))]
+        manifest_path = path.with_name(path.name + ".manifest.yaml")
+        manifest = Yammler(str(manifest_path))
+
+        expected = {
+            "url": self.url,
+            "size": size,
+            "segments": len(ranges),
+            "validators": self.validators,
+        }
+        if dict(manifest) != expected:
+            for part in parts:
+                if part.exists():
+                    part.unlink()
+            manifest.clear()
+            manifest.update(expected)
+            manifest.dump()
+
+        resumed = sum(part.stat().st_size for part in parts if part.exists())
+        if resumed:
+            logger.info(f"Resuming download of {path.name} from {hf_size(resumed)}")
+
+        logger.info(
+            f"Starting download from {self.url} to {path} in {len(ranges)} segments..."
+        )
+        progress = DownloadProgress(total=size - resumed)
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [
+                executor.submit(self._fetch_segment, part, start, end, progress)
+                for part, (start, end) in zip(parts, ranges)
+            ]
+            for future in futures:
+                future.result()
+
+        partial = path.with_name(path.name + ".part")
+        with open(partial, "wb") as out:
+            for part in parts:
+                with open(part, "rb") as f:
+                    shutil.copyfileobj(f, out, self.chunk_size)
+        self.verify_size(partial, size)
+
+        os.replace(partial, path)
+        for part in parts:
+            part.unlink()
+        manifest_path.unlink()
+
+        self._log_download(progress)
+        return path
+
+    @retry(requests.RequestException, tries=3, delay=5, backoff=2, logger=logger)
+    def _fetch_segment(
+        self, part: Path, start: int, end: int, progress: DownloadProgress
+    ) -> Path:
+        """ Download the inclusive byte range [start, end] to part, continuing from
+            whatever is already in the file so a retry only fetches what's missing.
+        """
+        offset = start + (part.stat().st_size if part.exists() else 0)
+        if offset > end:
+            return part
+
+        headers = {"Range": f"bytes={offset}-{end}", "Accept-Encoding": "identity"}
+        validator = self.validators.get("ETag") or self.validators.get("Last-Modified")
+        if validator:
+            headers["If-Range"] = validator
+
+        with requests.get(self.url, headers=headers, stream=True) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise DownloadError(
+                    f"Expected a partial response for bytes {offset}-{end}, got status {r.status_code}. The remote file may have changed."  # noqa
+                )
+            with open(part, "ab") as f:
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    progress.update(len(chunk))
+
+        self.verify_size(part, end - start + 1)
+        return part
+
+    @staticmethod
+    def verify_size(path: Path, expected: Optional[int]):
+        actual = path.stat().st_size
+        if expected is not None and actual != expected:
+            raise DownloadError(
+                f"Size of {path.name} ({actual} bytes) does not match the expected size ({expected} bytes)"  # noqa
+            )
+
+    def _log_download(self, progress: DownloadProgress):
+        logger.info(
+            "Download successful (download size: %s, download_time: %ss, rate: %s/s)",
+            hf_size(progress.nbytes),
+            round(progress.elapsed, 0),
+            hf_size(int(progress.rate)),
+            extra=progress.attrs,
+        )
+        metrics.post(
+            "download_bytes_per_second",
+            progress.rate,
+            metric_type="gauge",
+            tags={"url": self.url},
+        )
+
     def get_file_size(self, r: requests.Response) -> Union[int, None]:
         b = r.headers.get("Content-Length")
         return int(b) if b else None
 
 
+class ZipMember:
+    """ Handle to a single file inside a zip archive that can be read in place,
+        without first extracting it to disk. Only the archive's path is held, so
+        handles are cheap to create and safe to pass between processes.
+    """
+
+    def __init__(self, archive: Union[str, Path], info: zipfile.ZipInfo):
+        self.archive = Path(archive)
+        self.info = info
+
+    def __repr__(self):
+        return f"{self.archive.name}:{self.info.filename}"
+
+    @property
+    def name(self) -> str:
+        return Path(self.info.filename).name
+
+    @property
+    def size(self) -> int:
+        """ Uncompressed size in bytes """
+        return self.info.file_size
+
+    @property
+    def checksum(self) -> str:
+        """ Identifies the member's contents using the CRC stored in the archive,
+            so the member doesn't have to be read """
+        return f"crc32:{self.info.CRC:08x}:{self.info.file_size}"
+
+    @contextmanager
+    def open(self, encoding: str = None) -> Iterator[IO[str]]:
+        """ Open the member as a text stream that is decoded as it is read """
+        with zipfile.ZipFile(self.archive) as z:
+            with z.open(self.info) as raw:
+                yield io.TextIOWrapper(
+                    raw, encoding=encoding or conf.COLLECTOR_FILE_ENCODING, newline=""
+                )
+
+
+FileHandle = Union[Path, ZipMember]
+
+
+def file_checksum(source: FileHandle, chunk_size: int = 1 << 20) -> str:
+    """ A digest of a file's contents, used to tell whether a file has changed
+        since it was last loaded """
+    if isinstance(source, ZipMember):
+        return source.checksum
+    digest = hashlib.blake2b(digest_size=16)
+    with open(source, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return f"blake2b:{digest.hexdigest()}"
+
+
 class ZipDownloader(FileDownloader):
     download_to = conf.COLLECTOR_DOWNLOAD_PATH
     prefix = conf.COLLECTOR_FILE_PREFIX
 
-    def __init__(self, url: str, download_to: str = None, csv_only: bool = True):
-        super().__init__(url=url)
+    def __init__(
+        self,
+        url: str,
+        download_to: str = None,
+        csv_only: bool = True,
+        cache: str = None,
+        segments: int = None,
+    ):
+        super().__init__(url=url, cache=cache, segments=segments)
         self.download_to = download_to or self.download_to
         self.csv_only = csv_only
         self.filelist: List[zipfile.ZipInfo] = []
+        self.archive: Optional[Path] = None
+
+    @property
+    def archive_path(self) -> Path:
+        """ Location on disk the archive is spooled to while streaming """
+        name = os.path.basename(urllib.parse.urlparse(self.url or "").path)
+        return Path(self.download_to) / (name or "download.zip")
 
     @property
     def paths(self):
@@ -62,22 +454,62 @@ class ZipDownloader(FileDownloader):
         result = self.filter_by_prefix(result)
         return self.sort_by_file_no(result)
 
+    @property
+    def members(self) -> List[ZipMember]:
+        """ Handles to the archive's files, filtered and ordered the same as paths """
+        if self.archive is None:
+            return []
+        filelist = self._keep_only(self.filelist) if self.csv_only else self.filelist
+        result = [ZipMember(self.archive, x) for x in filelist]
+        result = self.filter_by_prefix(result)
+        return self.sort_by_file_no(result)
+
+    @property
+    def files(self) -> List[FileHandle]:
+        """ Files to collect: members of the archive if one has been fetched,
+            otherwise the paths of previously extracted files """
+        return self.members if self.archive is not None else self.paths
+
     @property
     def groups(self) -> Dict[str, List[Path]]:
         groups = itertools.groupby(self.paths, key=lambda f: f.name.split("_")[0])
         return {k: list(g) for k, g in groups}
 
-    def filter_by_prefix(self, filelist: List[Path], prefix: str = None) -> List[Path]:
+    def filter_by_prefix(
+        self, filelist: List[FileHandle], prefix: str = None
+    ) -> List[FileHandle]:
         prefix = prefix or self.prefix
         return [x for x in filelist if prefix in x.name]
 
+    def fetch(self) -> ZipDownloader:
+        """ Stream the archive to disk and index its contents without extracting them """
+        return self.load(self.download(self.archive_path))
+
+    def load(self, path: Union[str, Path]) -> ZipDownloader:
+        """ Index the contents of an archive that is already on disk """
+        with zipfile.ZipFile(path) as z:
+            self.filelist = z.filelist
+        self.archive = Path(path)
+        logger.info(f"Found {len(self.filelist)} files in {self.archive}")
+        return self
+
     def unpack(self, r: requests.Response = None) -> ZipDownloader:
-        r = r or self.get()
-        z = zipfile.ZipFile(io.BytesIO(r.content))
-        logger.debug(f"Unpacking zipfile contents to {self.download_to}")
-        z.extractall(self.download_to)
-        logger.info(f"Unpacked {len(z.filelist)} files")
-        self.filelist = z.filelist
+        """ Extract the archive's contents to the download directory.
+
+            If a response is passed, its (already in-memory) body is unpacked
+            directly. Otherwise, the archive is streamed to a spool file on
+            disk and opened from there.
+        """
+        if r is not None:
+            source: Union[io.BytesIO, Path] = io.BytesIO(r.content)
+        else:
+            source = self.download(self.archive_path)
+
+        with zipfile.ZipFile(source) as z:
+            logger.debug(f"Unpacking zipfile contents to {self.download_to}")
+            z.extractall(self.download_to)
+            logger.info(f"Unpacked {len(z.filelist)} files")
+            self.filelist = z.filelist
         return self
 
     def _keep_only(
@@ -89,8 +521,12 @@ class ZipDownloader(FileDownloader):
         return result
 
     @classmethod
-    def from_existing(cls):
-        obj = cls(url=None)  # type: ignore
+    def from_existing(cls, url: str = None):
+        """ Load a previously fetched archive, falling back to previously extracted files """
+        obj = cls(url=url)  # type: ignore
+        if url and obj.archive_path.exists():
+            return obj.load(obj.archive_path)
+
         filelist = [
             os.path.join(cls.download_to, x) for x in os.listdir(cls.download_to)
         ]
@@ -103,7 +539,9 @@ class ZipDownloader(FileDownloader):
         n = int(result[0]) if len(result) > 0 else 0
         return n
 
-    def sort_by_file_no(self, filelist: List[Path], reverse: bool = True) -> List[Path]:
+    def sort_by_file_no(
+        self, filelist: List[FileHandle], reverse: bool = True
+    ) -> List[FileHandle]:
         result = list(sorted(filelist, key=lambda x: self.get_file_key(x.name)))
         result = list(reversed(result)) if reverse else result
         return result
@@ -112,8 +550,7 @@ class ZipDownloader(FileDownloader):
 if __name__ == "__main__":
     # url = urljoin(conf.COLLECTOR_BASE_URL, conf.COLLECTOR_URL_PATH)
     # d = ZipDownloader(url)
-    # r = d.get()
-    # d.unpack(r)
-    # fp = d.paths[0]
+    # d.fetch()
+    # member = d.members[0]
     z = ZipDownloader.from_existing()
     z.paths
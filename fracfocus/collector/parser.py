@@ -1,14 +1,13 @@
 from __future__ import annotations
-from typing import Any, Callable, List, Union, Dict
+from typing import Any, Callable, List, Optional, Union, Dict
 import functools
 import logging
 import re
 from datetime import datetime
 from pydoc import locate
-import dateutil.parser
-
 import util
 from config import get_active_config
+from util.dt import DateParser
 
 conf = get_active_config()
 
@@ -162,6 +161,7 @@ class Parser:
         self.name = name or ""
         self.rules = rules
         self.parse_dtypes = parse_dtypes
+        self.date_parsers: Dict[Optional[str], DateParser] = {}
 
     def __repr__(self):
         return f"Parser - {self.name}: {len(self.rules)} rules"
@@ -186,11 +186,21 @@ class Parser:
     def try_float(s: str) -> float:
         return float(s)
 
-    @staticmethod
+    def date_parser(self, column: str = None) -> DateParser:
+        """ Each column gets its own date parser so formats are detected per
+            column, as they are in schema mode """
+        parser = self.date_parsers.get(column)
+        if parser is None:
+            parser = self.date_parsers[column] = DateParser(
+                sample_size=conf.PARSER_DATE_SAMPLE_SIZE,
+                cache_size=conf.PARSER_DATE_CACHE_SIZE,
+            )
+        return parser
+
     @safe_convert
-    def try_date(s: str) -> datetime:
+    def try_date(self, s: str, column: str = None) -> datetime:
         if s is not None:
-            return dateutil.parser.parse(s)
+            return self.date_parser(column)(s)
         else:
             return s
 
@@ -228,16 +238,17 @@ class Parser:
 
         return all(checks) if not return_partials else checks
 
-    def parse_dtype(self, value: str) -> Union[int, float, str, datetime]:
+    def parse_dtype(
+        self, value: str, column: str = None
+    ) -> Union[int, float, str, datetime]:
         funcs = [
-            "try_int",
-            "try_float",
-            "try_date",
-            "try_bool",
+            self.try_int,
+            self.try_float,
+            functools.partial(self.try_date, column=column),
+            self.try_bool,
         ]
 
-        for fname in funcs:
-            func = getattr(self, fname)
+        for func in funcs:
             newvalue = func(value)
             logger.debug(
                 f"Parsed dtype: {value or 'None':<20} -> {newvalue or 'None'} ({type(newvalue).__name__})"
@@ -249,12 +260,12 @@ class Parser:
         value = self.try_empty_str_to_none(value)
         return value
 
-    def parse(self, value: Any) -> Any:
+    def parse(self, value: Any, column: str = None) -> Any:
         """ Attempt to parse a value if all checks are satisfied """
         if not self.run_checks(value):
             return value
         else:
-            return self.parse_dtype(value) if self.parse_dtypes else value
+            return self.parse_dtype(value, column) if self.parse_dtypes else value
 
 
 if __name__ == "__main__":
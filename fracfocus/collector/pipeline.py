@@ -0,0 +1,292 @@
+""" Concurrent read -> transform -> write pipeline connected by bounded queues """
+
+from __future__ import annotations
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+from collections import deque
+import logging
+import queue
+import threading
+from timeit import default_timer as timer
+
+import metrics
+import util
+
+logger = logging.getLogger(__name__)
+
+Row = Dict[str, Any]
+
+_DONE = object()  # end of stream marker
+
+
+class PipelineError(Exception):
+    pass
+
+
+class StageStats:
+    """ Throughput and queue depth counters for a single pipeline stage """
+
+    def __init__(self, name: str, inbox: queue.Queue = None):
+        self.name = name
+        self.inbox = inbox
+        self.batches = 0
+        self.rows = 0
+        self.busy = 0.0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.name}: {self.rows} rows ({self.rows_per_second}/s), queue depth {self.depth}"  # noqa
+
+    @property
+    def depth(self) -> int:
+        return self.inbox.qsize() if self.inbox is not None else 0
+
+    @property
+    def rows_per_second(self) -> float:
+        return round(self.rows / self.busy, 2) if self.busy else 0.0
+
+    def record(self, rows: int, seconds: float):
+        with self._lock:
+            self.batches += 1
+            self.rows += rows
+            self.busy += seconds
+
+    def sample_depth(self):
+        self.max_depth = max(self.max_depth, self.depth)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "busy_seconds": round(self.busy, 2),
+            "rows_per_second": self.rows_per_second,
+            "queue_depth": self.depth,
+            "max_queue_depth": self.max_depth,
+        }
+
+
+class Pipeline:
+    """ Reads, transforms, and writes rows in concurrent stages so that parsing
+        and database writes overlap.
+
+        reader:      a thread that pulls raw rows from the source in batches
+        transformer: a pool of threads that transform each batch
+        writer:      runs in the calling thread (which owns the database session)
+                     and writes transformed rows in chunks of write_size
+
+        Stages are connected by bounded queues, so a slow stage applies
+        backpressure to the ones ahead of it and the number of rows in memory
+        stays bounded. Batches are written in the order they were read, even
+        with multiple transformers. Transformers share the GIL, so additional
+        transformers mostly help when writes are the bottleneck.
+
+        If given, checkpoint is called after each write with the number of
+        source rows whose output has been written, so that a later run can
+        start after them. It only advances at the end of a read batch. """
+
+    poll_interval = 0.1  # seconds
+
+    def __init__(
+        self,
+        source: Iterable[Row],
+        transform: Callable[[Row], Optional[Row]],
+        write: Callable[[List[Row]], Any],
+        read_size: int = 1000,
+        write_size: int = 10000,
+        transformers: int = 1,
+        queue_size: int = 8,
+        name: str = None,
+        checkpoint: Callable[[int], Any] = None,
+    ):
+        self.name = name or "pipeline"
+        self.source = source
+        self.transform = transform
+        self.write = write
+        self.read_size = read_size
+        self.write_size = write_size
+        self.transformers = max(1, transformers)
+        self.checkpoint = checkpoint
+
+        self.raw: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.transformed: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.reader_stats = StageStats("reader")
+        self.transformer_stats = StageStats("transformer", self.raw)
+        self.writer_stats = StageStats("writer", self.transformed)
+
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def __repr__(self):
+        return f"Pipeline: {self.name} ({self.transformers} transformers)"
+
+    @property
+    def stages(self) -> List[StageStats]:
+        return [self.reader_stats, self.transformer_stats, self.writer_stats]
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {s.name: s.to_dict() for s in self.stages}
+
+    def run(self) -> int:
+        """ Run the pipeline to completion and return the number of rows written """
+        threads = [threading.Thread(target=self._guard(self._read), daemon=True)]
+        threads += [
+            threading.Thread(target=self._guard(self._transform), daemon=True)
+            for _ in range(self.transformers)
+        ]
+        for t in threads:
+            t.start()
+
+        try:
+            self._write()
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._stop.set()
+            for t in threads:
+                t.join()
+
+        if self._error is not None:
+            raise PipelineError(f"{self.name} failed: {self._error}") from self._error
+
+        self.report()
+        return self.writer_stats.rows
+
+    def report(self):
+        stats = self.stats
+        logger.info(
+            f"{self.name}: "
+            + ", ".join(
+                f"{name}={s['rows_per_second']} rows/s" for name, s in stats.items()
+            ),
+            extra={"pipeline": stats},
+        )
+        for name, s in stats.items():
+            tags = {"pipeline": self.name, "stage": name}
+            metrics.post(
+                "pipeline.rows_per_second", s["rows_per_second"], "gauge", tags
+            )
+            metrics.post(
+                "pipeline.max_queue_depth", s["max_queue_depth"], "gauge", tags
+            )
+
+    def _guard(self, func: Callable) -> Callable:
+        def wrapper():
+            try:
+                func()
+            except BaseException as e:  # pylint: disable=broad-except
+                self._fail(e)
+
+        return wrapper
+
+    def _fail(self, e: BaseException):
+        if self._error is None:
+            self._error = e
+            logger.error(f"{self.name} stopped: {e}")
+        self._stop.set()
+
+    def _put(self, q: queue.Queue, item: Any, stats: StageStats):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=self.poll_interval)
+                stats.sample_depth()
+                return
+            except queue.Full:
+                continue
+        raise PipelineError("pipeline stopped")
+
+    def _get(self, q: queue.Queue) -> Any:
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
+        raise PipelineError("pipeline stopped")
+
+    def _read(self):
+        rows = iter(self.source)
+        seq = 0
+        while True:
+            ts = timer()
+            batch = list(next(util.chunks(rows, self.read_size), []))
+            if not batch:
+                break
+            self.reader_stats.record(len(batch), timer() - ts)
+            self._put(self.raw, (seq, batch), self.transformer_stats)
+            seq += 1
+
+        for _ in range(self.transformers):
+            self._put(self.raw, _DONE, self.transformer_stats)
+
+    def _transform(self):
+        transform = self.transform
+        while True:
+            item = self._get(self.raw)
+            if item is _DONE:
+                self._put(self.transformed, _DONE, self.writer_stats)
+                return
+            seq, batch = item
+            ts = timer()
+            rows = [r for r in (transform(row) for row in batch) if r is not None]
+            self.transformer_stats.record(len(rows), timer() - ts)
+            self._put(self.transformed, (seq, rows, len(batch)), self.writer_stats)
+
+    def _write(self):
+        pending: Dict[int, Tuple[List[Row], int]] = {}  # arrived ahead of their turn
+        next_seq = 0
+        buffer: List[Row] = []
+        finished = 0
+
+        # (rows buffered, source rows read) at the end of each read batch, until
+        # every row buffered from that batch has been written
+        marks: Deque[Tuple[int, int]] = deque()
+        buffered = 0
+        read = 0
+        written = 0
+        committed = 0
+
+        def flush(rows: List[Row]):
+            nonlocal written, committed
+            self._flush(rows)
+            written += len(rows)
+            position = committed
+            while marks and marks[0][0] <= written:
+                position = marks.popleft()[1]
+            if position != committed:
+                committed = position
+                self._checkpoint(committed)
+
+        while finished < self.transformers:
+            item = self._get(self.transformed)
+            if item is _DONE:
+                finished += 1
+                continue
+
+            seq, rows, n = item
+            pending[seq] = (rows, n)
+            while next_seq in pending:
+                rows, n = pending.pop(next_seq)
+                buffer.extend(rows)
+                buffered += len(rows)
+                read += n
+                marks.append((buffered, read))
+                next_seq += 1
+
+            while len(buffer) >= self.write_size:
+                flush(buffer[: self.write_size])
+                buffer = buffer[self.write_size :]
+
+        if buffer:
+            flush(buffer)
+        if read != committed:  # trailing batches with nothing to write
+            self._checkpoint(read)
+
+    def _flush(self, rows: List[Row]):
+        ts = timer()
+        self.write(rows)
+        self.writer_stats.record(len(rows), timer() - ts)
+        logger.debug(f"{self.name}: {self.stages}")
+
+    def _checkpoint(self, position: int):
+        if self.checkpoint is not None:
+            self.checkpoint(position)
@@ -1,6 +1,7 @@
 from __future__ import annotations
-from typing import Callable, Dict, List, Union  # pylint: disable=unused-import
+from typing import Any, Callable, Dict, List, Union  # pylint: disable=unused-import
 
+import functools
 import logging
 from config import get_active_config
 
@@ -45,11 +46,21 @@ class RowParser(object):
         return util.apply_transformation(data, sp.normalize, keys=True, values=False)
 
     def parse_value_dtypes(self, data: Dict) -> Dict:
+        return {k: self.parse_value(v, column=k) for k, v in data.items()}
+
+    def parse_value(self, value: Any, column: str = None) -> Any:
+        """ Parse a single value of a column with each attached parser """
+        return util.apply_transformation(
+            value,
+            functools.partial(self._parse_value, column=column),
+            keys=False,
+            values=True,
+        )
+
+    def _parse_value(self, value: Any, column: str = None) -> Any:
         for parser in self.parsers:
-            data = util.apply_transformation(
-                data, parser.parse, keys=False, values=True
-            )
-        return data
+            value = parser.parse(value, column=column)
+        return value
 
     def parse(self, row: dict, parse_dtypes: bool = True, **kwargs) -> Dict:
         # parsed = self.normalize_keys(row)
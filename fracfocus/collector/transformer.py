@@ -1,9 +1,13 @@
 from __future__ import annotations
 from typing import Dict, List, Callable, Union, Optional
+import hashlib
 import logging
 from datetime import date, datetime
 
 
+from flask_sqlalchemy import Model
+
+from collector.converters import Converter, compile_converters
 from collector.parser import Parser
 from collector.row_parser import RowParser
 from config import get_active_config
@@ -21,8 +25,25 @@ class TransformationError(Exception):
     pass
 
 
+def row_hash(row: Row) -> str:
+    """ Digest of a row's values, stable from run to run for the same content """
+    content = "\x1f".join(f"{k}\x1e{row[k]!r}" for k in sorted(row))
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+
 class Transformer(object):
-    parser = RowParser.load_from_config(conf.PARSER_CONFIG)
+    """ Renames, filters, and converts the values of raw rows.
+
+        Two parsing modes are supported:
+            schema: each value is converted once by a converter compiled from the
+                    type of its destination column in the model. Values that can't
+                    be converted, and columns the model doesn't define, fall back
+                    to the regex parser.
+            regex:  every value is run through the regex parser rules and the
+                    parser guesses its type.
+
+        Schema mode is only available when a model is given.
+    """
 
     def __init__(
         self,
@@ -30,24 +51,50 @@ class Transformer(object):
         exclude: List[str] = None,
         normalize: bool = False,
         parser: Parser = None,
+        model: Model = None,
+        mode: str = None,
     ):
         self.normalize = normalize
         self.aliases = aliases or {}
         self.exclude = exclude or []
         self.errors: List[str] = []
-        self.parser = parser or self.parser
+        self.parser = parser or RowParser.load_from_config(conf.PARSER_CONFIG)
+        self.model = model
+        self.mode = mode or conf.PARSER_MODE
+        self.converters: Dict[str, Converter] = {}
+
+        if self.mode == "schema" and model is not None:
+            self.converters = compile_converters(
+                model.__table__.columns, fallback=self.parser.parse_value
+            )
+        elif self.mode != "regex":
+            logger.debug(
+                f"Schema parsing unavailable (mode={self.mode}, model={model}). "
+                "Using regex parsing."
+            )
+            self.mode = "regex"
 
     def __repr__(self):
-        return (
-            f"Transformer: {len(self.aliases)} aliases, {len(self.exclude)} exclusions"
-        )
+        return f"Transformer: {len(self.aliases)} aliases, {len(self.exclude)} exclusions ({self.mode} parsing)"  # noqa
+
+    def convert(self, row: Row) -> Row:
+        """ Apply each column's compiled converter to its value """
+        fallback = self.parser.parse_value
+        converters = self.converters
+        return {
+            k: converters[k](v) if k in converters else fallback(v, column=k)
+            for k, v in row.items()
+        }
 
     def transform(self, row: dict) -> Row:
 
         try:
             row = self.drop_exclusions(row)
             row = self.apply_aliases(row)
-            row = self.parser.parse(row)
+            if self.converters:
+                row = self.convert(row)
+            else:
+                row = self.parser.parse(row)
 
             if "api14" in row.keys():
                 row["api14"] = str(row["api14"])
@@ -85,4 +132,3 @@ if __name__ == "__main__":
     ep = Endpoint.load_from_config(conf)["registry"]
     t = Transformer(ep.mappings.aliases, ep.exclude)
     t.transform(row)
-
@@ -51,7 +51,10 @@ class Yammler(dict):
         """ Safely write to file """
         _fspath = fspath
         _mode = mode
-        _file = tempfile.NamedTemporaryFile(_mode, delete=False)
+        # create the temp file alongside the target so the rename stays on one filesystem
+        _dir = os.path.dirname(os.path.abspath(_fspath))
+        os.makedirs(_dir, exist_ok=True)
+        _file = tempfile.NamedTemporaryFile(_mode, delete=False, dir=_dir)
 
         try:
             yield _file
@@ -110,11 +110,45 @@ class BaseConfig:
     )
     COLLECTOR_DOWNLOAD_PATH = os.getenv("FRACFOCUS_DOWNLOAD_PATH", "/tmp/fracfocus")
     COLLECTOR_WRITE_SIZE = int(os.getenv("FRACFOCUS_WRITE_SIZE", "10000"))
+    COLLECTOR_WORKERS = int(os.getenv("FRACFOCUS_WORKERS", "1"))
+    COLLECTOR_READ_SIZE = int(os.getenv("FRACFOCUS_READ_SIZE", "1000"))
+    COLLECTOR_TRANSFORMERS = int(os.getenv("FRACFOCUS_TRANSFORMERS", "1"))
+    COLLECTOR_QUEUE_SIZE = int(os.getenv("FRACFOCUS_QUEUE_SIZE", "8"))
+    COLLECTOR_COPY_BUFFER_SIZE = int(
+        os.getenv("FRACFOCUS_COPY_BUFFER_SIZE", str(64 * 1024))
+    )  # characters per read when streaming rows through COPY
     COLLECTOR_FILE_PREFIX = os.getenv("FRACFOCUS_FILE_PREFIX", "FracFocusRegistry")
+    COLLECTOR_FILE_ENCODING = os.getenv("FRACFOCUS_FILE_ENCODING", "utf-8")
+    # download validators are kept in the database unless this names a yaml
+    # file instead, which must then be on persistent storage
+    COLLECTOR_CACHE_PATH = os.getenv("FRACFOCUS_CACHE_PATH")
+    COLLECTOR_DOWNLOAD_CHUNK_SIZE = int(
+        os.getenv("FRACFOCUS_DOWNLOAD_CHUNK_SIZE", str(1024 * 1024))
+    )  # bytes
+    COLLECTOR_DOWNLOAD_SEGMENTS = int(os.getenv("FRACFOCUS_DOWNLOAD_SEGMENTS", "1"))
+    COLLECTOR_DOWNLOAD_LOG_INTERVAL = float(
+        os.getenv("FRACFOCUS_DOWNLOAD_LOG_INTERVAL", "15")
+    )  # seconds
+    COLLECTOR_PROPPANT_REGEX = os.getenv(
+        "FRACFOCUS_PROPPANT_REGEX", "sand|silica|propp|mesh"
+    )  # case insensitive match on ingredient_name
+    COLLECTOR_REFRESH_SUMMARY = to_bool(os.getenv("FRACFOCUS_REFRESH_SUMMARY", True))
+    COLLECTOR_DEAD_LETTER_PATH = os.getenv(
+        "FRACFOCUS_DEAD_LETTER_PATH", "/tmp/fracfocus/rejected"
+    )  # rows the database refused are appended to {table}.ndjson here
+    COLLECTOR_SWAP_LOCK_TIMEOUT = os.getenv(
+        "FRACFOCUS_SWAP_LOCK_TIMEOUT", "30s"
+    )  # how long a full refresh waits for readers before giving up on the swap
+    COLLECTOR_MAX_REJECTS = int(
+        os.getenv("FRACFOCUS_MAX_REJECTS", "1000")
+    )  # per write batch, before the load is failed
 
     """ Parser """
     PARSER_CONFIG_PATH = abs_path(CONFIG_BASEPATH, "parsers.yaml")
     PARSER_CONFIG = load_config(PARSER_CONFIG_PATH)
+    PARSER_MODE = os.getenv("PARSER_MODE", "schema")  # schema | regex
+    PARSER_DATE_SAMPLE_SIZE = int(os.getenv("PARSER_DATE_SAMPLE_SIZE", "10"))
+    PARSER_DATE_CACHE_SIZE = int(os.getenv("PARSER_DATE_CACHE_SIZE", "4096"))
 
     """ Logging """
     LOG_LEVEL = os.getenv("LOG_LEVEL", logging.INFO)
@@ -126,6 +160,33 @@ class BaseConfig:
         os.getenv("WEB_LOG_SLOW_RESPONSE_THRESHOLD", 3)
     )  # seconds # noqa
 
+    """ Web """
+    WEB_STREAM_CHUNK_SIZE = int(os.getenv("WEB_STREAM_CHUNK_SIZE", "1000"))  # rows
+    WEB_CACHE_MAX_AGE = int(os.getenv("WEB_CACHE_MAX_AGE", "300"))  # seconds
+    WEB_COALESCE_REQUESTS = to_bool(os.getenv("WEB_COALESCE_REQUESTS", True))
+    WEB_COMPRESSION_ENABLED = to_bool(os.getenv("WEB_COMPRESSION_ENABLED", True))
+    WEB_COMPRESSION_MIN_SIZE = int(
+        os.getenv("WEB_COMPRESSION_MIN_SIZE", "1024")
+    )  # bytes
+    WEB_COMPRESSION_ENCODINGS = [
+        x.strip()
+        for x in os.getenv("WEB_COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",")
+    ]  # in order of preference; br and zstd are used when brotli/zstandard are installed # noqa
+
+    """ Cache """
+    CACHE_ENABLED = to_bool(os.getenv("CACHE_ENABLED", True))
+    CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")  # memory | sqlite | redis
+    CACHE_PATH = os.getenv("CACHE_PATH", "/tmp/fracfocus/cache.sqlite3")
+    CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+    CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "100000"))  # entries
+    CACHE_MAX_BYTES = int(
+        os.getenv("CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+    )  # memory and sqlite backends
+    CACHE_TTL = float(os.getenv("CACHE_TTL", "3600"))  # seconds
+    CACHE_CHECK_INTERVAL = float(
+        os.getenv("CACHE_CHECK_INTERVAL", "30")
+    )  # seconds between dataset version checks and metrics reports
+
     """ --------------- Sqlalchemy --------------- """
 
     DATABASE_DIALECT = os.getenv("DATABASE_DIALECT", "postgres")
@@ -145,6 +206,9 @@ class BaseConfig:
         "database": DATABASE_NAME,
     }
     SQLALCHEMY_DATABASE_URI = str(make_url(DATABASE_URL_PARAMS))
+    DATABASE_PREPARE_STATEMENTS = to_bool(
+        os.getenv("DATABASE_PREPARE_STATEMENTS", False)
+    )  # server-side prepared statements; unsafe behind pgbouncer in transaction mode # noqa
     DEFAULT_EXCLUSIONS = ["updated_at", "inserted_at"]
 
     @property
@@ -25,7 +25,13 @@ CONTEXT_SETTINGS = dict(
 )
 STATUS_COLOR_MAP = defaultdict(
     lambda: "white",
-    {"success": "green", "error": "red", "timeout": "yellow", "failed": "red"},
+    {
+        "success": "green",
+        "skipped": "green",
+        "error": "red",
+        "timeout": "yellow",
+        "failed": "red",
+    },
 )
 
 conf = get_active_config()
@@ -107,25 +113,118 @@ def ipython_embed():
     "use_existing",
     "--use-existing",
     "-e",
-    help=f"Use previously downloaded files (must be located at {conf.COLLECTOR_DOWNLOAD_PATH})",
+    help=f"Use a previously downloaded archive or extracted files (must be located at {conf.COLLECTOR_DOWNLOAD_PATH})",
     is_flag=True,
 )
-def collector(update_on_conflict, ignore_on_conflict, use_existing):
+@click.option(
+    "force",
+    "--force",
+    "-f",
+    help="Download and collect the archive even if it is unchanged since the last run",
+    is_flag=True,
+)
+@click.option(
+    "segments",
+    "--segments",
+    "-s",
+    help="Number of parallel range requests used to download the archive",
+    show_default=True,
+    default=conf.COLLECTOR_DOWNLOAD_SEGMENTS,
+    type=int,
+)
+@click.option(
+    "use_copy",
+    "--copy",
+    "-c",
+    help="Bulk load through a staging table using COPY instead of multi-row INSERTs",
+    is_flag=True,
+)
+@click.option(
+    "workers",
+    "--workers",
+    "-w",
+    help="Number of worker processes used to collect files in parallel",
+    show_default=True,
+    default=conf.COLLECTOR_WORKERS,
+    type=int,
+)
+@click.option(
+    "full_refresh",
+    "--full-refresh",
+    help="Reload the registry from scratch into a shadow table and swap it in when complete",
+    is_flag=True,
+)
+@click.option(
+    "resume",
+    "--resume",
+    "-r",
+    help="Skip files a previous run finished and restart interrupted ones from their last checkpoint",
+    is_flag=True,
+)
+def collector(
+    update_on_conflict,
+    ignore_on_conflict,
+    use_existing,
+    force,
+    segments,
+    use_copy,
+    workers,
+    full_refresh,
+    resume,
+):
     "Run a one-off task to synchronize from the fracfocus data source"
+    if full_refresh and resume:
+        raise click.UsageError("--resume can't be combined with --full-refresh")
+
     logger.info(conf)
 
     endpoints = Endpoint.load_from_config(conf)
     coll = FracFocusCollector(endpoints["registry"])
     url = util.urljoin(conf.COLLECTOR_BASE_URL, conf.COLLECTOR_URL_PATH)
     if not use_existing:
-        downloader = ZipDownloader(url)
-        req = downloader.get()
-        filelist = downloader.unpack(req).paths
+        downloader = ZipDownloader(url, segments=segments)
+        if not force and not downloader.is_modified():
+            logger.info(
+                f"No changes to {url} since the last collection. Nothing to do.",
+                extra={"collector_result": "noop"},
+            )
+            metrics.post("collector.noop", 1)
+            return
+        filelist = downloader.fetch().files
     else:
-        downloader = ZipDownloader.from_existing()
-        filelist = downloader.paths
+        downloader = ZipDownloader.from_existing(url)
+        filelist = downloader.files
 
-    coll.collect(filelist, update_on_conflict, ignore_on_conflict)
+    if full_refresh:
+        results = coll.full_refresh(filelist, workers=workers)
+    else:
+        results = coll.collect(
+            filelist,
+            update_on_conflict,
+            ignore_on_conflict,
+            use_copy=use_copy,
+            workers=workers,
+            resume=resume,
+        )
+
+    for result in results:
+        click.secho(
+            "{file:>50} {status:<10} {rows:>10} rows {seconds}s".format(
+                **{"seconds": None, **result}
+            ),
+            fg=STATUS_COLOR_MAP[result["status"]],
+        )
+
+    if any(r["rows"] for r in results):
+        DatasetVersion.stamp()  # invalidates api caches
+
+    failed = [r for r in results if r["status"] not in ("success", "skipped")]
+    if failed:
+        logger.error(f"Failed to collect {len(failed)} of {len(results)} files")
+        sys.exit(1)
+
+    if not use_existing:
+        downloader.save_validators()
 
 
 @run_cli.command(context_settings=dict(ignore_unknown_options=True))
@@ -50,6 +50,11 @@ def ensure_list(value: Any) -> List[Any]:
     return value
 
 
+def dedupe(values: Iterable) -> List[Any]:
+    """ Remove duplicates, preserving order """
+    return list(dict.fromkeys(values))
+
+
 def hf_size(size_bytes: Union[str, int]) -> str:
     """Human friendly string representation of a size in bytes.
 
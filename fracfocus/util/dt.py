@@ -1,8 +1,113 @@
+from typing import Callable, List, Optional, Tuple, Union
 from datetime import datetime
+import functools
+import logging
 
+import dateutil.parser
 import pytz
 
+logger = logging.getLogger(__name__)
+
 
 def utcnow():
     """ Get the current datetime in utc as a datetime object with timezone information """
     return datetime.now().astimezone(pytz.utc)
+
+
+def parse_mdy(value: str) -> datetime:
+    """ Parse US formatted dates with an optional 12 or 24 hour time component.
+
+        Example: "9/11/2014 12:00:00 AM" -> datetime(2014, 9, 11, 0, 0)
+    """
+    date_part, _, time_part = value.strip().partition(" ")
+    month, day, year = date_part.split("/")
+    if len(year) != 4:
+        raise ValueError(f"Expected a four digit year: {value}")
+
+    hour = minute = second = 0
+    if time_part:
+        clock, _, meridiem = time_part.partition(" ")
+        hour, minute, second = [int(x) for x in clock.split(":")]
+        meridiem = meridiem.upper()
+        if meridiem:
+            if meridiem not in ("AM", "PM") or not 1 <= hour <= 12:
+                raise ValueError(f"Invalid 12 hour time: {value}")
+            hour = hour % 12 + (12 if meridiem == "PM" else 0)
+
+    return datetime(int(year), int(month), int(day), hour, minute, second)
+
+
+class Unparseable:
+    """ Memoized parse failure """
+
+    def __init__(self, message: str):
+        self.message = message
+
+
+class DateParser:
+    """ Parses date strings that tend to share a single format, such as the values
+        of one column.
+
+        The format is detected from the first values parsed (up to sample_size
+        attempts) and applied to every value after that. Results are memoized in
+        a bounded LRU cache, and dateutil is used only for values the detected
+        format can't handle.
+    """
+
+    formats: List[Tuple[str, Callable[[str], datetime]]] = [
+        ("M/D/YYYY h:mm:ss AM", parse_mdy),
+        ("ISO 8601", datetime.fromisoformat),
+    ]
+
+    def __init__(self, sample_size: int = 10, cache_size: int = 4096):
+        self.sample_size = sample_size
+        self.fmt: Optional[str] = None
+        self.fallbacks = 0
+        self._func: Optional[Callable[[str], datetime]] = None
+        self._attempts = 0
+        self.parse = functools.lru_cache(maxsize=cache_size)(self._parse)
+        self.__name__ = type(self).__name__
+
+    def __repr__(self):
+        return f"DateParser: {self.fmt or 'undetected'} ({self.parse.cache_info()})"
+
+    def __call__(self, value: str) -> datetime:
+        result = self.parse(value)
+        if isinstance(result, Unparseable):
+            raise ValueError(result.message)
+        return result
+
+    def detect(self, value: str) -> Optional[Tuple[str, Callable[[str], datetime]]]:
+        for name, func in self.formats:
+            try:
+                func(value)
+                return name, func
+            except (TypeError, ValueError):
+                continue
+        return None
+
+    def _parse(self, value: str) -> Union[datetime, Unparseable]:
+        """ Parse a value, returning failures instead of raising them so they're
+            memoized as well """
+        if self._func is not None:
+            try:
+                return self._func(value)
+            except (TypeError, ValueError):
+                pass
+        elif self._attempts < self.sample_size:
+            detected = self.detect(value)
+            if detected:
+                self.fmt, self._func = detected
+                logger.debug(f"Detected date format: {self.fmt} (from {value})")
+                return self._func(value)
+
+        self.fallbacks += 1
+        try:
+            result = dateutil.parser.parse(value)
+        except (TypeError, ValueError, OverflowError) as e:
+            return Unparseable(f"Unable to parse date: {value} ({e})")
+
+        # only values that are dates count against the detection sample
+        if self._func is None:
+            self._attempts += 1
+        return result
@@ -4,6 +4,18 @@ from typing import Any
 import json
 from datetime import datetime, date, timedelta
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """ Encode obj as compact JSON, using orjson when it is installed """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
 
 class DateTimeEncoder(json.JSONEncoder):
     def default(self, obj):
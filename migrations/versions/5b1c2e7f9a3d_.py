@@ -0,0 +1,50 @@
+"""add registry.is_proppant
+
+Revision ID: 5b1c2e7f9a3d
+Revises: ef074201f4ed
+Create Date: 2026-10-18 11:30:00.000000
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5b1c2e7f9a3d"
+down_revision = "ef074201f4ed"
+branch_labels = None
+depends_on = None
+
+PROPPANT_REGEX = os.getenv("FRACFOCUS_PROPPANT_REGEX", "sand|silica|propp|mesh")
+
+
+def upgrade():
+    op.add_column(
+        "registry",
+        sa.Column(
+            "is_proppant", sa.Boolean(), server_default=sa.false(), nullable=False
+        ),
+    )
+    # backfill existing rows; only proppants need to be rewritten. The
+    # updated_at trigger is disabled so the backfill doesn't mark them as updated.
+    op.execute("ALTER TABLE registry DISABLE TRIGGER tg_registry_updated_at")
+    op.execute(
+        sa.text(
+            "UPDATE registry SET is_proppant = true WHERE ingredient_name ~* :regex"
+        ).bindparams(regex=PROPPANT_REGEX)
+    )
+    op.execute("ALTER TABLE registry ENABLE TRIGGER tg_registry_updated_at")
+    op.create_index(
+        "ix_registry_api14_is_proppant",
+        "registry",
+        ["api14"],
+        unique=False,
+        postgresql_where=sa.text("is_proppant"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_registry_api14_is_proppant", table_name="registry")
+    op.drop_column("registry", "is_proppant")
@@ -0,0 +1,75 @@
+"""add completion_summary
+
+Revision ID: 8c4d0a6e2f17
+Revises: 5b1c2e7f9a3d
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8c4d0a6e2f17"
+down_revision = "5b1c2e7f9a3d"
+branch_labels = None
+depends_on = None
+
+# same calculation as Registry.completion_calcs
+BACKFILL = """
+INSERT INTO completion_summary (
+    api14, api10, total_base_water_volume, ingredient_mass, hf_job_pct,
+    updated_at, water_mass, prop_mass, mass_diff_pct
+)
+SELECT
+    api14, api10, total_base_water_volume, ingredient_mass, hf_job_pct,
+    updated_at, water_mass, prop_mass,
+    ((prop_mass - ingredient_mass)
+        / CASE WHEN ingredient_mass = 0 THEN prop_mass END) * 100
+FROM (
+    SELECT *, (water_mass * hf_job_pct) / 100 AS prop_mass
+    FROM (
+        SELECT *, total_base_water_volume * 8.33 AS water_mass
+        FROM (
+            SELECT
+                api14,
+                max(api10) AS api10,
+                max(total_base_water_volume) AS total_base_water_volume,
+                CAST(sum(ingredient_mass) AS INTEGER) AS ingredient_mass,
+                sum(percent_hf_job) AS hf_job_pct,
+                max(updated_at) AS updated_at
+            FROM registry
+            WHERE is_proppant
+            GROUP BY api14
+        ) AS agg
+    ) AS agg2
+) AS agg3
+"""
+
+
+def upgrade():
+    op.create_table(
+        "completion_summary",
+        sa.Column("api14", sa.String(length=14), nullable=False),
+        sa.Column("api10", sa.String(length=10), nullable=True),
+        sa.Column("total_base_water_volume", sa.BigInteger(), nullable=True),
+        sa.Column("ingredient_mass", sa.Integer(), nullable=True),
+        sa.Column("hf_job_pct", sa.Float(), nullable=True),
+        sa.Column("water_mass", sa.Numeric(), nullable=True),
+        sa.Column("prop_mass", sa.Float(), nullable=True),
+        sa.Column("mass_diff_pct", sa.Float(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint("api14"),
+    )
+    op.create_index(
+        op.f("ix_completion_summary_api10"),
+        "completion_summary",
+        ["api10"],
+        unique=False,
+    )
+    op.execute(BACKFILL)
+
+
+def downgrade():
+    op.drop_index(op.f("ix_completion_summary_api10"), table_name="completion_summary")
+    op.drop_table("completion_summary")
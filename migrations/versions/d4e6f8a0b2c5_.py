@@ -0,0 +1,27 @@
+"""add registry.row_hash
+
+Revision ID: d4e6f8a0b2c5
+Revises: a3f8b2d61c90
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d4e6f8a0b2c5"
+down_revision = "a3f8b2d61c90"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # left null on existing rows; the next load of each row fills it in
+    op.add_column(
+        "registry", sa.Column("row_hash", sa.String(length=32), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_column("registry", "row_hash")
@@ -0,0 +1,45 @@
+"""add ingest_ledger
+
+Revision ID: e7a9c1b3d5f6
+Revises: d4e6f8a0b2c5
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e7a9c1b3d5f6"
+down_revision = "d4e6f8a0b2c5"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "ingest_ledger",
+        sa.Column("run_id", sa.String(length=32), nullable=False),
+        sa.Column("file", sa.String(), nullable=False),
+        sa.Column("file_hash", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("start_row", sa.Integer(), nullable=False),
+        sa.Column("last_row", sa.Integer(), nullable=False),
+        sa.Column("rows_read", sa.Integer(), nullable=False),
+        sa.Column("rows_written", sa.Integer(), nullable=False),
+        sa.Column("rows_rejected", sa.Integer(), nullable=False),
+        sa.Column("error", sa.String(), nullable=True),
+        sa.Column("seconds", sa.Float(), nullable=True),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint("run_id", "file"),
+    )
+    op.create_index(
+        "ix_ingest_ledger_file", "ingest_ledger", ["file", "file_hash"], unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("ix_ingest_ledger_file", table_name="ingest_ledger")
+    op.drop_table("ingest_ledger")
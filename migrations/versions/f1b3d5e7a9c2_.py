@@ -0,0 +1,33 @@
+"""add download_validators
+
+Revision ID: f1b3d5e7a9c2
+Revises: e7a9c1b3d5f6
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "f1b3d5e7a9c2"
+down_revision = "e7a9c1b3d5f6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "download_validators",
+        sa.Column("url", sa.String(), nullable=False),
+        sa.Column(
+            "validators", postgresql.JSONB(astext_type=sa.Text()), nullable=False
+        ),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("url"),
+    )
+
+
+def downgrade():
+    op.drop_table("download_validators")
@@ -0,0 +1,369 @@
+# pylint: disable=missing-function-docstring,missing-module-docstring,no-self-use
+import fnmatch
+import socketserver
+import threading
+import time
+
+import pytest  # noqa
+
+from api.cache import (
+    CacheBackend,
+    CompletionCache,
+    LRUCache,
+    RedisCache,
+    SingleFlight,
+    SQLiteCache,
+)
+
+WELLS = {
+    "42461409160000": {"api14": "42461409160000", "api10": "4246140916"},
+    "42461409160100": {"api14": "42461409160100", "api10": "4246140916"},
+    "42383406370000": {"api14": "42383406370000", "api10": "4238340637"},
+}
+
+
+class Loader:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, api10s=None, api14s=None):
+        self.calls.append(api10s or api14s)
+        if api10s:
+            return [r for r in WELLS.values() if r["api10"] in api10s]
+        return [WELLS[x] for x in api14s if x in WELLS]
+
+
+@pytest.fixture
+def loader():
+    yield Loader()
+
+
+class TestLRUCache:
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set_many({"a": 1, "b": 2})
+        cache.get_many(["a"])
+        cache.set_many({"c": 3})
+        assert cache.get_many(["a", "b", "c"]) == {"a": 1, "c": 3}
+        stats = cache.stats()
+        assert (stats["size"], stats["evictions"]) == (2, 1)
+
+    def test_evicts_over_max_bytes(self):
+        cache = LRUCache(max_bytes=1000)
+        cache.set_many({str(i): "x" * 100 for i in range(20)})
+        stats = cache.stats()
+        assert 0 < stats["bytes"] <= 1000
+        assert stats["size"] + stats["evictions"] == 20
+        assert "19" in cache.get_many(["0", "19"])
+
+    def test_expires_entries(self):
+        cache = LRUCache(ttl=0.05)
+        cache.set_many({"a": 1})
+        assert cache.get_many(["a"]) == {"a": 1}
+        time.sleep(0.1)
+        assert cache.get_many(["a"]) == {}
+        assert len(cache) == 0
+
+
+class TestSQLiteCache:
+    def test_shared_between_instances(self, tmp_path):
+        path = str(tmp_path / "cache.sqlite3")
+        SQLiteCache(path).set_many({"a": {"api14": "42461409160000"}, "b": None})
+        assert SQLiteCache(path).get_many(["a", "b", "c"]) == {
+            "a": {"api14": "42461409160000"},
+            "b": None,
+        }
+
+    def test_expires_entries(self, tmp_path):
+        cache = SQLiteCache(str(tmp_path / "cache.sqlite3"), ttl=0.05)
+        cache.set_many({"a": 1})
+        time.sleep(0.1)
+        assert cache.get_many(["a"]) == {}
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        cache = SQLiteCache(str(tmp_path / "cache.sqlite3"), maxsize=10)
+        for i in range(25):
+            cache.set_many({str(i): i})
+        stats = cache.stats()
+        assert (stats["size"], stats["evictions"]) == (10, 15)
+        assert cache.get_many(["0", "24"]) == {"24": 24}
+
+    def test_evicts_over_max_bytes(self, tmp_path):
+        cache = SQLiteCache(str(tmp_path / "cache.sqlite3"), max_bytes=5000)
+        cache.set_many({str(i): "x" * 1000 for i in range(20)})
+        assert 0 < cache.stats()["bytes"] <= 5000
+
+
+class RESPServer(socketserver.ThreadingTCPServer):
+    """ Minimal stand-in for a Redis server, answering the commands RedisCache
+        issues over the Redis protocol from an in-memory dict """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RESPHandler)
+        self.data = {}
+        self.expires = {}
+        self.evicted_keys = 0
+        self.used_memory = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address
+        return f"redis://{host}:{port}/0"
+
+    def live(self, key: bytes) -> bool:
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def command(self, name: bytes, *args: bytes):
+        name = name.upper()
+        if name == b"PING":
+            return "PONG"
+        if name == b"SET":
+            key, value, *options = args
+            self.data[key] = value
+            self.expires.pop(key, None)
+            if options and options[0].upper() == b"PX":
+                self.expires[key] = time.monotonic() + int(options[1]) / 1000
+            return "OK"
+        if name == b"MGET":
+            return [self.data[k] if self.live(k) else None for k in args]
+        if name == b"DBSIZE":
+            return sum(self.live(k) for k in list(self.data))
+        if name == b"DEL":
+            return sum(self.data.pop(k, None) is not None for k in args)
+        if name == b"SCAN":
+            pattern = args[args.index(b"MATCH") + 1].decode()
+            keys = [
+                k
+                for k in list(self.data)
+                if self.live(k) and fnmatch.fnmatchcase(k.decode(), pattern)
+            ]
+            return [b"0", keys]
+        if name == b"INFO":
+            if args and args[0].lower() == b"memory":
+                return f"# Memory\r\nused_memory:{self.used_memory}\r\n".encode()
+            return f"# Stats\r\nevicted_keys:{self.evicted_keys}\r\n".encode()
+        return Exception(f"ERR unknown command '{name.decode()}'")
+
+
+class RESPHandler(socketserver.StreamRequestHandler):
+    def read(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        count = int(line[1:])
+        args = []
+        for _ in range(count):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def encode(self, value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, Exception):
+            return f"-{value}\r\n".encode()
+        if isinstance(value, str):
+            return f"+{value}\r\n".encode()
+        if isinstance(value, int):
+            return f":{value}\r\n".encode()
+        if isinstance(value, list):
+            return f"*{len(value)}\r\n".encode() + b"".join(
+                self.encode(x) for x in value
+            )
+        return f"${len(value)}\r\n".encode() + value + b"\r\n"
+
+    def handle(self):
+        while True:
+            args = self.read()
+            if args is None:
+                return
+            with self.server.lock:
+                reply = self.server.command(*args)
+            self.wfile.write(self.encode(reply))
+
+
+@pytest.fixture
+def resp_server():
+    pytest.importorskip("redis")
+    server = RESPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestRedisCache:
+    def test_set_and_get(self, resp_server):
+        cache = RedisCache(resp_server.url)
+        cache.set_many({"a": {"api14": "42461409160000"}, "b": None})
+        assert cache.get_many(["a", "b", "c"]) == {
+            "a": {"api14": "42461409160000"},
+            "b": None,
+        }
+        assert cache.get_many([]) == {}
+        assert b"fracfocus:cache:a" in resp_server.data
+
+    def test_expires_entries(self, resp_server):
+        cache = RedisCache(resp_server.url, ttl=0.05)
+        cache.set_many({"a": 1})
+        time.sleep(0.1)
+        assert cache.get_many(["a"]) == {}
+
+    def test_stats_read_from_server_counters(self, resp_server):
+        resp_server.used_memory = 1024
+        resp_server.evicted_keys = 3
+        cache = RedisCache(resp_server.url)
+        cache.set_many({"a": 1, "b": 2})
+
+        stats = cache.stats()
+        assert len(cache) == stats["size"] == 2
+        assert (stats["bytes"], stats["evictions"]) == (1024, 3)
+
+    def test_clear_leaves_other_keys(self, resp_server):
+        resp_server.data[b"other:key"] = b"x"
+        cache = RedisCache(resp_server.url)
+        cache.set_many({"a": 1, "b": 2})
+        cache.clear()
+        assert cache.get_many(["a", "b"]) == {}
+        assert list(resp_server.data) == [b"other:key"]
+
+
+class TestCacheBackend:
+    def test_abstract(self):
+        with pytest.raises(TypeError):
+            CacheBackend()  # pylint: disable=abstract-class-instantiated
+
+
+class TestCompletionCache:
+    def test_partial_hit_loads_only_misses(self, loader):
+        cache = CompletionCache(loader)
+        cache.completion_calcs(api14s=["42461409160000"])
+        result = cache.completion_calcs(
+            api14s=["42461409160000", "42383406370000", "00000000000000"]
+        )
+        assert [r["api14"] for r in result] == ["42461409160000", "42383406370000"]
+        assert loader.calls == [
+            ["42461409160000"],
+            ["42383406370000", "00000000000000"],
+        ]
+        assert (cache.hits, cache.misses) == (1, 3)
+
+    def test_caches_wells_without_data(self, loader):
+        cache = CompletionCache(loader)
+        assert cache.completion_calcs(api14s=["00000000000000"]) == []
+        assert cache.completion_calcs(api14s=["00000000000000"]) == []
+        assert len(loader.calls) == 1
+
+    def test_api10_lookup(self, loader):
+        cache = CompletionCache(loader)
+        first = cache.completion_calcs(api10s=["4246140916"])
+        assert len(first) == 2
+        assert cache.completion_calcs(api10s=["4246140916"]) == first
+        assert cache.completion_calcs(api14s=["42461409160100"]) == [
+            WELLS["42461409160100"]
+        ]
+        assert loader.calls == [["4246140916"]]
+
+    def test_version_change_clears_cache(self, loader):
+        versions = iter(["v1", "v1", "v2"])
+        cache = CompletionCache(
+            loader, version=lambda: next(versions), check_interval=0
+        )
+        for _ in range(3):
+            cache.completion_calcs(api14s=["42461409160000"])
+        assert len(loader.calls) == 2
+        assert cache.version == "v2"
+
+    def test_shared_backend_namespaced_by_version(self, loader, tmp_path):
+        versions = iter(["v1", "v2"])
+        backend = SQLiteCache(str(tmp_path / "cache.sqlite3"))
+        cache = CompletionCache(
+            loader, backend=backend, version=lambda: next(versions), check_interval=0
+        )
+        cache.completion_calcs(api14s=["42461409160000"])
+        cache.completion_calcs(api14s=["42461409160000"])
+        assert len(loader.calls) == 2
+        assert len(backend) == 2  # the old version's entry is left to eviction
+
+    def test_reports_off_the_request_path(self, loader):
+        release = threading.Event()
+        reads = []
+
+        class SlowStats(LRUCache):
+            def stats(self):
+                reads.append(1)
+                release.wait(5)
+                return super().stats()
+
+        cache = CompletionCache(loader, backend=SlowStats(), check_interval=0)
+        cache.completion_calcs(api14s=["42461409160000"])  # returns while stats wait
+        cache.completion_calcs(api14s=["42461409160000"])
+        reporter = cache._reporter  # pylint: disable=protected-access
+        assert reporter.is_alive()
+        release.set()
+        reporter.join(5)
+        assert reads == [1]  # a report still running is not started again
+
+
+class TestSingleFlight:
+    def run_concurrently(self, flight, func, n=10):
+        results = []
+        errors = []
+
+        def call():
+            try:
+                results.append(flight.do("key", func))
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(n)]
+        for t in threads:
+            t.start()
+        while flight.stats()["calls"] + flight.stats()["coalesced"] < n:
+            time.sleep(0.01)  # wait until every caller has arrived
+        return threads, results, errors
+
+    def test_coalesces_concurrent_calls(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            release.wait()
+            return ["result"]
+
+        threads, results, _ = self.run_concurrently(flight, func)
+        release.set()
+        for t in threads:
+            t.join()
+
+        assert len(calls) == 1
+        assert results == [["result"]] * 10
+        assert flight.stats() == {"calls": 1, "coalesced": 9, "in_flight": 0}
+        assert flight.do("key", lambda: "again") == "again"
+
+    def test_shares_errors(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def func():
+            release.wait()
+            raise ValueError("bad query")
+
+        threads, results, errors = self.run_concurrently(flight, func)
+        release.set()
+        for t in threads:
+            t.join()
+
+        assert results == []
+        assert len(errors) == 10
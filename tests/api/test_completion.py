@@ -0,0 +1,202 @@
+# pylint: disable=missing-function-docstring,missing-module-docstring,no-self-use
+import json
+
+import pytest  # noqa
+from flask import Flask, request
+
+import api.completion
+from api.completion import (
+    Completions,
+    completion_calcs,
+    completion_etag,
+    parse_api_list,
+)
+from api.cache import CompletionCache
+from api.models import CompletionSummary, Registry
+
+
+@pytest.fixture
+def app():
+    yield Flask(__name__)
+
+
+class TestParseApiList:
+    def test_json_list(self, app):
+        body = ["42461409160000", "4246140916", "42461409160000"]
+        with app.test_request_context(method="POST", json=body):
+            assert parse_api_list(request) == {
+                "api10": ["4246140916"],
+                "api14": ["42461409160000"],
+            }
+
+    def test_json_object(self, app):
+        body = {"api14": ["42461409160000", "42383406370000"]}
+        with app.test_request_context(method="POST", json=body):
+            assert parse_api_list(request) == {
+                "api10": [],
+                "api14": ["42461409160000", "42383406370000"],
+            }
+
+    def test_newline_delimited(self, app):
+        body = '42461409160000\n"42383406370000"\n\n4246140916\n'
+        with app.test_request_context(
+            method="POST", data=body, content_type="application/x-ndjson"
+        ):
+            assert parse_api_list(request) == {
+                "api10": ["4246140916"],
+                "api14": ["42461409160000", "42383406370000"],
+            }
+
+    @pytest.mark.parametrize(
+        "body",
+        [
+            ["424614"],
+            ["424614091600"],  # between api10 and api14
+            ["4246140916000000"],  # longer than api14
+            {"api10": ["42461409160000"]},
+            {"api14": ["4246140916"]},
+        ],
+    )
+    def test_invalid_api(self, app, body):
+        with app.test_request_context(method="POST", json=body):
+            with pytest.raises(ValueError):
+                parse_api_list(request)
+
+    def test_post_rejects_invalid_api(self, app):
+        with app.test_request_context(method="POST", data="424614091600\n"):
+            response, status = Completions().post()
+        assert status == 400
+        assert "length of 12" in response["status"]
+
+
+class TestCompletionCalcs:
+    @pytest.fixture(autouse=True)
+    def models(self, monkeypatch):
+        monkeypatch.setattr(api.completion, "cache", None)
+        monkeypatch.setattr(api.completion, "flight", None)
+        for model in (Registry, CompletionSummary):
+            monkeypatch.setattr(
+                model,
+                "completion_calcs",
+                lambda api10s=None, api14s=None, model=model: [model.__name__],
+            )
+
+    def test_live_reads_registry(self, app):
+        with app.test_request_context(query_string={"live": "true"}):
+            assert completion_calcs(api14s=["42461409160000"]) == ["Registry"]
+
+    def test_reads_summary(self, app):
+        with app.test_request_context():
+            assert completion_calcs(api14s=["42461409160000"]) == ["CompletionSummary"]
+
+
+class TestCompletionEtag:
+    def test_changes_with_ids_version_and_source(self, app, monkeypatch):
+        monkeypatch.setattr(api.completion, "cache", None)
+        monkeypatch.setattr(api.completion, "dataset_version", lambda: "v1")
+        with app.test_request_context():
+            etag = completion_etag(api14s=["42461409160000"])
+            assert etag == completion_etag(api14s=["42461409160000"])
+            assert etag != completion_etag(api14s=["42383406370000"])
+            assert etag != completion_etag(api10s=["42461409160000"])
+
+        with app.test_request_context(query_string={"live": "true"}):
+            assert etag != completion_etag(api14s=["42461409160000"])
+
+        monkeypatch.setattr(api.completion, "dataset_version", lambda: "v2")
+        with app.test_request_context():
+            assert etag != completion_etag(api14s=["42461409160000"])
+
+    def test_tagged_with_version_cache_read_under(self, app, monkeypatch):
+        """ After an ingest, the cache keeps serving the old version until its
+            next check, so its responses keep the old version's tag """
+        versions = ["v1"]
+        version = lambda: versions[-1]  # noqa: E731
+        cache = CompletionCache(
+            lambda api10s=None, api14s=None: [{"api14": x} for x in api14s],
+            version=version,
+            check_interval=3600,
+        )
+        monkeypatch.setattr(api.completion, "cache", cache)
+        monkeypatch.setattr(api.completion, "dataset_version", version)
+        api14s = ["42461409160000"]
+
+        with app.test_request_context():
+            cache.completion_calcs(api14s=api14s)  # filled under v1
+            before = completion_etag(api14s=api14s)
+            versions.append("v2")
+            assert cache.completion_calcs(api14s=api14s) == [{"api14": api14s[0]}]
+            assert completion_etag(api14s=api14s) == before
+            assert completion_etag(api14s=api14s, cached=False) != before
+
+            cache._checked_at = None  # pylint: disable=protected-access
+            assert completion_etag(api14s=api14s) != before
+            assert cache.version == "v2"
+
+
+COLUMNS = [
+    "api14",
+    "api10",
+    "total_base_water_volume",
+    "ingredient_mass",
+    "hf_job_pct",
+    "water_mass",
+    "prop_mass",
+    "mass_diff_pct",
+    "updated_at",
+]
+
+
+class FakeQuery:
+    column_descriptions = [{"name": name} for name in COLUMNS]
+    rows = [
+        (
+            "42461409160000",
+            "4246140916",
+            420000,
+            100,
+            10.5,
+            3498600,
+            367353.0,
+            0.1,
+            None,
+        ),
+        ("42461409160100", "4246140916", None, None, None, None, None, None, None),
+    ]
+
+    def yield_per(self, count):  # pylint: disable=unused-argument
+        return iter(self.rows)
+
+
+class FakeModel:
+    api10 = api14 = None
+
+    @classmethod
+    def completion_calcs_query(cls, *criterion):  # pylint: disable=unused-argument
+        return FakeQuery()
+
+
+class TestStream:
+    @pytest.fixture(autouse=True)
+    def any_of(self, monkeypatch):
+        monkeypatch.setattr(api.completion, "any_of", lambda column, values: None)
+
+    def test_json_document(self):
+        ids = {"api10": ["4246140916"], "api14": ["42461409160000"]}
+        body = b"".join(Completions().stream(FakeModel, ids))
+        data = json.loads(body)["data"]
+        assert [r["api14"] for r in data] == ["42461409160000", "42461409160100"]
+
+    def test_ndjson(self):
+        ids = {"api10": ["4246140916"], "api14": []}
+        lines = b"".join(Completions().stream(FakeModel, ids, ndjson=True))
+        records = [json.loads(line) for line in lines.splitlines()]
+        assert [r["api10"] for r in records] == ["4246140916", "4246140916"]
+
+    def test_wants_stream(self, app):
+        with app.test_request_context(headers={"Accept": "application/x-ndjson"}):
+            assert Completions.wants_stream() and Completions.wants_ndjson()
+        with app.test_request_context(query_string={"stream": "1"}):
+            assert Completions.wants_stream() and not Completions.wants_ndjson()
+        with app.test_request_context(headers={"Accept": "*/*"}):
+            assert not Completions.wants_stream()
@@ -0,0 +1,78 @@
+# pylint: disable=missing-function-docstring,missing-module-docstring,no-self-use
+import gzip
+
+import pytest  # noqa
+from flask import Flask, Response, g
+
+from api.compression import Codec, Gzip, compress_response
+
+BODY = b'{"provider":"FracFocus","fluid_uom":"BBL"},' * 100
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+
+    @app.route("/")
+    def index():  # pylint: disable=unused-variable
+        return Response(BODY, mimetype="application/json")
+
+    @app.route("/small")
+    def small():  # pylint: disable=unused-variable
+        return Response(b"{}", mimetype="application/json")
+
+    @app.route("/stream")
+    def stream():  # pylint: disable=unused-variable
+        return Response((BODY for _ in range(3)), mimetype="application/json")
+
+    @app.after_request
+    def after_request(response):  # pylint: disable=unused-variable
+        response = compress_response(response, min_size=100)
+        response.headers["X-Compression"] = str(g.get("compression"))
+        return response
+
+    yield app
+
+
+class TestCompressResponse:
+    def test_gzip(self, app):
+        r = app.test_client().get("/", headers={"Accept-Encoding": "gzip, deflate"})
+        assert r.headers["Content-Encoding"] == "gzip"
+        assert r.headers["Vary"] == "Accept-Encoding"
+        assert gzip.decompress(r.data) == BODY
+        assert "'ratio'" in r.headers["X-Compression"]
+
+    def test_not_accepted(self, app):
+        r = app.test_client().get("/", headers={"Accept-Encoding": "identity"})
+        assert "Content-Encoding" not in r.headers
+        assert r.data == BODY
+
+    def test_below_min_size(self, app):
+        r = app.test_client().get("/small", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in r.headers
+        assert r.headers["X-Compression"] == "None"
+
+    def test_streamed(self, app, caplog):
+        caplog.set_level("INFO", logger="api.compression")
+        r = app.test_client().get("/stream", headers={"Accept-Encoding": "gzip"})
+        assert r.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(r.data) == BODY * 3
+        r.close()
+
+        stats = caplog.records[-1].compression
+        assert stats["original_length"] == len(BODY) * 3
+        assert stats["compressed_length"] == len(r.data)
+        assert stats["ratio"] > 1 and stats["cpu_time"] >= 0
+
+
+class TestCodec:
+    def test_stream_stats(self):
+        stats = {}
+        data = b"".join(Gzip().stream([BODY, BODY], stats))
+        assert gzip.decompress(data) == BODY * 2
+        assert stats["original_length"] == len(BODY) * 2
+        assert stats["compressed_length"] == len(data)
+
+    def test_abstract(self):
+        with pytest.raises(TypeError):
+            Codec()  # pylint: disable=abstract-class-instantiated
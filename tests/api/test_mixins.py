@@ -0,0 +1,145 @@
+# pylint: disable=missing-function-docstring,missing-module-docstring,no-self-use
+from contextlib import contextmanager
+from datetime import date, datetime
+from types import SimpleNamespace
+import json
+import uuid
+
+import pytest  # noqa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+
+import api.mixins
+from api.mixins import CopyStream
+from api.models import Registry
+
+
+class TestCopyStream:
+    def test_format_row(self):
+        row = (1, None, True, "a\tb\\c\n", datetime(2014, 9, 11), date(2014, 9, 11))
+        expected = "1\t\\N\tt\ta\\tb\\\\c\\n\t2014-09-11 00:00:00\t2014-09-11\n"
+        assert CopyStream.format_row(row) == expected
+
+    def test_read_in_pieces(self):
+        rows = [(i, f"value-{i}") for i in range(100)]
+        stream = CopyStream(rows)
+
+        pieces = []
+        while True:
+            piece = stream.read(7)
+            if not piece:
+                break
+            assert len(piece) <= 7
+            pieces.append(piece)
+
+        assert "".join(pieces) == "".join(CopyStream.format_row(r) for r in rows)
+
+
+class TestOnConflict:
+    def test_updates_only_changed_rows(self):
+        stmt = insert(Registry).values(
+            upload_key=uuid.uuid4(), ingredient_key=uuid.uuid4(), row_hash="abc"
+        )
+        final_stmt, op_name = Registry.on_conflict(stmt, "core_insert")
+        sql = str(final_stmt.compile(dialect=postgresql.dialect()))
+        assert op_name == "core_insert_update_on_conflict"
+        assert "WHERE registry.row_hash IS DISTINCT FROM excluded.row_hash" in sql
+
+
+class TestDedupeRecords:
+    def test_last_record_wins(self):
+        upload_key = uuid.uuid4()
+        records = [
+            {"upload_key": str(upload_key), "ingredient_key": "a", "tvd": 1},
+            {"upload_key": str(upload_key), "ingredient_key": "b", "tvd": 2},
+            {"upload_key": str(upload_key).upper(), "ingredient_key": "a", "tvd": 3},
+        ]
+        deduped, duplicates = Registry.dedupe_records(records)
+        assert duplicates == 1
+        assert [r["tvd"] for r in deduped] == [2, 3]
+
+
+class TestCoreInsert:
+    @pytest.fixture
+    def statements(self, monkeypatch, tmp_path):
+        """ Stand in for the database: fail any statement containing a bad row """
+        statements = []
+
+        def execute_counted(stmt, n):
+            records = stmt.parameters
+            statements.append(len(records))
+            if any(r["tvd"] < 0 for r in records):
+                raise IntegrityError("INSERT", {}, Exception("tvd must be positive"))
+            return {"inserted": n, "updated": 0, "unchanged": 0}
+
+        monkeypatch.setattr(Registry, "execute_counted", execute_counted)
+        monkeypatch.setattr(Registry, "persist", lambda: None)
+        monkeypatch.setattr(Registry, "post_op_metrics", lambda *a, **k: None)
+        monkeypatch.setattr(api.mixins.conf, "COLLECTOR_DEAD_LETTER_PATH", tmp_path)
+        yield statements
+
+    def records(self, n, bad=()):
+        return [
+            {
+                "upload_key": str(uuid.uuid4()),
+                "ingredient_key": "a",
+                "tvd": -i if i in bad else i,
+            }
+            for i in range(n)
+        ]
+
+    def test_isolates_bad_rows(self, statements, tmp_path):
+        assert Registry.core_insert(self.records(1024, bad={100, 900})) == 1022
+        assert len(statements) <= 1 + 2 * 2 * 10
+        rejected = (tmp_path / "registry.ndjson").read_text().splitlines()
+        assert sorted(json.loads(r)["record"]["tvd"] for r in rejected) == [-900, -100]
+        assert json.loads(rejected[0])["error"] == "tvd must be positive"
+
+    def test_gives_up_after_max_rejects(self, statements, monkeypatch):
+        monkeypatch.setattr(api.mixins.conf, "COLLECTOR_MAX_REJECTS", 3)
+        with pytest.raises(IntegrityError):
+            Registry.core_insert(self.records(64, bad=set(range(1, 64, 2))))
+
+    def test_max_rejects_spans_chunks(self, statements, monkeypatch):
+        monkeypatch.setattr(api.mixins.conf, "COLLECTOR_MAX_REJECTS", 3)
+        with pytest.raises(IntegrityError):  # two bad rows in each chunk of 16
+            Registry.core_insert(self.records(64, bad={1, 2, 17, 18}), size=16)
+
+
+class DBAPIError(Exception):
+    pass
+
+
+class TestCoreCopy:
+    def test_fallback_keeps_duplicates(self, monkeypatch):
+        """ A batch COPY refuses is retried with core_insert as it was given,
+            duplicates included """
+
+        @contextmanager
+        def begin():
+            raise IntegrityError("COPY", {}, DBAPIError("null value in api14"))
+            yield  # pylint: disable=unreachable
+
+        bind = SimpleNamespace(
+            dialect=SimpleNamespace(
+                identifier_preparer=postgresql.dialect().identifier_preparer,
+                dbapi=SimpleNamespace(DataError=DBAPIError, IntegrityError=DBAPIError),
+            ),
+            engine=SimpleNamespace(begin=begin),
+        )
+        monkeypatch.setattr(Registry, "s", SimpleNamespace(bind=bind))
+        batches = []
+        monkeypatch.setattr(
+            Registry,
+            "core_insert",
+            lambda records, **kwargs: batches.append(records) or len(records) - 1,
+        )
+        records = [
+            {"upload_key": "a", "ingredient_key": "b", "tvd": 1},
+            {"upload_key": "a", "ingredient_key": "b", "tvd": 2},
+            {"upload_key": "a", "ingredient_key": "c", "tvd": 3},
+        ]
+
+        assert Registry.core_copy(records) == 2
+        assert batches == [records]
@@ -0,0 +1,112 @@
+# pylint: disable=missing-function-docstring,missing-module-docstring,no-self-use
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest  # noqa
+from flask import Flask
+from sqlalchemy.dialects import postgresql
+
+from api.models import CompletionSummary, is_proppant
+from fracfocus import db
+
+
+class TestProppantClassification:
+    @pytest.mark.parametrize(
+        "name,expected",
+        [
+            ("Sand (Proppant)", True),
+            ("CRYSTALLINE SILICA", True),
+            ("100 Mesh", True),
+            ("Resin Coated Proppant", True),
+            ("Water", False),
+            ("Hydrochloric Acid", False),
+            ("", False),
+            (None, False),
+        ],
+    )
+    def test_is_proppant(self, name, expected):
+        assert is_proppant(name) is expected
+
+
+class RecordingConnection:
+    """ Records each statement compiled for postgres, with its parameters """
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, stmt):
+        compiled = stmt.compile(dialect=postgresql.dialect())
+        self.statements.append((" ".join(str(compiled).split()), compiled.params))
+        return SimpleNamespace(rowcount=2)
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+
+    conn = RecordingConnection()
+
+    @contextmanager
+    def begin():
+        yield conn
+
+    engine = SimpleNamespace(begin=begin)
+    monkeypatch.setattr(
+        CompletionSummary, "s", SimpleNamespace(bind=SimpleNamespace(engine=engine))
+    )
+    monkeypatch.setattr(CompletionSummary, "post_op_metrics", lambda *a, **k: None)
+    with app.app_context():
+        yield conn
+
+
+class TestCompletionSummaryRefresh:
+    def test_refreshes_wells(self, conn):
+        api14s = ["42461409160000", "", "42383406370000", "42461409160000"]
+        assert CompletionSummary.refresh(api14s) == 2
+
+        [(upsert, upsert_params), (delete, delete_params)] = conn.statements
+        wells = ["42383406370000", "42461409160000"]
+        assert upsert.startswith(
+            "INSERT INTO completion_summary (api14, api10, total_base_water_volume, "
+            "ingredient_mass, hf_job_pct, updated_at, water_mass, prop_mass, "
+            "mass_diff_pct) SELECT "
+        )
+        assert (
+            "FROM registry WHERE registry.is_proppant "
+            "AND registry.api14 IN (%(api14_1)s, %(api14_2)s) "
+            "GROUP BY registry.api14"
+        ) in upsert
+        assert upsert.endswith(
+            "ON CONFLICT (api14) DO UPDATE SET api10 = excluded.api10, "
+            "total_base_water_volume = excluded.total_base_water_volume, "
+            "ingredient_mass = excluded.ingredient_mass, "
+            "hf_job_pct = excluded.hf_job_pct, water_mass = excluded.water_mass, "
+            "prop_mass = excluded.prop_mass, "
+            "mass_diff_pct = excluded.mass_diff_pct, "
+            "updated_at = excluded.updated_at"
+        )
+        assert [upsert_params["api14_1"], upsert_params["api14_2"]] == wells
+
+        assert delete == (
+            "DELETE FROM completion_summary WHERE NOT (EXISTS (SELECT * FROM registry "
+            "WHERE registry.api14 = completion_summary.api14 "
+            "AND registry.is_proppant)) "
+            "AND completion_summary.api14 IN (%(api14_1)s, %(api14_2)s)"
+        )
+        assert sorted(delete_params.values()) == wells
+
+    def test_refreshes_all_wells(self, conn):
+        CompletionSummary.refresh()
+        [(upsert, _), (delete, _)] = conn.statements
+        assert "WHERE registry.is_proppant GROUP BY registry.api14" in upsert
+        assert "ON CONFLICT (api14) DO UPDATE" in upsert
+        assert delete.startswith("DELETE FROM completion_summary WHERE NOT (EXISTS")
+        assert "IN (" not in delete
+
+    @pytest.mark.parametrize("api14s", [[], ["", None]])
+    def test_empty_set(self, conn, api14s):
+        assert CompletionSummary.refresh(api14s) == 0
+        assert conn.statements == []
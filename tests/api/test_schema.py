@@ -0,0 +1,60 @@
+# pylint: disable=missing-function-docstring,missing-module-docstring,no-self-use
+from datetime import datetime, timezone
+from decimal import Decimal
+import json
+
+import pytest  # noqa
+
+from api.schema import CompletionParameterSchema, compile_serializer
+
+COLUMNS = [
+    "api14",
+    "api10",
+    "total_base_water_volume",
+    "ingredient_mass",
+    "hf_job_pct",
+    "updated_at",
+    "water_mass",
+    "prop_mass",
+    "mass_diff_pct",
+]
+
+ROWS = [
+    (
+        "42461409160000",
+        "4246140916",
+        7469522,
+        6156910,
+        11.876543,
+        datetime(2020, 1, 3, 12, 30, 15, 123456, tzinfo=timezone.utc),
+        Decimal("62221118.26"),
+        7389837.554321,
+        -16.68921,
+    ),
+    ("42383406370000", "4238340637", 41, 0, 0.0, None, Decimal("0"), 0.0, 100.0),
+    ("42383406370100", "4238340637", None, None, None, None, None, None, None),
+    ("42383406370200", "4238340637", 0, 5, 0.004, datetime(2019, 12, 30), 0, 0.9, 0),
+]
+
+
+def canonical(records) -> str:
+    return json.dumps(records, sort_keys=True)
+
+
+class TestCompileSerializer:
+    def test_parity_with_schema_for_mappings(self):
+        records = [dict(zip(COLUMNS, row)) for row in ROWS]
+        expected = CompletionParameterSchema(many=True).dump(
+            [dict(r) for r in records]  # the schema's hooks modify their input
+        )
+        serialize = compile_serializer()
+        assert canonical([serialize(r) for r in records]) == canonical(expected)
+
+    def test_parity_with_schema_for_tuples(self):
+        columns = list(reversed(COLUMNS))
+        rows = [tuple(reversed(row)) for row in ROWS]
+        expected = CompletionParameterSchema(many=True).dump(
+            [dict(zip(COLUMNS, row)) for row in ROWS]
+        )
+        serialize = compile_serializer(columns)
+        assert canonical([serialize(r) for r in rows]) == canonical(expected)
@@ -0,0 +1,206 @@
+# pylint: disable=missing-function-docstring,missing-module-docstring,no-self-use
+from contextlib import contextmanager
+from typing import Dict, List
+
+import pytest  # noqa
+from sqlalchemy.dialects import postgresql
+
+from api.models import Registry
+from api.shadow import ShadowTable
+
+INDEXES = [
+    (
+        "ix_registry_api14",
+        "CREATE INDEX ix_registry_api14 ON public.registry USING btree (api14)",
+    ),
+    (
+        "ix_registry_api14_is_proppant",
+        "CREATE INDEX ix_registry_api14_is_proppant ON public.registry "
+        "USING btree (api14) WHERE is_proppant",
+    ),
+]
+
+TRIGGER = (
+    "CREATE TRIGGER tg_registry_updated_at BEFORE UPDATE ON public.registry "
+    "FOR EACH ROW EXECUTE FUNCTION set_updated_at()"
+)
+
+
+class Result:
+    def __init__(self, rows: List = None, rowcount: int = 0):
+        self.rows = rows or []
+        self.rowcount = rowcount
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def fetchall(self):
+        return self.rows
+
+    def scalar(self):
+        return self.rows[0][0] if self.rows else None
+
+
+class RecordingConnection:
+    """ Records the SQL of each statement executed, answering the catalog
+        queries that contain a key of responses with its result """
+
+    def __init__(self, responses: Dict[str, Result]):
+        self.responses = responses
+        self.statements: List[str] = []
+
+    def execution_options(self, **kwargs):
+        return self
+
+    def execute(self, statement, *args, **params):
+        if not isinstance(statement, str):
+            statement = str(statement.compile(dialect=postgresql.dialect()))
+        self.statements.append(" ".join(statement.split()))
+        for key, result in self.responses.items():
+            if key in statement:
+                return result
+        return Result()
+
+
+class RecordingEngine:
+    dialect = postgresql.dialect()
+
+    def __init__(self, conn: RecordingConnection):
+        self.conn = conn
+
+    @contextmanager
+    def begin(self):
+        yield self.conn
+
+
+@pytest.fixture
+def conn():
+    yield RecordingConnection(
+        {
+            "DELETE FROM": Result(rowcount=2),
+            "pg_get_indexdef": Result(INDEXES),
+            "role_table_grants": Result([("reader", "SELECT"), ("PUBLIC", "SELECT")]),
+            "pg_get_triggerdef": Result([(TRIGGER,)]),
+            "pg_constraint": Result([("registry_pkey",)]),
+        }
+    )
+
+
+@pytest.fixture
+def shadow(monkeypatch, conn):
+    monkeypatch.setattr(ShadowTable, "engine", RecordingEngine(conn))
+    yield ShadowTable(Registry)
+
+
+def position(statements: List[str], prefix: str) -> int:
+    return next(i for i, s in enumerate(statements) if s.startswith(prefix))
+
+
+class TestShadowTable:
+    def test_name(self, shadow):
+        assert shadow.name == "registry_shadow"
+
+    def test_shadow_index_ddl(self, shadow):
+        name, definition = INDEXES[1]
+        assert shadow.shadow_index_ddl(name, definition) == (
+            "CREATE INDEX ix_registry_api14_is_proppant_shadow ON registry_shadow "
+            "USING btree (api14) WHERE is_proppant"
+        )
+
+    def test_shadow_index_name_fits_identifier_limit(self, shadow):
+        name = shadow.shadow_index_name("ix_" + "x" * 70)
+        assert len(name) == 63 and name.endswith("_shadow")
+
+    def test_long_shadow_index_names_are_distinct(self, shadow):
+        prefix = "ix_" + "x" * 70
+        names = {shadow.shadow_index_name(prefix + s) for s in ("_a", "_b")}
+        assert len(names) == 2
+        assert all(len(name) == 63 for name in names)
+
+    def test_generated_defaults(self, shadow):
+        defaults = shadow.generated_defaults()
+        assert defaults["created_at"] == "now()"
+        assert defaults["is_federal_well"] == "false"
+        assert "api14" not in defaults
+
+    def test_create(self, shadow, conn):
+        shadow.create()
+        assert conn.statements[:3] == [
+            "DROP TABLE IF EXISTS registry_shadow",
+            "CREATE TABLE registry_shadow (LIKE registry INCLUDING DEFAULTS)",
+            "ALTER TABLE registry_shadow ADD COLUMN _load_file bigint, "
+            "ADD COLUMN _load_row bigint",
+        ]
+        assert (
+            "ALTER TABLE registry_shadow ALTER COLUMN created_at SET DEFAULT now()"
+            in conn.statements
+        )
+
+    def test_build(self, shadow, conn):
+        shadow.build()
+        statements = conn.statements
+
+        assert statements[0] == (
+            "DELETE FROM registry_shadow a USING registry_shadow b "
+            "WHERE a.upload_key = b.upload_key "
+            "AND a.ingredient_key = b.ingredient_key "
+            "AND (a._load_file, a._load_row) < (b._load_file, b._load_row)"
+        )
+        assert statements[1] == (
+            "ALTER TABLE registry_shadow DROP COLUMN _load_file, DROP COLUMN _load_row"
+        )
+        assert statements[2] == (
+            "UPDATE registry_shadow a SET created_at = b.created_at FROM registry b "
+            "WHERE a.upload_key = b.upload_key AND a.ingredient_key = b.ingredient_key"
+        )
+        pkey = position(statements, "ALTER TABLE registry_shadow ADD CONSTRAINT")
+        assert statements[pkey] == (
+            "ALTER TABLE registry_shadow ADD CONSTRAINT registry_shadow_pkey "
+            "PRIMARY KEY (upload_key, ingredient_key)"
+        )
+        assert all(
+            s.endswith("DROP DEFAULT") for s in statements[3:pkey]
+        ), "defaults are dropped before the primary key is added"
+
+        indexes = [s for s in statements if s.startswith("CREATE INDEX")]
+        assert indexes == [
+            "CREATE INDEX ix_registry_api14_shadow ON registry_shadow "
+            "USING btree (api14)",
+            "CREATE INDEX ix_registry_api14_is_proppant_shadow ON registry_shadow "
+            "USING btree (api14) WHERE is_proppant",
+        ]
+        assert position(statements, "CREATE INDEX") > pkey
+
+        grants = [s for s in statements if s.startswith("GRANT")]
+        assert grants == [
+            "GRANT SELECT ON registry_shadow TO reader",
+            "GRANT SELECT ON registry_shadow TO PUBLIC",
+        ]
+        assert statements[-1] == "ANALYZE registry_shadow"
+
+    def test_swap(self, shadow, conn):
+        shadow.swap()
+        statements = [
+            s for s in conn.statements if not s.startswith("SELECT")
+        ]  # catalog queries
+
+        assert statements == [
+            "SET LOCAL lock_timeout = '30s'",
+            "LOCK TABLE registry IN ACCESS EXCLUSIVE MODE",
+            "DROP TABLE registry",
+            "ALTER TABLE registry_shadow RENAME TO registry",
+            "ALTER TABLE registry RENAME CONSTRAINT registry_shadow_pkey "
+            "TO registry_pkey",
+            "ALTER INDEX ix_registry_api14_shadow RENAME TO ix_registry_api14",
+            "ALTER INDEX ix_registry_api14_is_proppant_shadow "
+            "RENAME TO ix_registry_api14_is_proppant",
+            TRIGGER,
+        ]
+
+    def test_swap_reads_catalog_before_drop(self, shadow, conn):
+        shadow.swap()
+        drop = conn.statements.index("DROP TABLE registry")
+        catalog = [
+            i for i, s in enumerate(conn.statements) if "pg_" in s and "SELECT" in s
+        ]
+        assert len(catalog) == 3 and max(catalog) < drop
@@ -0,0 +1,67 @@
+# pylint: disable=missing-function-docstring,missing-module-docstring,no-self-use
+import pytest  # noqa
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    any_,
+    bindparam,
+    create_engine,
+    select,
+)
+from sqlalchemy.dialects import postgresql
+
+from api.statements import CachedStatement
+
+metadata = MetaData()
+wells = Table("wells", metadata, Column("api14", String(14)), Column("depth", Integer))
+
+
+@pytest.fixture
+def conn():
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+    with engine.connect() as conn:
+        conn.execute(
+            wells.insert(),
+            [{"api14": f"4246140916{i:04d}", "depth": i} for i in range(10)],
+        )
+        yield conn
+
+
+class TestCachedStatement:
+    def test_built_and_compiled_once(self, conn):
+        builds = []
+
+        def build():
+            builds.append(1)
+            return select([wells.c.api14]).where(
+                wells.c.api14.in_(bindparam("ids", expanding=True))
+            )
+
+        stmt = CachedStatement("wells_by_api14", build)
+        for ids in (["42461409160001"], ["42461409160002", "42461409160003"]):
+            result = stmt.execute(conn, ids=ids)
+            assert sorted(r.api14 for r in result) == ids
+        assert len(builds) == 1
+        assert len(stmt.compiled_cache) == 1
+
+    def test_prepared_sql(self):
+        class Connection:
+            dialect = postgresql.psycopg2.dialect()
+
+        stmt = CachedStatement(
+            "wells_by_api14",
+            lambda: select([wells.c.api14, wells.c.depth * 0.3048]).where(
+                wells.c.api14
+                == any_(bindparam("ids", type_=postgresql.ARRAY(String(14))))
+            ),
+            prepare=True,
+        )
+        prepare, execute = stmt.prepared_sql(Connection)
+        assert prepare.startswith("PREPARE wells_by_api14 (VARCHAR(14)[]) AS SELECT")
+        assert "wells.depth * 0.3048" in prepare
+        assert "ANY ($1::VARCHAR(14)[])" in prepare
+        assert execute == "EXECUTE wells_by_api14 (:ids)"
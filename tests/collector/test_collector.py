@@ -0,0 +1,314 @@
+# pylint: disable=missing-function-docstring,missing-module-docstring,no-self-use
+import csv
+import re
+import uuid
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+
+import pytest  # noqa
+
+import api.models
+import collector.collector as collector_module
+from collector import Endpoint, FracFocusCollector
+
+ROW = {
+    "UploadKey": str(uuid.UUID(int=1)),
+    "IngredientKey": str(uuid.UUID(int=2)),
+    "APINumber": "42461409160000",
+    "IngredientName": "Sand, White",
+    "MassIngredient": "7469522",
+}
+
+
+ALIASES = {
+    "UploadKey": "upload_key",
+    "IngredientKey": "ingredient_key",
+    "APINumber": "api14",
+    "IngredientName": "ingredient_name",
+    "MassIngredient": "ingredient_mass",
+}
+
+
+@pytest.fixture
+def collector():
+    endpoint = Endpoint(
+        "registry", model="api.models.Registry", mappings={"aliases": ALIASES}
+    )
+    yield FracFocusCollector(endpoint)
+
+
+class TestTransformRow:
+    def test_hashes_row(self, collector):
+        row = collector.transform_row(ROW)
+        assert row["is_proppant"] is True
+        assert len(row["row_hash"]) == 32
+        assert collector.transform_row(ROW)["row_hash"] == row["row_hash"]
+
+    def test_drops_rows_without_keys(self, collector):
+        assert collector.transform_row({**ROW, "IngredientKey": ""}) is None
+
+    def test_proppant_pattern_changes_hash(self, collector, monkeypatch):
+        before = collector.transform_row(ROW)
+        monkeypatch.setattr(api.models, "PROPPANT_PATTERN", re.compile("ceramic"))
+        after = collector.transform_row(ROW)
+        assert after["is_proppant"] is False
+        assert after["row_hash"] != before["row_hash"]
+
+
+def write_csv(path, n: int, **values):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(ROW))
+        writer.writeheader()
+        for i in range(n):
+            writer.writerow(
+                {**ROW, "IngredientKey": str(uuid.UUID(int=i + 1)), **values}
+            )
+    return path
+
+
+@pytest.fixture
+def loaded(monkeypatch):
+    """ Rows passed to the model's core_insert, in place of the database """
+    rows = []
+
+    def core_insert(records, **kwargs):  # pylint: disable=unused-argument
+        rows.extend(records)
+        return len(records)
+
+    monkeypatch.setattr(api.models.Registry, "core_insert", core_insert)
+    for name, value in {
+        "COLLECTOR_READ_SIZE": 2,
+        "COLLECTOR_WRITE_SIZE": 2,
+        "COLLECTOR_REFRESH_SUMMARY": False,
+    }.items():
+        monkeypatch.setattr(collector_module.conf, name, value)
+    yield rows
+
+
+class FakeLedger:
+    def __init__(self, entry=None, exists: bool = True, fail_checkpoints=False):
+        self.entry = entry
+        self.table_exists = exists
+        self.fail_checkpoints = fail_checkpoints
+        self.started = []
+        self.checkpoints = []
+        self.finished = []
+
+    def exists(self):
+        return self.table_exists
+
+    def latest(self, file, file_hash):  # pylint: disable=unused-argument
+        return self.entry
+
+    def start(self, run_id, file, file_hash, start_row=0):
+        self.started.append((run_id, file, file_hash, start_row))
+
+    def update(self, run_id, file, finished=False, **values):
+        if finished:
+            self.finished.append(values)
+        elif self.fail_checkpoints:
+            raise RuntimeError("connection refused")
+        else:
+            self.checkpoints.append(values["last_row"])
+
+
+class TestIngestLedger:
+    def test_skips_completed_file(self, collector, loaded, monkeypatch, tmp_path):
+        ledger = FakeLedger(SimpleNamespace(run_id="abc", status="success"))
+        monkeypatch.setattr(collector_module, "IngestLedger", ledger)
+        path = write_csv(tmp_path / "a.csv", 4)
+
+        [result] = collector.collect(path, resume=True)
+
+        assert result["status"] == "skipped"
+        assert loaded == []
+        assert ledger.started == [] and ledger.finished == []
+
+    def test_resumes_after_last_row(self, collector, loaded, monkeypatch, tmp_path):
+        entry = SimpleNamespace(run_id="abc", status="running", last_row=2)
+        ledger = FakeLedger(entry)
+        monkeypatch.setattr(collector_module, "IngestLedger", ledger)
+        path = write_csv(tmp_path / "a.csv", 5)
+
+        [result] = collector.collect(path, resume=True)
+
+        assert (result["status"], result["start_row"], result["rows"]) == (
+            "success",
+            2,
+            3,
+        )
+        assert [r["ingredient_key"] for r in loaded] == [
+            str(uuid.UUID(int=i)) for i in (3, 4, 5)
+        ]
+        assert ledger.started[0][3] == 2
+        assert ledger.checkpoints == [4, 5]
+        assert ledger.finished == [
+            {
+                "status": "success",
+                "error": None,
+                "seconds": result["seconds"],
+                "rows_read": 3,
+                "rows_written": 3,
+                "rows_rejected": 0,
+            }
+        ]
+
+    def test_checkpoint_failure_is_not_fatal(
+        self, collector, loaded, monkeypatch, tmp_path
+    ):
+        ledger = FakeLedger(fail_checkpoints=True)
+        monkeypatch.setattr(collector_module, "IngestLedger", ledger)
+
+        [result] = collector.collect(write_csv(tmp_path / "a.csv", 4))
+
+        assert (result["status"], result["rows"]) == ("success", 4)
+        assert ledger.finished[0]["status"] == "success"
+
+    def test_unused_without_table(self, collector, loaded, monkeypatch, tmp_path):
+        ledger = FakeLedger(exists=False)
+        monkeypatch.setattr(collector_module, "IngestLedger", ledger)
+        checksums = []
+        monkeypatch.setattr(collector_module, "file_checksum", checksums.append)
+
+        [result] = collector.collect(write_csv(tmp_path / "a.csv", 4))
+
+        assert (result["status"], result["rows"]) == ("success", 4)
+        assert checksums == [] and ledger.started == []
+
+
+class FakeExecutor:
+    """ Stands in for ProcessPoolExecutor, running each file in this process.
+        Files in died come back as if their worker process had been killed. """
+
+    died = ()
+
+    def __init__(self, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, path, **kwargs):  # pylint: disable=unused-argument
+        future = Future()
+        if path in self.died:
+            future.set_exception(
+                BrokenProcessPool("A process in the process pool was terminated")
+            )
+        else:
+            future.set_result(collector_module._worker_collector.collect_file(path))
+        return future
+
+
+class TestCollectFile:
+    def test_result(self, collector, loaded, tmp_path):
+        path = write_csv(tmp_path / "a.csv", 5)
+
+        result = collector.collect_file(path)
+
+        assert result["file"] == str(path)
+        assert (result["status"], result["rows"]) == ("success", 5)
+        assert result["pipeline"]["reader"]["rows"] == 5
+        assert result["pipeline"]["writer"]["rows"] == 5
+        assert isinstance(result["seconds"], float)
+        assert "error" not in result
+        assert len(loaded) == 5
+
+    def test_failed_write_does_not_stop_others(
+        self, collector, loaded, monkeypatch, tmp_path
+    ):
+        monkeypatch.setattr(collector_module, "IngestLedger", FakeLedger(exists=False))
+        bad_api = "42383406370000"
+
+        def core_insert(records, **kwargs):  # pylint: disable=unused-argument
+            if any(r["api14"] == bad_api for r in records):
+                raise RuntimeError("deadlock detected")
+            loaded.extend(records)
+            return len(records)
+
+        monkeypatch.setattr(api.models.Registry, "core_insert", core_insert)
+        paths = [
+            write_csv(tmp_path / "a.csv", 2),
+            write_csv(tmp_path / "b.csv", 2, APINumber=bad_api),
+            write_csv(tmp_path / "c.csv", 2),
+        ]
+
+        results = collector.collect(paths)
+
+        assert [(r["status"], r["rows"]) for r in results] == [
+            ("success", 2),
+            ("error", 0),
+            ("success", 2),
+        ]
+        assert "deadlock detected" in results[1]["error"]
+        assert len(loaded) == 4
+
+
+class TestCollectParallel:
+    def test_worker_died(self, collector, loaded, monkeypatch, tmp_path):
+        a = write_csv(tmp_path / "a.csv", 2)
+        b = write_csv(tmp_path / "b.csv", 2)
+        monkeypatch.setattr(collector_module, "ProcessPoolExecutor", FakeExecutor)
+        monkeypatch.setattr(FakeExecutor, "died", (b,))
+        monkeypatch.setattr(collector_module, "_worker_collector", collector)
+
+        results = collector.collect_parallel([a, b], workers=2)
+
+        results = {r["file"]: r for r in results}
+        assert (results[str(a)]["status"], results[str(a)]["rows"]) == ("success", 2)
+        assert results[str(b)] == {
+            "file": str(b),
+            "status": "error",
+            "rows": 0,
+            "error": "A process in the process pool was terminated",
+        }
+
+
+class FakeShadow:
+    name = "registry_shadow"
+    calls = []
+
+    def __init__(self, model):
+        self.model = model
+
+    def create(self):
+        self.calls.append("create")
+        return self
+
+    def build(self):
+        self.calls.append("build")
+
+    def swap(self):
+        self.calls.append("swap")
+        raise RuntimeError("canceling statement due to lock timeout")
+
+    def drop(self):
+        self.calls.append("drop")
+
+
+class TestFullRefresh:
+    def test_failed_swap_drops_shadow(self, collector, monkeypatch):
+        FakeShadow.calls = []
+        monkeypatch.setattr(collector_module, "ShadowTable", FakeShadow)
+        monkeypatch.setattr(
+            FracFocusCollector,
+            "collect",
+            lambda self, filelist, **kwargs: [
+                {"file": "a.csv", "status": "success", "rows": 10}
+            ],
+        )
+        refreshed = []
+        monkeypatch.setattr(
+            api.models.CompletionSummary, "refresh", lambda: refreshed.append(1)
+        )
+
+        results = collector.full_refresh(["a.csv"])
+
+        assert FakeShadow.calls == ["create", "build", "swap", "drop"]
+        assert [r["status"] for r in results] == ["success", "error"]
+        assert results[1]["file"] == "registry_shadow"
+        assert "lock timeout" in results[1]["error"]
+        assert refreshed == []
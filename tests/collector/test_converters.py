@@ -0,0 +1,49 @@
+# pylint: disable=missing-function-docstring,missing-module-docstring,no-self-use
+from datetime import datetime
+
+import pytest  # noqa
+from sqlalchemy import BigInteger, Boolean, Column, Date, Float, Integer, String
+from sqlalchemy.dialects.postgresql import UUID
+
+from collector.converters import compile_converters, to_int
+
+
+@pytest.fixture
+def converters():
+    columns = [
+        Column("upload_key", UUID(as_uuid=True)),
+        Column("job_start_date", Date),
+        Column("tvd", Integer),
+        Column("ingredient_mass", BigInteger),
+        Column("lat", Float),
+        Column("is_water", Boolean),
+        Column("api14", String(14)),
+    ]
+    yield compile_converters(columns, fallback=lambda v: f"fallback:{v}")
+
+
+class TestConverters:
+    def test_to_int(self):
+        assert to_int("6752") == 6752
+        assert to_int("6752.0") == 6752
+        assert to_int("6752.5") == 6752.5
+
+    @pytest.mark.parametrize(
+        "column,value,expected",
+        [
+            ("job_start_date", "9/11/2014 12:00:00 AM", datetime(2014, 9, 11)),
+            ("tvd", "-01", -1),
+            ("ingredient_mass", "7469522", 7469522),
+            ("lat", "28.439819444", 28.439819444),
+            ("is_water", "True", True),
+            ("is_water", "false", False),
+            ("api14", "05123456780000", "05123456780000"),
+            ("upload_key", "68acaa3e-c788", "68acaa3e-c788"),
+            ("tvd", "", None),
+            ("lat", None, None),
+            ("tvd", "n/a", "fallback:n/a"),
+            ("is_water", "maybe", "fallback:maybe"),
+        ],
+    )
+    def test_convert(self, converters, column, value, expected):
+        assert converters[column](value) == expected
@@ -0,0 +1,243 @@
+# pylint: disable=missing-function-docstring,missing-module-docstring,no-self-use
+import io
+import os
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest  # noqa
+import requests
+
+import api.models
+from collector.downloader import FileDownloader, ZipDownloader, file_checksum
+
+url = "http://fracfocus.example.com/digitaldownload/FracFocusCSV.zip"
+
+
+@pytest.fixture
+def archive():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as z:
+        z.writestr("FracFocusRegistry_1.csv", "UploadKey,APINumber\n1,42461409160000\n")
+        z.writestr("FracFocusRegistry_2.csv", "UploadKey,APINumber\n2,42383406370000\n")
+        z.writestr("readme.txt", "not a csv")
+    yield buffer.getvalue()
+
+
+class TestFileDownloader:
+    def test_download_streams_to_disk(self, requests_mock, tmp_path):
+        content = b"x" * 10000
+        requests_mock.get(url, content=content)
+        downloader = FileDownloader(url)
+        downloader.chunk_size = 1024
+
+        path = downloader.download(tmp_path / "out.bin")
+
+        assert path.read_bytes() == content
+        assert not (tmp_path / "out.bin.part").exists()
+
+
+class TestZipDownloader:
+    def test_unpack_from_spooled_archive(self, requests_mock, tmp_path, archive):
+        requests_mock.get(url, content=archive)
+        downloader = ZipDownloader(url, download_to=str(tmp_path))
+
+        paths = downloader.unpack().paths
+
+        assert downloader.archive_path == tmp_path / "FracFocusCSV.zip"
+        assert downloader.archive_path.exists()
+        assert [p.name for p in paths] == [
+            "FracFocusRegistry_2.csv",
+            "FracFocusRegistry_1.csv",
+        ]
+        assert all(p.exists() for p in paths)
+
+    def test_fetch_reads_members_without_extracting(
+        self, requests_mock, tmp_path, archive
+    ):
+        requests_mock.get(url, content=archive)
+        downloader = ZipDownloader(url, download_to=str(tmp_path))
+
+        members = downloader.fetch().files
+
+        assert [m.name for m in members] == [
+            "FracFocusRegistry_2.csv",
+            "FracFocusRegistry_1.csv",
+        ]
+        assert not (tmp_path / "FracFocusRegistry_1.csv").exists()
+        with members[0].open() as f:
+            assert f.read().splitlines()[1] == "2,42383406370000"
+
+    def test_from_existing_loads_archive(
+        self, requests_mock, tmp_path, archive, monkeypatch
+    ):
+        monkeypatch.setattr(ZipDownloader, "download_to", str(tmp_path))
+        requests_mock.get(url, content=archive)
+        ZipDownloader(url).fetch()
+
+        downloader = ZipDownloader.from_existing(url)
+
+        assert len(downloader.files) == 2
+
+    def test_file_checksum(self, requests_mock, tmp_path, archive):
+        requests_mock.get(url, content=archive)
+        downloader = ZipDownloader(url, download_to=str(tmp_path))
+        members = downloader.fetch().files
+        paths = downloader.unpack().paths
+
+        checksums = [file_checksum(m) for m in members]
+        assert checksums[0].startswith("crc32:") and len(set(checksums)) == 2
+
+        before = file_checksum(paths[0])
+        assert file_checksum(paths[0]) == before
+        paths[0].write_text("UploadKey,APINumber\n3,42383406370000\n")
+        assert file_checksum(paths[0]) != before
+
+
+class TestConditionalDownload:
+    @pytest.fixture
+    def downloader(self, tmp_path):
+        yield FileDownloader(url, cache=str(tmp_path / "download.yaml"))
+
+    def test_is_modified_without_history(self, downloader):
+        assert downloader.is_modified()
+
+    def test_not_modified_on_304(self, requests_mock, downloader):
+        headers = {"ETag": '"abc"', "Content-Length": "3"}
+        requests_mock.get(url, content=b"abc", headers=headers)
+        downloader.get()
+        downloader.save_validators()
+
+        requests_mock.head(url, status_code=304)
+
+        assert not downloader.is_modified()
+        assert requests_mock.last_request.headers["If-None-Match"] == '"abc"'
+
+    def test_modified_when_validators_differ(self, requests_mock, downloader):
+        headers = {"Last-Modified": "Mon, 02 Mar 2020 00:00:00 GMT"}
+        requests_mock.get(url, content=b"abc", headers=headers)
+        downloader.get()
+        downloader.save_validators()
+
+        requests_mock.head(url, headers={"Last-Modified": "Mon, 16 Mar 2020 00:00:00 GMT"})
+        assert downloader.is_modified()
+
+        requests_mock.head(url, headers=headers)
+        assert not downloader.is_modified()
+
+    def test_validators_kept_in_database(self, requests_mock, monkeypatch):
+        saved = {}
+        monkeypatch.setattr(api.models.DownloadValidators, "get", saved.get)
+        monkeypatch.setattr(api.models.DownloadValidators, "save", saved.__setitem__)
+        headers = {"ETag": '"abc"', "Content-Length": "3"}
+        requests_mock.get(url, content=b"abc", headers=headers)
+        downloader = FileDownloader(url)
+        downloader.get()
+        downloader.save_validators()
+
+        assert saved == {url: headers}
+        requests_mock.head(url, status_code=304)
+        assert not FileDownloader(url).is_modified()
+
+    def test_modified_when_database_unavailable(self, monkeypatch):
+        def get(url):
+            raise RuntimeError('relation "download_validators" does not exist')
+
+        monkeypatch.setattr(api.models.DownloadValidators, "get", get)
+        assert FileDownloader(url).is_modified()
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """ Minimal stand-in for a file server that honors byte range requests """
+
+    content = b""
+    served = 0
+    truncate = False
+
+    def log_message(self, *args):  # silence request logging
+        pass
+
+    def _headers(self, status: int, length: int, extra: dict = None):
+        self.send_response(status)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(length))
+        for k, v in (extra or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._headers(200, len(self.content))
+
+    def do_GET(self):
+        header = self.headers.get("Range")
+        if not header:
+            self._headers(200, len(self.content))
+            body = self.content
+        else:
+            start, end = [int(x) for x in header.replace("bytes=", "").split("-")]
+            body = self.content[start : end + 1]
+            content_range = f"bytes {start}-{end}/{len(self.content)}"
+            self._headers(206, len(body), {"Content-Range": content_range})
+
+        if self.truncate:  # drop the connection halfway through the body
+            body = body[: len(body) // 2]
+            self.close_connection = True
+        type(self).served += len(body)
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def range_server():
+    handler = type("Handler", (RangeRequestHandler,), {"content": os.urandom(100003)})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestSegmentedDownload:
+    @pytest.fixture(autouse=True)
+    def no_retry_delay(self, monkeypatch):
+        monkeypatch.setattr("collector.util.time.sleep", lambda s: None)
+
+    def make_downloader(self, server, tmp_path) -> FileDownloader:
+        host, port = server.server_address
+        downloader = FileDownloader(
+            f"http://{host}:{port}/FracFocusCSV.zip",
+            cache=str(tmp_path / "download.yaml"),
+            segments=4,
+        )
+        downloader.chunk_size = 1024
+        return downloader
+
+    def test_split_ranges(self):
+        assert FileDownloader.split_ranges(10, 3) == [(0, 3), (4, 7), (8, 9)]
+        assert FileDownloader.split_ranges(2, 4) == [(0, 0), (1, 1)]
+
+    def test_download_segmented(self, range_server, tmp_path):
+        downloader = self.make_downloader(range_server, tmp_path)
+
+        path = downloader.download(tmp_path / "FracFocusCSV.zip")
+
+        assert path.read_bytes() == range_server.RequestHandlerClass.content
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["FracFocusCSV.zip"]
+
+    def test_resume_after_failed_download(self, range_server, tmp_path):
+        handler = range_server.RequestHandlerClass
+        downloader = self.make_downloader(range_server, tmp_path)
+
+        handler.truncate = True
+        with pytest.raises(requests.RequestException):
+            downloader.download(tmp_path / "FracFocusCSV.zip")
+        resumed = sum(p.stat().st_size for p in tmp_path.glob("*.part?"))
+        assert resumed > 0
+
+        handler.truncate = False
+        handler.served = 0
+        path = downloader.download(tmp_path / "FracFocusCSV.zip")
+
+        assert path.read_bytes() == handler.content
+        assert handler.served == len(handler.content) - resumed
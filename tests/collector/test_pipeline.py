@@ -0,0 +1,97 @@
+# pylint: disable=missing-function-docstring,missing-module-docstring,no-self-use
+import random
+import time
+
+import pytest  # noqa
+
+from collector.pipeline import Pipeline, PipelineError
+
+
+def slow_double(row):
+    time.sleep(random.random() / 10000)
+    return {"n": row["n"] * 2}
+
+
+class TestPipeline:
+    def test_rows_written_in_order(self):
+        written = []
+        pipeline = Pipeline(
+            source=({"n": n} for n in range(1000)),
+            transform=slow_double,
+            write=written.append,
+            read_size=7,
+            write_size=100,
+            transformers=4,
+            queue_size=2,
+        )
+        assert pipeline.run() == 1000
+        assert [r["n"] for chunk in written for r in chunk] == list(range(0, 2000, 2))
+        assert [len(chunk) for chunk in written] == [100] * 10
+        assert pipeline.stats["writer"]["batches"] == 10
+
+    def test_drops_filtered_rows(self):
+        written = []
+        pipeline = Pipeline(
+            source=({"n": n} for n in range(10)),
+            transform=lambda row: row if row["n"] % 2 else None,
+            write=written.extend,
+            read_size=3,
+        )
+        assert pipeline.run() == 5
+        assert [r["n"] for r in written] == [1, 3, 5, 7, 9]
+
+    def test_transform_error_stops_pipeline(self):
+        def fail(row):
+            if row["n"] == 500:
+                raise ValueError("bad row")
+            return row
+
+        pipeline = Pipeline(
+            source=({"n": n} for n in range(100000)),
+            transform=fail,
+            write=lambda rows: None,
+            read_size=10,
+            transformers=2,
+        )
+        with pytest.raises(PipelineError, match="bad row"):
+            pipeline.run()
+
+    def test_write_error_stops_pipeline(self):
+        def fail(rows):
+            raise RuntimeError("database unavailable")
+
+        pipeline = Pipeline(
+            source=({"n": n} for n in range(100000)),
+            transform=lambda row: row,
+            write=fail,
+            read_size=10,
+            write_size=10,
+        )
+        with pytest.raises(PipelineError, match="database unavailable"):
+            pipeline.run()
+        assert pipeline.writer_stats.rows == 0
+
+    def test_checkpoints_follow_committed_batches(self):
+        checkpoints = []
+
+        def write(rows):
+            if rows[0]["n"] >= 50 and fail:
+                raise RuntimeError("database unavailable")
+
+        pipeline_args = dict(
+            transform=lambda row: row if row["n"] < 95 else None,
+            write=write,
+            read_size=10,
+            write_size=25,
+            checkpoint=checkpoints.append,
+        )
+
+        fail = True
+        with pytest.raises(PipelineError):
+            Pipeline(source=({"n": n} for n in range(100)), **pipeline_args).run()
+        assert checkpoints == [20, 50]
+
+        fail = False
+        checkpoints.clear()
+        Pipeline(source=({"n": n} for n in range(100)), **pipeline_args).run()
+        assert checkpoints == [20, 50, 70, 100]
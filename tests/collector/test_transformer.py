@@ -0,0 +1,46 @@
+# pylint: disable=missing-function-docstring,missing-module-docstring,no-self-use
+from datetime import datetime
+
+import pytest  # noqa
+
+from collector.transformer import Transformer, row_hash
+
+ROW = {
+    "api14": "42461409160000",
+    "job_start_date": datetime(2014, 9, 11),
+    "ingredient_mass": 7469522,
+    "lat": 28.439819444,
+    "ingredient_comment": None,
+}
+
+
+class TestRowHash:
+    def test_independent_of_key_order(self):
+        assert row_hash(ROW) == row_hash(dict(reversed(list(ROW.items()))))
+
+    @pytest.mark.parametrize(
+        "key,value",
+        [("ingredient_mass", 7469523), ("lat", 28.43982), ("ingredient_comment", "")],
+    )
+    def test_changes_with_content(self, key, value):
+        assert row_hash(ROW) != row_hash({**ROW, key: value})
+
+
+class TestRegexParsing:
+    def test_dates_detected_per_column(self):
+        columns = ["job_start_date", "job_end_date"]
+        transformer = Transformer(aliases={k: k for k in columns}, mode="regex")
+        row = transformer.transform(
+            {"job_start_date": "9/11/2014 12:00:00 AM", "job_end_date": "2014-09-25"}
+        )
+        assert row == {
+            "job_start_date": datetime(2014, 9, 11),
+            "job_end_date": datetime(2014, 9, 25),
+        }
+
+        date_parsers = transformer.parser.parsers[0].date_parsers
+        assert {k: date_parsers[k].fmt for k in columns} == {
+            "job_start_date": "M/D/YYYY h:mm:ss AM",
+            "job_end_date": "ISO 8601",
+        }
+        assert all(date_parsers[k].fallbacks == 0 for k in columns)
@@ -6,6 +6,7 @@ from datetime import datetime
 from requests_mock import ANY
 
 import util
+from util.dt import DateParser, parse_mdy
 
 expected_url = "https://api.example.com/v3/path/to/endpoint"
 
@@ -26,3 +27,47 @@ class TestTokenManager:
         path = "path/to/endpoint"
         assert util.urljoin(url, path) == expected_url
 
+
+class TestDateParser:
+    @pytest.mark.parametrize(
+        "value,expected",
+        [
+            ("9/11/2014 12:00:00 AM", datetime(2014, 9, 11, 0, 0)),
+            ("9/25/2014 5:00:00 AM", datetime(2014, 9, 25, 5, 0)),
+            ("12/1/2019 12:30:15 PM", datetime(2019, 12, 1, 12, 30, 15)),
+            ("12/1/2019 11:59:00 PM", datetime(2019, 12, 1, 23, 59)),
+            ("12/1/2019 23:59:00", datetime(2019, 12, 1, 23, 59)),
+            ("1/2/2019", datetime(2019, 1, 2)),
+        ],
+    )
+    def test_parse_mdy(self, value, expected):
+        assert parse_mdy(value) == expected
+
+    @pytest.mark.parametrize("value", ["9/11/14", "13:00:00 PM", "2014-09-11"])
+    def test_parse_mdy_rejects(self, value):
+        with pytest.raises(ValueError):
+            parse_mdy(value)
+
+    def test_detects_format_and_memoizes(self):
+        parser = DateParser()
+        assert parser("9/11/2014 12:00:00 AM") == datetime(2014, 9, 11)
+        assert parser("9/11/2014 12:00:00 AM") == datetime(2014, 9, 11)
+
+        assert parser.fmt == "M/D/YYYY h:mm:ss AM"
+        assert parser.parse.cache_info().hits == 1
+        assert parser.fallbacks == 0
+
+    def test_falls_back_to_dateutil(self):
+        parser = DateParser()
+        parser("2014-09-11")
+        assert parser("Sep 11, 2014") == datetime(2014, 9, 11)
+        assert parser.fmt == "ISO 8601"
+        assert parser.fallbacks == 1
+
+    def test_unparseable(self):
+        parser = DateParser(sample_size=1)
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                parser("Texas")
+        assert parser.fallbacks == 1
+        assert parser.fmt is None